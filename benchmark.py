@@ -0,0 +1,281 @@
+"""Synthetic data generator and benchmark harness for driver.py.
+
+    python benchmark.py generate DIR --rows 1000000 --patients 50000 --tests 20 --skew 1.1
+    python benchmark.py run --sizes 10000 100000 1000000 --output benchmark-results.json
+
+Every operation runs in a fresh child process started in the data directory, so
+driver.py's relative medicalRecord.txt/medicalTest.txt paths point at the generated
+files and the peak RSS reported is that operation's alone.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import datetime
+import subprocess
+from itertools import accumulate
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# The standard tests: medicalTest.txt line, typical result range, turnaround in minutes
+BASE_TESTS = [
+    ("Hgb, > 13.8, < 17.2, g/dL, 00-03-04", 11.0, 20.0, 184),
+    ("BGT, > 70, < 99, mg/dL, 00-12-06", 55.0, 130.0, 726),
+    ("LDL, < 100, mg/dL, 00-12-06", 50.0, 190.0, 726),
+    ("systole, < 120, mm Hg, 00-03-04", 90.0, 170.0, 184),
+    ("diastole, < 80, mm Hg, 00-03-04", 55.0, 110.0, 184),
+]
+FIRST_PATIENT_ID = 1000000
+START_DATE = datetime.date(2020, 1, 1)
+WRITE_BATCH = 100000
+OPERATIONS = ["load", "filter_all", "filter_test", "filter_abnormal_range", "filter_patient",
+              "is_existing_test", "validate_records", "update_record"]
+# Operations that run many small calls time this many of them
+LOOKUPS = 1000
+UPDATES = 100
+
+
+def synthetic_tests(count):
+    """The standard tests followed by made-up ones up to count."""
+    tests = BASE_TESTS[:count]
+    for number in range(len(tests), count):
+        tests.append((f"T{number:04d}, > 10, < 50, mg/dL, 00-06-00", 0.0, 60.0, 360))
+    return tests
+
+
+def zipf_weights(count, skew):
+    """Cumulative weights giving rank r a share proportional to 1 / r**skew (skew 0 is uniform)."""
+    return list(accumulate(1.0 / rank ** skew for rank in range(1, count + 1)))
+
+
+def generate_data(directory, rows, patients=None, tests=5, skew=1.0, days=5 * 365, pending=0.1, seed=0):
+    """Write medicalTest.txt and medicalRecord.txt with rows random records into directory.
+
+    Patients and tests are drawn with Zipf-like skew, test times uniformly over days
+    starting at START_DATE. Records are written in batches, so memory use does not grow
+    with rows.
+    """
+    from driver import format_epoch_minutes, EPOCH_ORDINAL
+
+    patients = patients or max(1, rows // 20)
+    if not 1 <= patients <= 10 ** 7 - FIRST_PATIENT_ID:
+        raise ValueError("patients must be between 1 and 9000000")
+    rng = random.Random(seed)
+    test_rows = synthetic_tests(tests)
+    test_weights = zipf_weights(len(test_rows), skew)
+    patient_weights = zipf_weights(patients, skew)
+    patient_ids = list(range(FIRST_PATIENT_ID, FIRST_PATIENT_ID + patients))
+    rng.shuffle(patient_ids)
+    start_minute = (START_DATE.toordinal() - EPOCH_ORDINAL) * 1440
+    span = days * 1440
+
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "medicalTest.txt"), "w") as file:
+        file.writelines(line + "\n" for line, _, _, _ in test_rows)
+    with open(os.path.join(directory, "medicalRecord.txt"), "w") as file:
+        written = 0
+        while written < rows:
+            count = min(WRITE_BATCH, rows - written)
+            lines = []
+            for patient_id, (line, low, high, turnaround) in zip(
+                    rng.choices(patient_ids, cum_weights=patient_weights, k=count),
+                    rng.choices(test_rows, cum_weights=test_weights, k=count)):
+                name, _, rest = line.partition(", ")
+                unit = rest.rsplit(", ", 2)[-2]
+                test_time = start_minute + rng.randrange(span)
+                if rng.random() < pending:
+                    status, results = "Pending", ""
+                else:
+                    status = "Completed" if rng.random() < 0.7 else "Reviewed"
+                    results = format_epoch_minutes(test_time + rng.randint(15, 2 * turnaround))
+                lines.append(f"{patient_id}: {name}, {format_epoch_minutes(test_time)}, "
+                             f"{round(rng.uniform(low, high), 1)}, {unit}, {status}, {results}\n")
+            file.writelines(lines)
+            written += count
+    return rows
+
+
+def sample_keys(count, seed=1):
+    """count (patient ID, test name) pairs from the current record file, for lookups."""
+    import driver
+
+    driver.store.refresh()
+    rng = random.Random(seed)
+    records = driver.store.records
+    return [(records[i].patient_id, records[i].test_name) for i in (rng.randrange(len(records)) for _ in range(count))]
+
+
+def measure(operation):
+    """Run operation against the files in the current directory; returns (seconds, items).
+
+    Setup, such as loading the store before timing lookups, is not part of the time.
+    """
+    import driver
+
+    if operation == "load":
+        start = time.perf_counter()
+        driver.store.refresh()
+        return time.perf_counter() - start, len(driver.store.records)
+
+    filters = {
+        "filter_all": {},
+        "filter_test": {'test_name': 'LDL'},
+        "filter_abnormal_range": {'abnormal': True, 'date_range': ('2021-01-01', '2021-06-30')},
+        "filter_patient": {'patient_id': str(FIRST_PATIENT_ID)},
+    }
+    if operation in filters:
+        start = time.perf_counter()
+        summary = driver.collect_summary(filters[operation], limit=0)
+        return time.perf_counter() - start, summary.values.count
+
+    if operation == "is_existing_test":
+        keys = sample_keys(LOOKUPS)
+        start = time.perf_counter()
+        for patient_id, test_name in keys:
+            driver.is_existing_test(patient_id, test_name)
+        return time.perf_counter() - start, len(keys)
+
+    if operation == "validate_records":
+        # add_record's checks: catalog lookup, future date, status and duplicate key
+        driver.store.refresh()
+        records = [driver.MedicalRecord(FIRST_PATIENT_ID + i % 1000, 'LDL', 26000000 + i, 100.0, 'mg/dL', 'Pending')
+                   for i in range(LOOKUPS)]
+        start = time.perf_counter()
+        tests = driver.storage.tests()
+        now_minutes = driver.current_epoch_minutes()
+        existing = driver.storage.record_keys()
+        for record in records:
+            if driver.validate_record(record, tests, now_minutes) is None:
+                record.key() in existing
+        return time.perf_counter() - start, len(records)
+
+    if operation == "update_record":
+        # Rewrite records with their own values; the path is the same as an edit
+        keys = sample_keys(UPDATES)
+        driver.aggregates.refresh()
+        start = time.perf_counter()
+        for patient_id, test_name in keys:
+            for handle, record in driver.storage.find_records(patient_id, test_name)[:1]:
+                driver.storage.replace_record(handle, record, record)
+        return time.perf_counter() - start, len(keys)
+
+    raise ValueError(f"Unknown operation {operation}")
+
+
+def peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def run_measurement(operation, directory):
+    """Measure operation in a child process started in directory."""
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__), "measure", operation],
+                               cwd=directory, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"{operation} failed:\n{completed.stderr}")
+    return json.loads(completed.stdout.splitlines()[-1])
+
+
+def run_benchmarks(sizes, operations, repeat=3, patients=None, tests=5, skew=1.0, seed=0, data_dir=None,
+                   keep=False):
+    """Generate data for each size and time each operation; returns the result document."""
+    base = data_dir or tempfile.mkdtemp(prefix="medrec-bench-")
+    results = []
+    try:
+        for rows in sizes:
+            directory = os.path.join(base, str(rows))
+            start = time.perf_counter()
+            generate_data(directory, rows, patients, tests, skew, seed=seed)
+            print(f"{rows} rows generated in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+            for operation in operations:
+                runs = [run_measurement(operation, directory) for _ in range(repeat)]
+                best = min(run['seconds'] for run in runs)
+                items = runs[0]['items']
+                result = {
+                    'rows': rows,
+                    'operation': operation,
+                    'seconds': best,
+                    'runs': [run['seconds'] for run in runs],
+                    'items': items,
+                    'microseconds_per_item': best / items * 1e6 if items else None,
+                    'peak_rss_kb': max(run['peak_rss_kb'] or 0 for run in runs) or None,
+                }
+                results.append(result)
+                print(f"{rows:>10} {operation:<22} {best:10.4f}s  {result['peak_rss_kb']} KB", file=sys.stderr)
+            if not keep:
+                shutil.rmtree(directory)
+    finally:
+        if not keep and data_dir is None:
+            shutil.rmtree(base, ignore_errors=True)
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+    return {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'numpy': numpy_version,
+        'parameters': {'patients': patients, 'tests': tests, 'skew': skew, 'seed': seed, 'repeat': repeat},
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic record files and benchmark driver.py.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_data_options(command):
+        command.add_argument("--patients", type=int, help="distinct patients (default rows / 20)")
+        command.add_argument("--tests", type=int, default=5, help="distinct tests (default 5)")
+        command.add_argument("--skew", type=float, default=1.0,
+                             help="Zipf exponent for patient and test frequency, 0 for uniform (default 1.0)")
+        command.add_argument("--seed", type=int, default=0)
+
+    generate = commands.add_parser("generate", help="write medicalTest.txt and medicalRecord.txt into a directory")
+    generate.add_argument("directory")
+    generate.add_argument("--rows", type=int, required=True)
+    add_data_options(generate)
+
+    run = commands.add_parser("run", help="time each operation over several data sizes")
+    run.add_argument("--sizes", type=int, nargs="+", default=[10 ** 4, 10 ** 5, 10 ** 6],
+                     help="record counts to benchmark (default 10000 100000 1000000)")
+    run.add_argument("--operations", nargs="+", choices=OPERATIONS, default=OPERATIONS)
+    run.add_argument("--repeat", type=int, default=3, help="runs per operation; the fastest is reported")
+    run.add_argument("--output", default="benchmark-results.json")
+    run.add_argument("--data-dir", help="where to generate the data (default a temporary directory)")
+    run.add_argument("--keep", action="store_true", help="keep the generated data")
+    add_data_options(run)
+
+    measure_command = commands.add_parser("measure", help=argparse.SUPPRESS)
+    measure_command.add_argument("operation", choices=OPERATIONS)
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        generate_data(args.directory, args.rows, args.patients, args.tests, args.skew, seed=args.seed)
+    elif args.command == "run":
+        document = run_benchmarks(args.sizes, args.operations, args.repeat, args.patients, args.tests, args.skew,
+                                  args.seed, args.data_dir, args.keep)
+        with open(args.output, "w") as file:
+            json.dump(document, file, indent=2)
+        print(f"Results written to {args.output}.", file=sys.stderr)
+    else:
+        seconds, items = measure(args.operation)
+        print(json.dumps({'seconds': seconds, 'items': items, 'peak_rss_kb': peak_rss_kb()}))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
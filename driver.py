@@ -1,9 +1,134 @@
+import os
 import re
+import sys
+import csv
+import time
+import json
+import math
+import zlib
+import atexit
+import sqlite3
+import contextlib
+import asyncio
+import argparse
+import struct
+import bisect
+import calendar
 import datetime
-import statistics
+import functools
+import collections
+import cProfile
+import threading
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 # Define the file where all medical test records will be stored
 FILE = "medicalRecord.txt"
 test_file="medicalTest.txt"
+# Compact medicalRecord.txt once blanked-out rows take up this share of the file (and at least 1 MB)
+COMPACT_DEAD_FRACTION = 0.25
+COMPACT_MIN_DEAD_BYTES = 1 << 20
+# Per-patient/test and per-test/day aggregates kept next to the record file
+AGGREGATE_FILE = FILE + ".agg.json"
+# Patient timelines: moving-average window, deltas shown and patients kept in memory
+TIMELINE_WINDOW = 5
+TIMELINE_DELTAS = 5
+TIMELINE_CACHE_SIZE = 1024
+# Monthly partition files YYYY-MM.txt and their manifest (see PartitionedStorage)
+PARTITION_DIR = "medicalRecord.d"
+PARTITION_MANIFEST = "manifest.json"
+PARTITION_NAME = re.compile(r"^(\d{4}-\d{2})\.txt$")
+# How often serve consolidates finished partitions, in seconds
+PARTITION_CONSOLIDATE_INTERVAL = 3600
+# Optional fixed-width binary copy of medicalRecord.txt (see export_binary / import_binary)
+BINARY_FILE = "medicalRecord.bin"
+DATE_TIME_FORMAT = '%Y-%m-%d %H:%M'
+STATUSES = ["Pending", "Completed", "Reviewed"]
+
+
+class Profiler:
+    """Per-stage timers and counters for the record pipeline (see --profile).
+
+    Disabled by default. The hot loops ask for timed() or counted() wrappers once per
+    scan, which hand back the plain function or iterable while profiling is off, so the
+    instrumentation costs nothing unless it is switched on.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.stages = {}
+        self.counters = {}
+
+    def add_time(self, name, seconds, calls=1):
+        stage = self.stages.setdefault(name, [0, 0.0])
+        stage[0] += calls
+        stage[1] += seconds
+
+    def count(self, name, amount=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def timed(self, name, function):
+        """function, adding its calls and time to stage name while profiling."""
+        if not self.enabled:
+            return function
+        stage = self.stages.setdefault(name, [0, 0.0])
+        perf_counter = time.perf_counter
+
+        def timed_function(*args):
+            start = perf_counter()
+            try:
+                return function(*args)
+            finally:
+                stage[0] += 1
+                stage[1] += perf_counter() - start
+        return timed_function
+
+    def counted(self, name, items):
+        """items, adding how many were consumed to counter name while profiling."""
+        if not self.enabled:
+            return items
+
+        def counting():
+            consumed = 0
+            try:
+                for item in items:
+                    consumed += 1
+                    yield item
+            finally:
+                self.count(name, consumed)
+        return counting()
+
+    def report(self, file=sys.stderr):
+        print("\n--- Profile ---", file=file)
+        print(f"{'stage':<32}{'calls':>12}{'seconds':>12}", file=file)
+        for name, (calls, seconds) in self.stages.items():
+            print(f"{name:<32}{calls:>12}{seconds:>12.4f}", file=file)
+        for name, value in self.counters.items():
+            print(f"{name:<32}{value:>12}", file=file)
+
+
+profiler = Profiler()
 
 def display_menu():
     print("===============================")
@@ -14,17 +139,156 @@ def display_menu():
     print("3. Update patient records including all fields")
     print("4. Update medical tests in the medicalTest file")
     print("5. Filter medical tests")
-    print("6. Exit")
+    print("6. View a patient's timeline")
+    print("7. Exit")
     print("===============================")
     return input("Please choose an option: ")
 
+def parse_test_line(line):
+    """Split a medicalTest.txt line into name, normal range, unit and turnaround.
+
+    The normal range may itself contain ', ' (e.g. '> 13.8, < 17.2'), so the name is
+    taken from the front and the unit and turnaround time from the back of the line.
+    """
+    fields = line.strip().split(', ')
+    if len(fields) < 4:
+        raise ValueError(f"Malformed test line: {line.strip()}")
+    return fields[0], ', '.join(fields[1:-2]), fields[-2], fields[-1]
+
+
+NORMAL_RANGE_BOUND = re.compile(r"^\s*(<=|>=|<|>)\s*(-?\d+(?:\.\d+)?)\s*$")
+
+
+def parse_normal_range(normal_range):
+    """Parse a normal range like '> 13.8, < 17.2' or '< 100' into its bounds.
+
+    Returns (lower, lower_inclusive, upper, upper_inclusive); a missing bound is None.
+    """
+    lower = upper = None
+    lower_inclusive = upper_inclusive = False
+    for part in normal_range.split(','):
+        match = NORMAL_RANGE_BOUND.match(part)
+        if not match:
+            raise ValueError(f"Invalid normal range: {normal_range}")
+        operator, value = match.groups()
+        if operator.startswith('>'):
+            lower, lower_inclusive = float(value), operator == '>='
+        else:
+            upper, upper_inclusive = float(value), operator == '<='
+    return lower, lower_inclusive, upper, upper_inclusive
+
+
+def compile_normal_range(normal_range):
+    """Turn a normal range spec into a predicate that returns True for normal values."""
+    lower, lower_inclusive, upper, upper_inclusive = parse_normal_range(normal_range)
+    lower = float('-inf') if lower is None else lower
+    upper = float('inf') if upper is None else upper
+    if lower_inclusive and upper_inclusive:
+        return lambda value: lower <= value <= upper
+    if lower_inclusive:
+        return lambda value: lower <= value < upper
+    if upper_inclusive:
+        return lambda value: lower < value <= upper
+    return lambda value: lower < value < upper
+
+
+def build_test_entries(lines):
+    """Parse medicalTest.txt lines into a dict of test entries keyed by upper-cased name."""
+    tests = {}
+    for line in lines:
+        try:
+            test_name, normal_range, result_unit, turnaround_time = parse_test_line(line)
+        except ValueError:
+            print(f"Skipping malformed test: {line}")
+            profiler.count("malformed tests")
+            continue
+        try:
+            bounds = parse_normal_range(normal_range)
+            is_normal = compile_normal_range(normal_range)
+        except ValueError:
+            print(f"Unrecognised normal range for {test_name}: {normal_range}")
+            bounds = is_normal = None
+        try:
+            turnaround_minutes = parse_turnaround_time(turnaround_time)
+        except ValueError:
+            print(f"Unrecognised turnaround time for {test_name}: {turnaround_time}")
+            turnaround_minutes = None
+        tests[test_name.upper()] = {
+            'name': test_name,
+            'normal_range': normal_range,
+            'unit': result_unit,
+            'turnaround': turnaround_time,
+            'turnaround_minutes': turnaround_minutes,
+            'bounds': bounds,
+            'is_normal': is_normal,
+        }
+    return tests
+
+
+class TestCatalog:
+    """The medicalTest.txt catalog, parsed once and keyed by upper-cased test name.
+
+    The file is only re-read when its modification time or size changes, so lookups
+    from the record loops cost a dict access instead of a file scan.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._stamp = None
+        self._lines = []
+        self._tests = {}
+
+    def _current_stamp(self):
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def refresh(self):
+        stamp = self._current_stamp()
+        if stamp is not None and stamp == self._stamp:
+            return
+        with profiler.stage("load catalog"):
+            lines = []
+            if stamp is not None:
+                with open(self.file_path, "r") as file:
+                    lines = [line.strip() for line in file if line.strip()]
+            self._stamp = stamp
+            self._lines = lines
+            self._tests = build_test_entries(lines)
+
+    def invalidate(self):
+        self._stamp = None
+
+    def tests(self):
+        """Refresh once and return the name -> test mapping, for use inside record loops."""
+        self.refresh()
+        return self._tests
+
+    def lines(self):
+        self.refresh()
+        return list(self._lines)
+
+    def get(self, test_name):
+        self.refresh()
+        return self._tests.get(test_name.upper())
+
+    def __contains__(self, test_name):
+        return self.get(test_name) is not None
+
+
+catalog = TestCatalog(test_file)
+
+
 def is_valid_test_name(test_name):
-    with open(test_file, "r") as file:
-        for line in file:
-            stored_test_name = line.strip().split(', ')[0]
-            if test_name == stored_test_name:
-                return True
-    return False
+    return test_name.upper() in storage.tests()
+
+def parse_turnaround_time(turnaround_time):
+    """Convert a 'DD-hh-mm' turnaround time into minutes."""
+    days, hours, minutes = map(int, turnaround_time.split('-'))
+    return (days * 24 + hours) * 60 + minutes
+
 
 def validate_turnaround_time(days, hours, minutes):
     if days < 0 or days > 31:
@@ -38,325 +302,3173 @@ def validate_turnaround_time(days, hours, minutes):
         return False
     return True
 
-def is_existing_test(patient_id, test_name):
-    try:
-        with open(FILE, "r") as file:
-            for line in file:
-                try:
-                    line_patient_id, rest_of_line = line.split(": ", 1)
-                    line_test_name = rest_of_line.split(", ")[0]
-                    if line_patient_id.strip() == patient_id and line_test_name.strip().upper() == test_name.upper():
-                        return True
-                except ValueError:
-                    print(f"Skipping malformed line: {line.strip()}")
-                    continue
-    except FileNotFoundError:
-        print("Medical record file not found.")
-        return False
-    return False
+EPOCH = datetime.datetime(1970, 1, 1)
+EPOCH_ORDINAL = EPOCH.toordinal()
 
-def is_future_date(test_date_time):
-    try:
-        test_datetime = datetime.datetime.strptime(test_date_time, '%Y-%m-%d %H:%M')
-        current_datetime = datetime.datetime.now()
-        return test_datetime > current_datetime
-    except ValueError:
-        print("Invalid date and time format. Must be YYYY-MM-DD hh:mm.")
-        return False
 
-def load_records(file_path):
-    records = []
-    try:
-        with open(file_path, "r") as file:
-            for line in file:
-                records.append(line.strip())
-    except FileNotFoundError:
-        print(f"File {file_path} not found.")
-    return records
+@functools.lru_cache(maxsize=8192)
+def epoch_day_minutes(date):
+    """Minutes from the epoch to midnight of a 'YYYY-MM-DD' date.
 
-def save_records(file_path, records):
-    with open(file_path, "w") as file:
-        for record in records:
-            file.write(record + "\n")
+    Cached, since lab timestamps cluster heavily on the same days.
+    """
+    if len(date) == 10 and date[4] == '-' and date[7] == '-':
+        parsed = datetime.date(int(date[:4]), int(date[5:7]), int(date[8:]))
+    else:
+        parsed = datetime.datetime.strptime(date, '%Y-%m-%d')
+    return (parsed.toordinal() - EPOCH_ORDINAL) * 1440
 
-def load_test_records(file_path):
-    tests = []
-    try:
-        with open(file_path, "r") as file:
-            for line in file:
-                tests.append(line.strip())
-    except FileNotFoundError:
-        print(f"File {file_path} not found.")
-    return tests
 
-def update_test(file_path):
-    tests = load_test_records(file_path)
-    if not tests:
-        print("No tests available to update.")
-        return
-    print("Available Tests:")
-    for i, test in enumerate(tests, 1):
-        print(f"{i}. {test}")
-    while True:
+def to_epoch_minutes(date_time):
+    """Convert a 'YYYY-MM-DD hh:mm' string to minutes since the Unix epoch.
+
+    The fixed layout is sliced directly; anything else goes through strptime, which
+    raises ValueError for invalid input.
+    """
+    if len(date_time) == 16 and date_time[10] == ' ' and date_time[13] == ':':
+        hours, minutes = date_time[11:13], date_time[14:]
+        if hours.isdigit() and minutes.isdigit() and int(hours) < 24 and int(minutes) < 60:
+            return epoch_day_minutes(date_time[:10]) + int(hours) * 60 + int(minutes)
+    parsed = datetime.datetime.strptime(date_time, DATE_TIME_FORMAT)
+    return calendar.timegm(parsed.timetuple()) // 60
+
+
+def current_epoch_minutes():
+    """The local time now, in the same epoch minutes as to_epoch_minutes."""
+    now = datetime.datetime.now()
+    return (now.toordinal() - EPOCH_ORDINAL) * 1440 + now.hour * 60 + now.minute
+
+
+@functools.lru_cache(maxsize=8192)
+def format_epoch_day(day):
+    return (EPOCH + datetime.timedelta(days=day)).strftime('%Y-%m-%d')
+
+
+def format_epoch_minutes(minutes):
+    day, minute_of_day = divmod(minutes, 1440)
+    return f"{format_epoch_day(day)} {minute_of_day // 60:02d}:{minute_of_day % 60:02d}"
+
+
+class MedicalRecord:
+    """One line of medicalRecord.txt with its fields already converted.
+
+    Times are minutes since the epoch (results_time is None while there is no result),
+    the turnaround in minutes is computed once on construction and the repeated
+    strings (test name, unit, status) are interned.
+    """
+
+    __slots__ = ('patient_id', 'test_name', 'test_time', 'result', 'unit', 'status', 'results_time', 'turnaround')
+
+    def __init__(self, patient_id, test_name, test_time, result, unit, status, results_time=None):
+        self.patient_id = patient_id
+        self.test_name = test_name
+        self.test_time = test_time
+        self.result = result
+        self.unit = unit
+        self.status = status
+        self.results_time = results_time
+        self.turnaround = None if results_time is None else results_time - test_time
+
+    def key(self):
+        return self.patient_id, self.test_name.upper(), self.test_time
+
+    def fields(self):
+        return (self.patient_id, self.test_name, self.test_time, self.result, self.unit, self.status,
+                self.results_time)
+
+    def format(self):
+        results_date_time = '' if self.results_time is None else format_epoch_minutes(self.results_time)
+        return (f"{self.patient_id:07d}: {self.test_name}, {format_epoch_minutes(self.test_time)}, "
+                f"{self.result}, {self.unit}, {self.status}, {results_date_time}")
+
+    def to_dict(self):
+        return {
+            'patient_id': f"{self.patient_id:07d}",
+            'test_name': self.test_name,
+            'test_date_time': format_epoch_minutes(self.test_time),
+            'result': self.result,
+            'unit': self.unit,
+            'status': self.status,
+            'results_date_time': None if self.results_time is None else format_epoch_minutes(self.results_time),
+        }
+
+    def __repr__(self):
+        return f"MedicalRecord({self.format()!r})"
+
+
+def record_from_fields(patient_id, test_name, test_date_time, result, result_unit, status, results_date_time=''):
+    """Build a MedicalRecord from the text fields of a record, raising ValueError if invalid."""
+    patient_id = int(patient_id)
+    if not 0 <= patient_id <= 9999999:
+        raise ValueError(f"Invalid Patient ID {patient_id}. Must be a 7-digit integer.")
+    return MedicalRecord(
+        patient_id,
+        sys.intern(test_name),
+        to_epoch_minutes(test_date_time),
+        float(result),
+        sys.intern(result_unit),
+        sys.intern(status.capitalize()),
+        to_epoch_minutes(results_date_time) if results_date_time else None,
+    )
+
+
+def parse_record(line):
+    """Parse a medicalRecord.txt line into a MedicalRecord, raising ValueError if malformed."""
+    patient_id, details = line.split(": ", 1)
+    fields = [field.strip() for field in details.split(",")]
+    if len(fields) < 5:
+        raise ValueError(f"Malformed record: {line.strip()}")
+    return record_from_fields(patient_id, *fields[:6])
+
+
+# results_time of a record without a result, in typed columns
+MISSING_TIME = -1
+
+
+class RecordTable:
+    """MedicalRecords kept column-wise in typed arrays, about 40 bytes per row.
+
+    Test names, units and statuses are stored as codes into one shared string table;
+    indexing builds a MedicalRecord on the fly, so the table can stand in for a list
+    of records.
+    """
+
+    def __init__(self):
+        self.patient_id = array('i')
+        self.test_name = array('I')
+        self.test_time = array('q')
+        self.result = array('d')
+        self.unit = array('I')
+        self.status = array('I')
+        self.results_time = array('q')
+        self.strings = []
+        self.codes = {}
+
+    def _code(self, string):
+        code = self.codes.get(string)
+        if code is None:
+            code = self.codes[string] = len(self.strings)
+            self.strings.append(string)
+        return code
+
+    def append(self, record):
+        codes = self.codes
+        self.patient_id.append(record.patient_id)
+        self.test_name.append(codes.get(record.test_name) if record.test_name in codes else self._code(record.test_name))
+        self.test_time.append(record.test_time)
+        self.result.append(record.result)
+        self.unit.append(codes.get(record.unit) if record.unit in codes else self._code(record.unit))
+        self.status.append(codes.get(record.status) if record.status in codes else self._code(record.status))
+        self.results_time.append(MISSING_TIME if record.results_time is None else record.results_time)
+
+    def __setitem__(self, position, record):
+        self.patient_id[position] = record.patient_id
+        self.test_name[position] = self._code(record.test_name)
+        self.test_time[position] = record.test_time
+        self.result[position] = record.result
+        self.unit[position] = self._code(record.unit)
+        self.status[position] = self._code(record.status)
+        self.results_time[position] = MISSING_TIME if record.results_time is None else record.results_time
+
+    def __getitem__(self, position):
+        strings = self.strings
+        results_time = self.results_time[position]
+        return MedicalRecord(self.patient_id[position], strings[self.test_name[position]],
+                             self.test_time[position], self.result[position], strings[self.unit[position]],
+                             strings[self.status[position]], None if results_time == MISSING_TIME else results_time)
+
+    def __len__(self):
+        return len(self.patient_id)
+
+    def __iter__(self):
+        return (self[position] for position in range(len(self)))
+
+    def test_codes(self, test_name):
+        """The string codes spelling test_name in any case."""
+        test_name = test_name.upper()
+        return {code for code, string in enumerate(self.strings) if string.upper() == test_name}
+
+    def columns(self, tests):
+        """The table as RecordColumns, converted array by array rather than row by row."""
+        raw_codes = np.frombuffer(self.test_name, dtype=np.uint32)
+        name_codes = {}
+        code_map = np.zeros(len(self.strings), dtype=np.uint32)
+        for code in np.unique(raw_codes).tolist():
+            code_map[code] = name_codes.setdefault(self.strings[code].upper(), len(name_codes))
+        test_names = list(name_codes)
+        status_map = np.array([STATUS_CODES.get(string, UNKNOWN_STATUS) for string in self.strings] or [0],
+                              dtype=np.uint8)
+        return RecordColumns(
+            test_names,
+            np.frombuffer(self.patient_id, dtype=np.int32).copy(),
+            code_map[raw_codes],
+            np.frombuffer(self.test_time, dtype=np.int64).copy(),
+            np.frombuffer(self.results_time, dtype=np.int64).copy(),
+            np.frombuffer(self.result, dtype=np.float64).copy(),
+            status_map[np.frombuffer(self.status, dtype=np.uint32)],
+            tests,
+        )
+
+
+# Sorted index keys pack (value, position) into one integer: value * POSITION_SPAN + position
+POSITION_SPAN = 1 << 30
+
+
+class RecordChangedError(ValueError):
+    """The record to update was changed or removed by someone else since it was read."""
+
+
+class FileLock:
+    """An exclusive flock on file_path + ".lock", held by one process (and thread) at a time.
+
+    Re-entrant, so a method holding it can call others that take it too. Without fcntl
+    only the threads of this process are kept apart.
+    """
+
+    def __init__(self, file_path):
+        self.path = file_path + ".lock"
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            self._file = open(self.path, "a")
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if self._depth == 0 and self._file is not None:
+            # Closing the file releases the flock
+            self._file.close()
+            self._file = None
+        self._lock.release()
+
+
+def append_lines(file_path, lines):
+    """Append encoded lines with one write and one fsync; returns the first line's byte offset.
+
+    A missing final newline is added first, so the lines always start a new line.
+    """
+    with open(file_path, "a+b") as file:
+        offset = file.seek(0, os.SEEK_END)
+        if offset:
+            file.seek(offset - 1)
+            if file.read(1) != b"\n":
+                file.write(b"\n")
+                offset += 1
+        file.write(b"\n".join(lines) + b"\n")
+        file.flush()
+        os.fsync(file.fileno())
+    return offset
+
+
+def write_at(file_path, offset, data):
+    with open(file_path, "r+b") as file:
+        file.seek(offset)
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def replace_line(file_path, offset, length, line, append_path=None):
+    """Replace the length-byte line at offset of file_path with the encoded line.
+
+    The line is overwritten in place, padded with spaces, if it fits and append_path
+    (default file_path) is the same file; otherwise it is appended to append_path and
+    the old line blanked. Returns the appended line's offset, or None if it was written
+    in place.
+    """
+    if append_path is None:
+        append_path = file_path
+    if append_path == file_path and len(line) <= length:
+        write_at(file_path, offset, line.ljust(length))
+        return None
+    # Append first so a crash in between leaves the old row rather than no row
+    new_offset = append_lines(append_path, [line])
+    write_at(file_path, offset, b" " * length)
+    return new_offset
+
+
+class RecordStore:
+    """medicalRecord.txt loaded once into a RecordTable, with hash indexes on patient ID
+    and test name and sorted test time and turnaround indexes for ranges.
+
+    Every record also remembers the byte offset and length of its line, so an update
+    rewrites that line in place (padded with spaces) or, when the new line is longer,
+    appends it and blanks the old one. Blank lines are skipped by every reader and are
+    dropped in batches by compact(). The indexes are maintained incrementally; the
+    whole file is only re-read when it was changed behind the store's back. Index
+    entries are typed arrays of positions, and the sorted ones hold packed
+    value * POSITION_SPAN + position keys.
+
+    Writes hold lock, which other processes using the store take too; hold it yourself
+    from looking a record up to replacing it, and locate() it again before writing.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.binary_path = os.path.splitext(file_path)[0] + ".bin"
+        self.lock = FileLock(file_path)
+        self._stamp = None
+        self.records = RecordTable()
+        self.offsets = array('q')
+        self.lengths = array('I')
+        self.dead_bytes = 0
+        self.by_patient = {}
+        self.by_test = {}
+        self.by_time = array('q')
+        self.by_turnaround = array('q')
+        self._columns = None
+        self._columns_tests = None
+        self._load_lock = threading.Lock()
+
+    def _current_stamp(self):
         try:
-            choice = int(input("Select the test number to update: "))
-            if 1 <= choice <= len(tests):
-                selected_test = tests[choice - 1]
-                break
-            else:
-                print("Invalid selection. Please choose a valid test number.")
-        except ValueError:
-            print("Invalid input. Please enter a number.")
-    test_name, normal_range, result_unit, turnaround_time = selected_test.split(', ')
-    print("Leave field blank to keep the current value.")
-    new_test_name = input(f"Enter new Test Name (current: {test_name}): ").strip() or test_name
-    new_normal_range = input(f"Enter new Normal Range (current: {normal_range}): ").strip() or normal_range
-    new_result_unit = input(f"Enter new Result Unit (current: {result_unit}): ").strip() or result_unit
-    while True:
-        new_turnaround_time = input(f"Enter new Turnaround Time (current: {turnaround_time}, format DD-hh-mm): ").strip() or turnaround_time
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _index(self, position, record):
+        self._columns = None
+        self.by_patient.setdefault(record.patient_id, array('I')).append(position)
+        self.by_test.setdefault(record.test_name.upper(), array('I')).append(position)
+        bisect.insort(self.by_time, record.test_time * POSITION_SPAN + position)
+        if record.turnaround is not None:
+            bisect.insort(self.by_turnaround, record.turnaround * POSITION_SPAN + position)
+
+    def _unindex(self, position, record):
+        self.by_patient[record.patient_id].remove(position)
+        self.by_test[record.test_name.upper()].remove(position)
+        del self.by_time[bisect.bisect_left(self.by_time, record.test_time * POSITION_SPAN + position)]
+        if record.turnaround is not None:
+            del self.by_turnaround[bisect.bisect_left(self.by_turnaround,
+                                                      record.turnaround * POSITION_SPAN + position)]
+
+    def refresh(self):
+        stamp = self._current_stamp()
+        if stamp is not None and stamp == self._stamp:
+            return
+        # Threads reading at the same time (serve) load the file once
+        with self._load_lock:
+            stamp = self._current_stamp()
+            if stamp is not None and stamp == self._stamp:
+                return
+            with profiler.stage("load records"):
+                self._load(stamp)
+
+    def _load(self, stamp):
+        # A binary copy exported from exactly this version of the file saves parsing it
+        loaded = None if stamp is None else read_binary_table(self.binary_path, stamp)
+        if loaded is not None:
+            records, offsets, lengths, dead_bytes = loaded
+        else:
+            records = RecordTable()
+            offsets = array('q')
+            lengths = array('I')
+            dead_bytes = 0
+            if stamp is not None:
+                add = records.append
+                for offset, length, record in read_record_lines(self.file_path):
+                    if record is None:
+                        dead_bytes += length
+                    else:
+                        add(record)
+                        offsets.append(offset)
+                        lengths.append(length)
+        by_patient = {}
+        by_test = {}
+        upper_strings = [string.upper() for string in records.strings]
+        for position, (patient_id, test_code) in enumerate(zip(records.patient_id, records.test_name)):
+            by_patient.setdefault(patient_id, array('I')).append(position)
+            by_test.setdefault(upper_strings[test_code], array('I')).append(position)
+        by_time = array('q', sorted(test_time * POSITION_SPAN + position
+                                    for position, test_time in enumerate(records.test_time)))
+        by_turnaround = array('q', sorted(
+            (results_time - test_time) * POSITION_SPAN + position
+            for position, (test_time, results_time) in enumerate(zip(records.test_time, records.results_time))
+            if results_time != MISSING_TIME))
+        self.records, self.offsets, self.lengths, self.dead_bytes = records, offsets, lengths, dead_bytes
+        self.by_patient, self.by_test, self.by_time, self.by_turnaround = by_patient, by_test, by_time, by_turnaround
+        self._columns = None
+        self._stamp = stamp
+
+    def columns(self, tests):
+        """The records as RecordColumns (row i is position i), built once per change."""
+        self.refresh()
+        if self._columns is None or self._columns_tests is not tests:
+            self._columns = self.records.columns(tests)
+            self._columns_tests = tests
+        return self._columns
+
+    def is_current(self):
+        return self._stamp is not None and self._stamp == self._current_stamp()
+
+    def find(self, patient_id, test_name):
+        """Positions of the records for one patient and test name."""
+        self.refresh()
+        codes = self.records.test_codes(test_name)
+        test_names = self.records.test_name
+        return [position for position in self.by_patient.get(patient_id, ()) if test_names[position] in codes]
+
+    @staticmethod
+    def _key_range(keys, value_range):
+        start = bisect.bisect_left(keys, value_range[0] * POSITION_SPAN)
+        end = bisect.bisect_left(keys, (value_range[1] + 1) * POSITION_SPAN)
+        return [key % POSITION_SPAN for key in keys[start:end]]
+
+    def candidates(self, patient_id=None, test_name=None, time_range=None, turnaround_range=None):
+        """Positions that may match the given criteria, taken from the most selective index.
+
+        The other criteria still have to be checked against each record.
+        """
+        self.refresh()
+        choices = []
+        if patient_id is not None:
+            choices.append(self.by_patient.get(patient_id, ()))
+        if test_name is not None:
+            choices.append(self.by_test.get(test_name.upper(), ()))
+        if time_range is not None:
+            choices.append(self._key_range(self.by_time, time_range))
+        if turnaround_range is not None:
+            choices.append(self._key_range(self.by_turnaround, turnaround_range))
+        if not choices:
+            return range(len(self.records))
+        return sorted(min(choices, key=len))
+
+    def line_at(self, position):
+        """The raw line (without trailing whitespace) currently holding the record at position."""
+        with open(self.file_path, "rb") as file:
+            file.seek(self.offsets[position])
+            return file.read(self.lengths[position]).rstrip()
+
+    def _holds(self, position, fields):
         try:
-            days, hours, minutes = map(int, new_turnaround_time.split('-'))
+            return parse_record(self.line_at(position).decode()).fields() == fields
         except ValueError:
-            print("Invalid format. Must be in format DD-hh-mm. Please try again.")
-            continue
-        if validate_turnaround_time(days, hours, minutes):
-            break
-        else:
-            print("Invalid turnaround time. Please ensure days (0-31), hours (0-23), and minutes (0-59) are correct.")
-    tests[choice - 1] = f"{new_test_name}, {new_normal_range}, {new_result_unit}, {new_turnaround_time}"
-    save_records(file_path, tests)
-    print("Test updated successfully.")
+            return False
 
-def add_record():
-    while True:
-        patient_id = input("Enter Patient ID (7-digit integer): ")
-        if not patient_id.isdigit() or len(patient_id) != 7:
-            print("Invalid Patient ID. Must be a 7-digit integer. Please try again.")
-            continue
-        break
-    while True:
-        test_name = input("Enter Test Name (e.g., 'Hgb', 'BGT', 'LDL', 'systole', 'diastole'): ").upper()
-        if not is_valid_test_name(test_name):
-            print("Invalid Test Name. Please try again.")
-            continue
-        break
-    while True:
-        test_date_time = input("Enter Test Date and Time (format YYYY-MM-DD hh:mm): ")
+    def locate(self, position, record):
+        """The position of record, which was read from position earlier.
+
+        Another process may have rewritten or compacted the file since, so the line at
+        position is re-read; if it no longer holds record, the record is looked for among
+        the rows with the same key, and RecordChangedError is raised when it is gone.
+        Call it with lock held, so the answer stays true until the write.
+        """
+        self.refresh()
+        fields = record.fields()
+        if position < len(self.records) and self._holds(position, fields):
+            return position
+        for candidate in self.find(record.patient_id, record.test_name):
+            if self.records.test_time[candidate] == record.test_time and self._holds(candidate, fields):
+                return candidate
+        raise RecordChangedError(f"Record {record.format()!r} was changed or removed by someone else.")
+
+    def append_many(self, records):
+        """Append a batch of records with one write and one fsync.
+
+        The indexes are extended only if the store is already loaded; otherwise the
+        records are just written and picked up by the next refresh.
+        """
+        lines = [record.format().encode() for record in records]
+        if not lines:
+            return
+        with self.lock:
+            current = self.is_current()
+            offset = append_lines(self.file_path, lines)
+            if not current:
+                return
+            for record, line in zip(records, lines):
+                position = len(self.records)
+                self.offsets.append(offset)
+                self.lengths.append(len(line))
+                self.records.append(record)
+                self._index(position, record)
+                offset += len(line) + 1
+            self._stamp = self._current_stamp()
+
+    def replace(self, position, record):
+        """Overwrite the record at position, touching only its own line (plus an append).
+
+        position must be current: take lock and locate() the record first.
+        """
+        with self.lock:
+            self.refresh()
+            line = record.format().encode()
+            new_offset = replace_line(self.file_path, self.offsets[position], self.lengths[position], line)
+            if new_offset is not None:
+                self.dead_bytes += self.lengths[position] + 1
+                self.offsets[position] = new_offset
+                self.lengths[position] = len(line)
+            self._unindex(position, self.records[position])
+            self.records[position] = record
+            self._index(position, record)
+            self._stamp = self._current_stamp()
+            if self.dead_bytes > max(COMPACT_MIN_DEAD_BYTES, self._stamp[1] * COMPACT_DEAD_FRACTION):
+                self.compact()
+
+    def compact(self):
+        """Drop blanked-out lines and padding by writing a new file and renaming it into place.
+
+        Positions stay valid; only the stored offsets and lengths change.
+        """
+        with self.lock:
+            self.refresh()
+            temp_path = self.file_path + ".tmp"
+            new_offsets = {}
+            with open(self.file_path, "rb") as source, open(temp_path, "wb") as target:
+                offset = new_offset = 0
+                for raw_line in source:
+                    line = raw_line.rstrip()
+                    if line:
+                        new_offsets[offset] = new_offset, len(line)
+                        target.write(line + b"\n")
+                        new_offset += len(line) + 1
+                    offset += len(raw_line)
+                target.flush()
+                os.fsync(target.fileno())
+            os.replace(temp_path, self.file_path)
+            for position, offset in enumerate(self.offsets):
+                self.offsets[position], self.lengths[position] = new_offsets[offset]
+            self.dead_bytes = 0
+            self._stamp = self._current_stamp()
+
+
+store = RecordStore(FILE)
+
+
+def line_checksum(line):
+    return zlib.crc32(line.strip())
+
+
+class AggregateCache:
+    """count, sum, sum of squares, min, max and abnormal count per (patient, test) and
+    per (test, day), persisted in AGGREGATE_FILE.
+
+    The cache records a checksum of medicalRecord.txt: the number of non-blank lines
+    and the sum of their CRC32s, which is independent of line order, padding and
+    blank lines, so it can be updated per line and survives compaction. When the
+    file's size or mtime no longer match, the checksum is recomputed and the
+    aggregates are rebuilt if it differs. Writers call add/replace only while the
+    aggregates are loaded and current (is_current()); otherwise they leave them alone
+    and the next summary's refresh() notices the changed checksum and rebuilds. Changes
+    are written back on exit.
+    """
+
+    def __init__(self, file_path, record_file, record_store):
+        self.file_path = file_path
+        self.record_file = record_file
+        self.record_store = record_store
+        self.loaded = False
+        self.dirty = False
+        self.checksum = [0, 0]
+        self.file_stamp = None
+        self.catalog_checksum = None
+        self.by_patient_test = {}
+        self.by_test_day = {}
+
+    def _file_stamp(self):
         try:
-            datetime.datetime.strptime(test_date_time, '%Y-%m-%d %H:%M')
-            if is_future_date(test_date_time):
-                print("The test date cannot be in the future. Please try again.")
+            stat = os.stat(self.record_file)
+        except FileNotFoundError:
+            return None
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def _file_checksum(self):
+        checksum = [0, 0]
+        try:
+            with open(self.record_file, "rb") as file:
+                for line in file:
+                    if line.strip():
+                        checksum[0] += 1
+                        checksum[1] = (checksum[1] + line_checksum(line)) % (1 << 64)
+        except FileNotFoundError:
+            pass
+        return checksum
+
+    def _catalog_checksum(self):
+        return zlib.crc32("\n".join(catalog.lines()).encode())
+
+    def is_current(self):
+        """Whether the aggregates describe the record file and catalog as they are.
+
+        Loads the saved aggregates first if need be, but never rebuilds them, so a writer
+        can tell cheaply whether to bring them along (see add and replace).
+        """
+        if not self.loaded:
+            self._load()
+        return (self.loaded and self.file_stamp == self._file_stamp()
+                and self.catalog_checksum == self._catalog_checksum())
+
+    def refresh(self):
+        """Make sure the aggregates describe the current record file and test catalog."""
+        stamp = self._file_stamp()
+        catalog_checksum = self._catalog_checksum()
+        if self.loaded and stamp == self.file_stamp and catalog_checksum == self.catalog_checksum:
+            return
+        if not self.loaded:
+            self._load()
+            if self.loaded and stamp == self.file_stamp and catalog_checksum == self.catalog_checksum:
+                return
+        if self.loaded and catalog_checksum == self.catalog_checksum and self._file_checksum() == self.checksum:
+            self.file_stamp = stamp
+            self.dirty = True
+            return
+        self.rebuild()
+
+    def _load(self):
+        try:
+            with open(self.file_path, "r") as file:
+                data = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return
+        self.checksum = data['checksum']
+        self.file_stamp = data['file_stamp']
+        self.catalog_checksum = data['catalog_checksum']
+        self.by_patient_test = {tuple(key.split('|', 1)): value for key, value in data['by_patient_test'].items()}
+        self.by_test_day = {tuple(key.split('|', 1)): value for key, value in data['by_test_day'].items()}
+        self.loaded = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        data = {
+            'checksum': self.checksum,
+            'file_stamp': self.file_stamp,
+            'catalog_checksum': self.catalog_checksum,
+            'by_patient_test': {'|'.join(key): value for key, value in self.by_patient_test.items()},
+            'by_test_day': {'|'.join(key): value for key, value in self.by_test_day.items()},
+        }
+        temp_path = self.file_path + ".tmp"
+        with open(temp_path, "w") as file:
+            json.dump(data, file)
+        os.replace(temp_path, self.file_path)
+        self.dirty = False
+
+    def rebuild(self):
+        self.checksum = [0, 0]
+        self.by_patient_test = {}
+        self.by_test_day = {}
+        tests = catalog.tests()
+        for line in read_lines(self.record_file):
+            self._add_line(line.encode())
+            try:
+                record = parse_record(line)
+            except ValueError:
+                continue
+            self._add_record(record, tests)
+        self.file_stamp = self._file_stamp()
+        self.catalog_checksum = self._catalog_checksum()
+        self.loaded = True
+        self.dirty = True
+
+    @staticmethod
+    def _keys(record):
+        test_name = record.test_name.upper()
+        return (f"{record.patient_id:07d}", test_name), (test_name, format_epoch_day(record.test_time // 1440))
+
+    def _add_line(self, line):
+        self.checksum[0] += 1
+        self.checksum[1] = (self.checksum[1] + line_checksum(line)) % (1 << 64)
+
+    def _remove_line(self, line):
+        self.checksum[0] -= 1
+        self.checksum[1] = (self.checksum[1] - line_checksum(line)) % (1 << 64)
+
+    @staticmethod
+    def _is_abnormal(record, tests):
+        test = tests.get(record.test_name.upper())
+        return bool(test and test['is_normal'] and not test['is_normal'](record.result))
+
+    def _add_record(self, record, tests):
+        abnormal = self._is_abnormal(record, tests)
+        value = record.result
+        for table, key in zip((self.by_patient_test, self.by_test_day), self._keys(record)):
+            entry = table.get(key)
+            if entry is None:
+                table[key] = [1, value, value * value, value, value, int(abnormal)]
+            else:
+                entry[0] += 1
+                entry[1] += value
+                entry[2] += value * value
+                entry[3] = min(entry[3], value)
+                entry[4] = max(entry[4], value)
+                entry[5] += abnormal
+
+    def _remove_record(self, record, tests):
+        """Take record out of its entries; entries whose min or max it was are recomputed."""
+        abnormal = self._is_abnormal(record, tests)
+        value = record.result
+        patient_key, day_key = self._keys(record)
+        for table, key in ((self.by_patient_test, patient_key), (self.by_test_day, day_key)):
+            entry = table[key]
+            if entry[0] == 1:
+                del table[key]
+            elif value in (entry[3], entry[4]):
+                self._recompute(table, key, tests)
+            else:
+                entry[0] -= 1
+                entry[1] -= value
+                entry[2] -= value * value
+                entry[5] -= abnormal
+
+    def _recompute(self, table, key, tests):
+        """Rebuild one entry from the record store (which already holds the new data)."""
+        if table is self.by_patient_test:
+            positions = self.record_store.find(int(key[0]), key[1])
+            records = [self.record_store.records[position] for position in positions]
+        else:
+            start = epoch_day_minutes(key[1])
+            positions = self.record_store.candidates(test_name=key[0], time_range=(start, start + 1439))
+            records = [self.record_store.records[position] for position in positions
+                       if self.record_store.records[position].test_name.upper() == key[0]]
+        del table[key]
+        for record in records:
+            value = record.result
+            abnormal = self._is_abnormal(record, tests)
+            entry = table.get(key)
+            if entry is None:
+                table[key] = [1, value, value * value, value, value, int(abnormal)]
+            else:
+                entry[0] += 1
+                entry[1] += value
+                entry[2] += value * value
+                entry[3] = min(entry[3], value)
+                entry[4] = max(entry[4], value)
+                entry[5] += abnormal
+
+    def add(self, records):
+        """Account for records that were just appended to the record file, and save.
+
+        Call with the record file lock still held, so no other write comes in between.
+        """
+        tests = catalog.tests()
+        for record in records:
+            self._add_line(record.format().encode())
+            self._add_record(record, tests)
+        self.file_stamp = self._file_stamp()
+        self.dirty = True
+        self.save()
+
+    def replace(self, old_line, old_record, new_record):
+        """Account for old_record (stored as old_line) having been replaced by new_record, and save.
+
+        Call after the record store was updated, since min/max may be recomputed from it,
+        and with the record file lock still held.
+        """
+        tests = catalog.tests()
+        self._remove_line(old_line)
+        self._add_line(new_record.format().encode())
+        self._add_record(new_record, tests)
+        self._remove_record(old_record, tests)
+        self.file_stamp = self._file_stamp()
+        self.dirty = True
+        self.save()
+
+    @staticmethod
+    def _describe(entry):
+        if entry is None:
+            return None
+        count, total, squares, minimum, maximum, abnormal = entry
+        mean = total / count
+        return {'count': count, 'mean': mean, 'std': math.sqrt(max(squares / count - mean * mean, 0.0)),
+                'min': minimum, 'max': maximum, 'abnormal': abnormal}
+
+    def patient_test_summary(self, patient_id, test_name):
+        """Summary of one patient's results for one test, without scanning the records."""
+        self.refresh()
+        key = (f"{int(patient_id):07d}", test_name.upper())
+        return self._describe(self.by_patient_test.get(key))
+
+    def test_days_summary(self, test_name, start_date, end_date=None):
+        """Summary of one test over the days start_date..end_date (YYYY-MM-DD), one lookup per day."""
+        self.refresh()
+        test_name = test_name.upper()
+        first_day = epoch_day_minutes(start_date) // 1440
+        last_day = epoch_day_minutes(end_date or start_date) // 1440
+        combined = None
+        for day in range(first_day, last_day + 1):
+            entry = self.by_test_day.get((test_name, format_epoch_day(day)))
+            if entry is None:
+                continue
+            if combined is None:
+                combined = list(entry)
+            else:
+                combined[0] += entry[0]
+                combined[1] += entry[1]
+                combined[2] += entry[2]
+                combined[3] = min(combined[3], entry[3])
+                combined[4] = max(combined[4], entry[4])
+                combined[5] += entry[5]
+        return self._describe(combined)
+
+
+aggregates = AggregateCache(AGGREGATE_FILE, FILE, store)
+atexit.register(aggregates.save)
+
+
+class TestFileStorage:
+    """The medicalTest.txt side of the file-based storages, through the shared test catalog."""
+
+    def tests(self):
+        return catalog.tests()
+
+    def test_lines(self):
+        return catalog.lines()
+
+    def add_test(self, line):
+        with open(test_file, "a") as file:
+            file.write(line + "\n")
+        catalog.invalidate()
+
+    def save_tests(self, lines):
+        save_records(test_file, lines)
+        catalog.invalidate()
+
+
+class TextStorage(TestFileStorage):
+    """Storage in medicalTest.txt and medicalRecord.txt (the default).
+
+    Goes through the shared record store and aggregate cache. Records are identified by
+    their record store position.
+    """
+
+    def locked(self):
+        """Keep other processes from writing records, e.g. from finding a record to replacing it."""
+        return store.lock
+
+    def version(self):
+        """Changes whenever the records do (see TimelineCache)."""
+        return store._current_stamp()
+
+    def add_records(self, records):
+        with store.lock:
+            version = self.version()
+            maintain = aggregates.is_current()
+            store.append_many(records)
+            if maintain:
+                aggregates.add(records)
+            timelines.add(records, version)
+            cohorts.add(records, version)
+
+    def find_records(self, patient_id, test_name):
+        return [(position, store.records[position]) for position in store.find(patient_id, test_name)]
+
+    def replace_record(self, handle, old_record, record):
+        with store.lock:
+            maintain = aggregates.is_current()
+            position = store.locate(handle, old_record)
+            old_line = store.line_at(position)
+            version = self.version()
+            store.replace(position, record)
+            if maintain:
+                aggregates.replace(old_line, old_record, record)
+            timelines.replace(old_record, record, version)
+            cohorts.replace(old_record, record, version)
+
+    def record_keys(self):
+        if store.is_current():
+            return {record.key() for record in store.records}
+        return {record.key() for record in parse_records(read_lines(FILE))}
+
+    def select(self, filters):
+        return select_records(filters)
+
+
+class SQLiteStorage:
+    """Storage in an SQLite database in WAL mode, so readers never block the writer.
+
+    Records are identified by their row id. Statements are fixed parameterised SQL,
+    which sqlite3 keeps prepared in its per-connection statement cache, and inserts
+    are batched in one transaction.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tests (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE,
+            line TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS records (
+            id INTEGER PRIMARY KEY,
+            patient_id INTEGER NOT NULL,
+            test_name TEXT NOT NULL,
+            test_key TEXT NOT NULL,
+            test_time INTEGER NOT NULL,
+            result REAL NOT NULL,
+            unit TEXT NOT NULL,
+            status TEXT NOT NULL,
+            results_time INTEGER,
+            turnaround INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS records_patient ON records (patient_id, test_key);
+        CREATE INDEX IF NOT EXISTS records_test_time ON records (test_key, test_time);
+        CREATE INDEX IF NOT EXISTS records_time ON records (test_time);
+        CREATE INDEX IF NOT EXISTS records_turnaround ON records (turnaround);
+    """
+    RECORD_COLUMNS = "patient_id, test_name, test_time, result, unit, status, results_time"
+    INSERT_RECORD = ("INSERT INTO records (patient_id, test_name, test_key, test_time, result, unit, status, "
+                     "results_time, turnaround) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)")
+    UPDATE_RECORD = ("UPDATE records SET patient_id = ?, test_name = ?, test_key = ?, test_time = ?, result = ?, "
+                     "unit = ?, status = ?, results_time = ?, turnaround = ? WHERE id = ?")
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        # serve uses the connection from its thread pool, one writer or several readers at a time
+        self.connection = sqlite3.connect(db_path, isolation_level=None, timeout=30, cached_statements=256,
+                                          check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(self.SCHEMA)
+        self._tests = None
+        self._tests_version = None
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    @staticmethod
+    def _row(record):
+        return (record.patient_id, record.test_name, record.test_name.upper(), record.test_time, record.result,
+                record.unit, record.status, record.results_time, record.turnaround)
+
+    @staticmethod
+    def _record(row):
+        patient_id, test_name, test_time, result, unit, status, results_time = row
+        return MedicalRecord(patient_id, sys.intern(test_name), test_time, result, sys.intern(unit),
+                             sys.intern(status), results_time)
+
+    def tests(self):
+        # data_version changes whenever another connection commits
+        version = self.connection.execute("PRAGMA data_version").fetchone()[0]
+        if self._tests is None or version != self._tests_version:
+            self._tests = build_test_entries(self.test_lines())
+            self._tests_version = version
+        return self._tests
+
+    def test_lines(self):
+        return [line for (line,) in self.connection.execute("SELECT line FROM tests ORDER BY id")]
+
+    def add_test(self, line):
+        with self._transaction():
+            self.connection.execute("INSERT INTO tests (name, line) VALUES (?, ?)",
+                                    (parse_test_line(line)[0].upper(), line))
+        self._tests = None
+
+    def save_tests(self, lines):
+        with self._transaction():
+            self.connection.execute("DELETE FROM tests")
+            self.connection.executemany("INSERT OR REPLACE INTO tests (name, line) VALUES (?, ?)",
+                                        [(parse_test_line(line)[0].upper(), line) for line in lines])
+        self._tests = None
+
+    def locked(self):
+        # Row ids never change, and replace_record checks the row inside its transaction
+        return contextlib.nullcontext()
+
+    def version(self):
+        # data_version only changes when another connection commits, so our own writes keep it
+        return self.connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def add_records(self, records):
+        version = self.version()
+        with self._transaction():
+            self.connection.executemany(self.INSERT_RECORD, map(self._row, records))
+        timelines.add(records, version)
+        cohorts.add(records, version)
+
+    def find_records(self, patient_id, test_name):
+        rows = self.connection.execute(
+            f"SELECT id, {self.RECORD_COLUMNS} FROM records WHERE patient_id = ? AND test_key = ? ORDER BY id",
+            (patient_id, test_name.upper()))
+        return [(row[0], self._record(row[1:])) for row in rows]
+
+    def replace_record(self, handle, old_record, record):
+        version = self.version()
+        with self._transaction():
+            row = self.connection.execute(f"SELECT {self.RECORD_COLUMNS} FROM records WHERE id = ?",
+                                          (handle,)).fetchone()
+            if row is None or self._record(row).fields() != old_record.fields():
+                raise RecordChangedError(f"Record {old_record.format()!r} was changed or removed by someone else.")
+            self.connection.execute(self.UPDATE_RECORD, self._row(record) + (handle,))
+        timelines.replace(old_record, record, version)
+        cohorts.replace(old_record, record, version)
+
+    def record_keys(self):
+        return set(self.connection.execute("SELECT patient_id, test_key, test_time FROM records"))
+
+    def count_records(self):
+        return self.connection.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def select(self, filters):
+        """Yield the records matching filters; indexed criteria are evaluated by SQLite."""
+        clauses, parameters = [], []
+        if 'patient_id' in filters:
+            clauses.append("patient_id = ?")
+            parameters.append(int(filters['patient_id']))
+        if 'test_name' in filters:
+            clauses.append("test_key = ?")
+            parameters.append(filters['test_name'].upper())
+        if 'date_range' in filters:
+            clauses.append("test_time BETWEEN ? AND ?")
+            parameters.extend(date_range_minutes(filters['date_range']))
+        if 'status' in filters:
+            clauses.append("status = ?")
+            parameters.append(filters['status'])
+        if 'turnaround' in filters:
+            clauses.append("turnaround BETWEEN ? AND ?")
+            parameters.extend(filters['turnaround'])
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        predicates = record_predicates({key: filters[key] for key in ('abnormal', 'late') if key in filters},
+                                       self.tests())
+        rows = self.connection.execute(f"SELECT {self.RECORD_COLUMNS} FROM records{where} ORDER BY id", parameters)
+        for row in profiler.counted("rows scanned", rows):
+            record = self._record(row)
+            if all(predicate(record) for predicate in predicates):
+                yield record
+
+
+def migrate_to_sqlite(db_path, batch_size=10000):
+    """Copy medicalTest.txt and medicalRecord.txt into a new SQLite database; returns the record count."""
+    database = SQLiteStorage(db_path)
+    if database.count_records():
+        raise ValueError(f"{db_path} already contains records.")
+    database.save_tests(catalog.lines())
+    count = 0
+    batch = []
+    for record in parse_records(read_lines(FILE)):
+        batch.append(record)
+        if len(batch) >= batch_size:
+            database.add_records(batch)
+            count += len(batch)
+            batch = []
+    database.add_records(batch)
+    return count + len(batch)
+
+
+def partition_month(minutes):
+    """The 'YYYY-MM' partition holding a test taken at minutes since the epoch."""
+    return format_epoch_day(minutes // 1440)[:7]
+
+
+class PartitionedStorage(TestFileStorage):
+    """Records in monthly files (YYYY-MM.txt, medicalRecord.txt's line format) in one directory.
+
+    manifest.json holds each partition's test-time and patient-ID range, row count,
+    blank-line bytes and whether its rows are in test-time order; partitions changed
+    behind the manifest's back are rescanned. Date-range and patient queries only open
+    the partitions whose ranges can match. Records are identified by (month, byte offset,
+    line length) and updated like RecordStore does: in place, or blanked and appended to
+    the partition of the new test date. consolidate() rewrites finished months in
+    test-time order without blank lines.
+
+    Every write to a partition holds its FileLock (YYYY-MM.txt.lock), and an update
+    re-reads the row at its handle first, since consolidate() or another process may
+    have moved it.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, PARTITION_MANIFEST)
+        os.makedirs(directory, exist_ok=True)
+        try:
+            with open(self.manifest_path, "r") as file:
+                self.partitions = json.load(file)['partitions']
+        except (FileNotFoundError, ValueError, KeyError):
+            self.partitions = {}
+        self._locks = {}
+
+    def _path(self, month):
+        return os.path.join(self.directory, month + ".txt")
+
+    def _lock(self, month):
+        lock = self._locks.get(month)
+        if lock is None:
+            lock = self._locks[month] = FileLock(self._path(month))
+        return lock
+
+    @contextlib.contextmanager
+    def _locked_months(self, *months):
+        # Always in month order, so two updates moving rows between the same months cannot deadlock
+        with contextlib.ExitStack() as stack:
+            for month in sorted(set(months)):
+                stack.enter_context(self._lock(month))
+            yield
+
+    def locked(self):
+        # replace_record locks the partitions it writes and checks the row itself
+        return contextlib.nullcontext()
+
+    def _save_manifest(self):
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, "w") as file:
+            json.dump({'partitions': self.partitions}, file, indent=1, sort_keys=True)
+        os.replace(temp_path, self.manifest_path)
+
+    @staticmethod
+    def _empty_entry():
+        return {'rows': 0, 'min_time': None, 'max_time': None, 'min_patient': None, 'max_patient': None,
+                'dead_bytes': 0, 'sorted': True}
+
+    @staticmethod
+    def _widen(entry, record, rows=1):
+        if rows and entry['rows'] and record.test_time < entry['max_time']:
+            entry['sorted'] = False
+        entry['rows'] += rows
+        if entry['min_time'] is None:
+            entry['min_time'] = entry['max_time'] = record.test_time
+            entry['min_patient'] = entry['max_patient'] = record.patient_id
+            return
+        entry['min_time'] = min(entry['min_time'], record.test_time)
+        entry['max_time'] = max(entry['max_time'], record.test_time)
+        entry['min_patient'] = min(entry['min_patient'], record.patient_id)
+        entry['max_patient'] = max(entry['max_patient'], record.patient_id)
+
+    def _stamp(self, month, entry):
+        stat = os.stat(self._path(month))
+        entry['size'] = stat.st_size
+        entry['mtime_ns'] = stat.st_mtime_ns
+
+    def _scan(self, month):
+        """A manifest entry rebuilt from the partition file."""
+        entry = self._empty_entry()
+        with open(self._path(month), "rb") as file:
+            for raw_line in file:
+                if not raw_line.strip():
+                    entry['dead_bytes'] += len(raw_line)
+                    continue
+                try:
+                    record = parse_record(raw_line.decode())
+                except ValueError:
+                    continue
+                self._widen(entry, record)
+        self._stamp(month, entry)
+        return entry
+
+    def _current(self):
+        """The manifest entries by month, after rescanning partitions changed outside this storage."""
+        months = set()
+        for name in os.listdir(self.directory):
+            match = PARTITION_NAME.match(name)
+            if match:
+                months.add(match.group(1))
+        changed = False
+        for month in set(self.partitions) - months:
+            del self.partitions[month]
+            changed = True
+        for month in months:
+            entry = self.partitions.get(month)
+            stat = os.stat(self._path(month))
+            if entry is None or (entry.get('size'), entry.get('mtime_ns')) != (stat.st_size, stat.st_mtime_ns):
+                self.partitions[month] = self._scan(month)
+                changed = True
+        if changed:
+            self._save_manifest()
+        return self.partitions
+
+    def prune(self, filters):
+        """The months, in order, whose partitions can hold records matching filters."""
+        time_range = date_range_minutes(filters['date_range']) if 'date_range' in filters else None
+        patient_id = int(filters['patient_id']) if 'patient_id' in filters else None
+        partitions = self._current()
+        months = []
+        for month, entry in sorted(partitions.items()):
+            if not entry['rows']:
+                continue
+            if time_range is not None and (entry['max_time'] < time_range[0] or entry['min_time'] > time_range[1]):
+                continue
+            if patient_id is not None and not entry['min_patient'] <= patient_id <= entry['max_patient']:
+                continue
+            months.append(month)
+        profiler.count("partitions opened", len(months))
+        profiler.count("partitions pruned", len(partitions) - len(months))
+        return months
+
+    def _lines(self, month):
+        """(byte offset, length, line) for every non-blank line of a partition."""
+        with open(self._path(month), "rb") as file:
+            offset = 0
+            for raw_line in file:
+                line = raw_line.rstrip()
+                if line:
+                    yield offset, len(line), line
+                offset += len(raw_line)
+
+    def _append(self, month, records):
+        with self._lock(month):
+            entry = self._current().setdefault(month, self._empty_entry())
+            append_lines(self._path(month), [record.format().encode() for record in records])
+            for record in records:
+                self._widen(entry, record)
+            self._stamp(month, entry)
+
+    def version(self):
+        """Changes whenever a partition file does."""
+        return tuple(sorted((month, entry['size'], entry['mtime_ns']) for month, entry in self._current().items()))
+
+    def add_records(self, records):
+        by_month = {}
+        for record in records:
+            by_month.setdefault(partition_month(record.test_time), []).append(record)
+        with self._locked_months(*by_month):
+            version = self.version()
+            for month, month_records in sorted(by_month.items()):
+                self._append(month, month_records)
+            if by_month:
+                self._save_manifest()
+            timelines.add(records, version)
+            cohorts.add(records, version)
+
+    def find_records(self, patient_id, test_name):
+        prefix = f"{patient_id:07d}:".encode()
+        test_name = test_name.upper()
+        matches = []
+        for month in self.prune({'patient_id': patient_id}):
+            for offset, length, line in self._lines(month):
+                if not line.startswith(prefix):
+                    continue
+                try:
+                    record = parse_record(line.decode())
+                except ValueError:
+                    continue
+                if record.test_name.upper() == test_name:
+                    matches.append(((month, offset, length), record))
+        return matches
+
+    def _holds(self, month, offset, length, fields):
+        """Whether the line at offset (and length bytes long) of a partition parses to fields."""
+        try:
+            with open(self._path(month), "rb") as file:
+                file.seek(offset)
+                data = file.read(length + 1)
+            # The line must also end there, not just start like the old one
+            return data[length:] in (b"", b" ", b"\r", b"\n") and parse_record(data.decode()).fields() == fields
+        except (FileNotFoundError, ValueError):
+            return False
+
+    def _locate(self, month, offset, length, record):
+        """(offset, length) of record, which was read from offset of month's partition earlier.
+
+        If the line there no longer holds record, the partition is searched for it, and
+        RecordChangedError is raised when it is gone. Call with the month's lock held.
+        """
+        fields = record.fields()
+        if self._holds(month, offset, length, fields):
+            return offset, length
+        if os.path.exists(self._path(month)):
+            prefix = f"{record.patient_id:07d}:".encode()
+            for offset, length, line in self._lines(month):
+                if line.startswith(prefix) and self._holds(month, offset, length, fields):
+                    return offset, length
+        raise RecordChangedError(f"Record {record.format()!r} was changed or removed by someone else.")
+
+    def replace_record(self, handle, old_record, record):
+        month, offset, length = handle
+        new_month = partition_month(record.test_time)
+        with self._locked_months(month, new_month):
+            version = self.version()
+            offset, length = self._locate(month, offset, length, old_record)
+            entry = self._current()[month]
+            line = record.format().encode()
+            if replace_line(self._path(month), offset, length, line, self._path(new_month)) is None:
+                self._widen(entry, record, rows=0)
+                if record.test_time != old_record.test_time:
+                    entry['sorted'] = False
+            else:
+                new_entry = self._current().setdefault(new_month, self._empty_entry())
+                self._widen(new_entry, record)
+                self._stamp(new_month, new_entry)
+                entry['rows'] -= 1
+                entry['dead_bytes'] += length + 1
+            self._stamp(month, entry)
+            self._save_manifest()
+            timelines.replace(old_record, record, version)
+            cohorts.replace(old_record, record, version)
+
+    def count_records(self):
+        return sum(entry['rows'] for entry in self._current().values())
+
+    def record_keys(self):
+        return {record.key() for month in sorted(self._current())
+                for record in parse_records(read_lines(self._path(month)))}
+
+    def select(self, filters):
+        predicates = record_predicates(filters, self.tests())
+        for month in self.prune(filters):
+            for record in profiler.counted("rows scanned", parse_records(read_lines(self._path(month)))):
+                if all(predicate(record) for predicate in predicates):
+                    yield record
+
+    def consolidate(self, before_month=None):
+        """Rewrite the partitions before before_month (default: the current month) that have
+        blank lines or rows out of test-time order; returns the months rewritten."""
+        if before_month is None:
+            before_month = partition_month(current_epoch_minutes())
+        rewritten = []
+        for month, entry in sorted(self._current().items()):
+            if month >= before_month or (entry['sorted'] and not entry['dead_bytes']):
+                continue
+            with self._lock(month):
+                keyed_lines = []
+                for _, _, line in self._lines(month):
+                    try:
+                        test_time = parse_record(line.decode()).test_time
+                    except ValueError:
+                        test_time = sys.maxsize
+                    keyed_lines.append((test_time, line))
+                keyed_lines.sort(key=lambda keyed_line: keyed_line[0])
+                temp_path = self._path(month) + ".tmp"
+                with open(temp_path, "wb") as file:
+                    file.writelines(line + b"\n" for _, line in keyed_lines)
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(temp_path, self._path(month))
+                self.partitions[month] = self._scan(month)
+            rewritten.append(month)
+        if rewritten:
+            self._save_manifest()
+        return rewritten
+
+
+def migrate_to_partitions(directory, batch_size=100000):
+    """Copy medicalRecord.txt into monthly partitions in directory; returns the record count."""
+    partitioned = PartitionedStorage(directory)
+    if partitioned.count_records():
+        raise ValueError(f"{directory} already contains records.")
+    count = 0
+    batch = []
+    for record in parse_records(read_lines(FILE)):
+        batch.append(record)
+        if len(batch) >= batch_size:
+            partitioned.add_records(batch)
+            count += len(batch)
+            batch = []
+    partitioned.add_records(batch)
+    partitioned.consolidate(before_month="9999-99")
+    return count + len(batch)
+
+
+storage = TextStorage()
+
+
+def is_existing_test(patient_id, test_name):
+    return bool(storage.find_records(int(patient_id), test_name))
+
+def is_future_date(test_date_time, now=None):
+    """Whether a 'YYYY-MM-DD hh:mm' (or 'YYYY-MM-DD') value lies in the future.
+
+    Pass now (from current_epoch_minutes) to check a batch of values against one
+    snapshot instead of reading the clock for every value.
+    """
+    try:
+        if len(test_date_time) == 10:
+            test_time = epoch_day_minutes(test_date_time)
+        else:
+            test_time = to_epoch_minutes(test_date_time)
+    except ValueError:
+        print("Invalid date and time format. Must be YYYY-MM-DD hh:mm.")
+        return False
+    return test_time > (current_epoch_minutes() if now is None else now)
+
+def save_records(file_path, records):
+    with open(file_path, "w") as file:
+        for record in records:
+            file.write(record + "\n")
+
+def update_test():
+    tests = storage.test_lines()
+    if not tests:
+        print("No tests available to update.")
+        return
+    print("Available Tests:")
+    for i, test in enumerate(tests, 1):
+        print(f"{i}. {test}")
+    while True:
+        try:
+            choice = int(input("Select the test number to update: "))
+            if 1 <= choice <= len(tests):
+                selected_test = tests[choice - 1]
+                break
+            else:
+                print("Invalid selection. Please choose a valid test number.")
+        except ValueError:
+            print("Invalid input. Please enter a number.")
+    test_name, normal_range, result_unit, turnaround_time = parse_test_line(selected_test)
+    print("Leave field blank to keep the current value.")
+    new_test_name = input(f"Enter new Test Name (current: {test_name}): ").strip() or test_name
+    while True:
+        new_normal_range = input(f"Enter new Normal Range (current: {normal_range}): ").strip() or normal_range
+        try:
+            parse_normal_range(new_normal_range)
+        except ValueError:
+            print("Invalid normal range. Use bounds like '> 13.8, < 17.2' or '< 100'. Please try again.")
+            continue
+        break
+    new_result_unit = input(f"Enter new Result Unit (current: {result_unit}): ").strip() or result_unit
+    while True:
+        new_turnaround_time = input(f"Enter new Turnaround Time (current: {turnaround_time}, format DD-hh-mm): ").strip() or turnaround_time
+        try:
+            days, hours, minutes = map(int, new_turnaround_time.split('-'))
+        except ValueError:
+            print("Invalid format. Must be in format DD-hh-mm. Please try again.")
+            continue
+        if validate_turnaround_time(days, hours, minutes):
+            break
+        else:
+            print("Invalid turnaround time. Please ensure days (0-31), hours (0-23), and minutes (0-59) are correct.")
+    tests[choice - 1] = f"{new_test_name}, {new_normal_range}, {new_result_unit}, {new_turnaround_time}"
+    storage.save_tests(tests)
+    print("Test updated successfully.")
+
+def add_record():
+    while True:
+        patient_id = input("Enter Patient ID (7-digit integer): ")
+        if not patient_id.isdigit() or len(patient_id) != 7:
+            print("Invalid Patient ID. Must be a 7-digit integer. Please try again.")
+            continue
+        break
+    while True:
+        test_name = input("Enter Test Name (e.g., 'Hgb', 'BGT', 'LDL', 'systole', 'diastole'): ").upper()
+        if not is_valid_test_name(test_name):
+            print("Invalid Test Name. Please try again.")
+            continue
+        break
+    while True:
+        test_date_time = input("Enter Test Date and Time (format YYYY-MM-DD hh:mm): ")
+        try:
+            if to_epoch_minutes(test_date_time) > current_epoch_minutes():
+                print("The test date cannot be in the future. Please try again.")
+                continue
+        except ValueError:
+            print("Invalid Test Date and Time format. Must be YYYY-MM-DD hh:mm. Please try again.")
+            continue
+        break
+    while True:
+        result = input("Enter Test Result (numeric value): ")
+        try:
+            result = float(result)
+        except ValueError:
+            print("Invalid result. Must be a numeric value. Please try again.")
+            continue
+        break
+    result_unit = input("Enter Result Unit (e.g., 'mg/dL', 'mm Hg'): ")
+    while True:
+        status = input("Enter Test Status (Pending, Completed, Reviewed): ").capitalize()
+        if status not in ["Pending", "Completed", "Reviewed"]:
+            print("Invalid Status. Must be one of 'Pending', 'Completed', or 'Reviewed'. Please try again.")
+            continue
+        break
+    results_date_time = ''
+    if status == "Completed":
+        while True:
+            results_date_time = input("Enter Results Date and Time (format YYYY-MM-DD hh:mm): ")
+            try:
+                results_time = to_epoch_minutes(results_date_time)
+            except ValueError:
+                print("Invalid Results Date and Time format. Must be YYYY-MM-DD hh:mm. Please try again.")
+                continue
+            if results_time > current_epoch_minutes():
+                print("The results date cannot be in the future. Please try again.")
+                continue
+            if results_time < to_epoch_minutes(test_date_time):
+                print("The results date cannot be before the test date. Please try again.")
+                continue
+            break
+    record = parse_record(
+        f"{patient_id}: {test_name}, {test_date_time}, {result}, {result_unit}, {status}, {results_date_time}")
+    storage.add_records([record])
+    print("Record added successfully.")
+
+def add_new_medical_test():
+    while True:
+        test_name = input("Enter new Test Name: ").strip().upper()
+        if not test_name:
+            print("Test Name cannot be empty. Please try again.")
+            continue
+        if test_name.isdigit():
+            print("char only ")
+            continue
+        if test_name in storage.tests():
+            print("Test Name already exists. Please try again.")
+            continue
+        break
+    while True:
+        normal_range = input("Enter normal range (e.g., '> 13.8, < 17.2' or '< 100'): ").strip()
+        if not normal_range:
+            print("Normal Range cannot be empty. Please try again.")
+            continue
+        try:
+            parse_normal_range(normal_range)
+        except ValueError:
+            print("Invalid normal range. Use bounds like '> 13.8, < 17.2' or '< 100'. Please try again.")
+            continue
+        break
+    while True:
+        result_unit = input("Enter Result Unit (e.g., 'g/dL', 'mg/dL', 'mm Hg'): ").strip()
+        if not result_unit:
+            print("Result Unit cannot be empty. Please try again.")
+            continue
+        break
+    while True:
+        turnaround = input("Enter turnaround time (format DD-hh-mm): ").strip()
+        match = re.match(r"^(\d{2})-(\d{2})-(\d{2})$", turnaround)
+        if not match:
+            print("Invalid turnaround time format. Must be DD-hh-mm. Please try again.")
+            continue
+        days, hours, minutes = map(int, match.groups())
+        if not validate_turnaround_time(days, hours, minutes):
+            continue
+        break
+    storage.add_test(f"{test_name}, {normal_range}, {result_unit}, {turnaround}")
+    print("New medical test added successfully.")
+
+
+def prompt_record_update(record):
+    """Ask for new values for every field of record and return the updated MedicalRecord."""
+    print(f"Updating record for Patient ID: {record.patient_id:07d}, Test Name: {record.test_name}")
+
+    # Get new values or keep current values
+    test_name = input(
+        f"Enter new Test Name (current: {record.test_name}) or press Enter to keep: ").upper() or record.test_name
+
+    current_test_date_time = format_epoch_minutes(record.test_time)
+    while True:
+        test_date_time = input(
+            f"Enter new Test Date and Time (current: {current_test_date_time}) or press Enter to keep: ")
+        if test_date_time == '':
+            test_time = record.test_time
+            break
+        try:
+            test_time = to_epoch_minutes(test_date_time)
+        except ValueError:
+            print("Invalid date and time format. Must be YYYY-MM-DD hh:mm. Please try again.")
+            continue
+        if is_future_date(test_date_time):
+            print("Test date cannot be in the future. Please try again.")
+            continue
+        break
+
+    while True:
+        result = input(f"Enter new Test Result (current: {record.result}) or press Enter to keep: ")
+        if result == '':
+            result = record.result
+            break
+        try:
+            result = float(result)
+            break
+        except ValueError:
+            print("Invalid result. Must be a numeric value. Please try again.")
+
+    result_unit = input(
+        f"Enter new Result Unit (current: {record.unit}) or press Enter to keep: ") or record.unit
+
+    # Proper status input handling
+    valid_statuses = ["Pending", "Completed", "Reviewed"]
+    while True:
+        status = input(
+            f"Enter new Test Status (current: {record.status}) or press Enter to keep: ").capitalize()
+        if status == '':
+            status = record.status
+        if status in valid_statuses:
+            break
+        else:
+            print(f"Invalid Status. Must be one of {', '.join(valid_statuses)}. Please try again.")
+
+    results_time = record.results_time
+    if status == "Completed":
+        current_results_date_time = '' if results_time is None else format_epoch_minutes(results_time)
+        while True:
+            results_date_time = input(
+                f"Enter new Results Date and Time (current: {current_results_date_time}) or press Enter to keep: ")
+            if results_date_time == '':
+                break
+            try:
+                new_results_time = to_epoch_minutes(results_date_time)
+            except ValueError:
+                print("Invalid date and time format. Must be YYYY-MM-DD hh:mm. Please try again.")
+                continue
+            if is_future_date(results_date_time):
+                print("Results date cannot be in the future. Please try again.")
+                continue
+            if new_results_time < test_time:
+                print("Results date cannot be before the test date. Please try again.")
+                continue
+            results_time = new_results_time
+            break
+
+    return MedicalRecord(record.patient_id, sys.intern(test_name), test_time, result,
+                         sys.intern(result_unit), sys.intern(status), results_time)
+
+
+def update_record():
+    patient_id_to_update = input("Enter Patient ID (7-digit integer) to update: ")
+    test_name_to_update = input(
+        "Enter Test Name to update (e.g., 'Hgb', 'BGT', 'LDL', 'systole', 'diastole'): ").upper()
+    if not patient_id_to_update.isdigit() or len(patient_id_to_update) != 7:
+        print("Invalid Patient ID. Must be a 7-digit integer.")
+        return
+    patient_id_to_update = int(patient_id_to_update)
+
+    # No lock is held while prompting: replace_record finds the record again (or raises
+    # RecordChangedError) if another process changed the file in the meantime
+    matches = storage.find_records(patient_id_to_update, test_name_to_update)
+    if not matches:
+        print("No matching record found.")
+        return
+    for handle, old_record in matches:
+        new_record = prompt_record_update(old_record)
+        try:
+            storage.replace_record(handle, old_record, new_record)
+        except RecordChangedError as e:
+            print(e)
+            return
+    print("Record updated successfully.")
+
+
+class RunningStats:
+    """Count, minimum, maximum and mean of a stream of numbers in constant memory.
+
+    The total is kept as exact partial sums (as in math.fsum), so the mean does not
+    depend on the order in which values are added or partial stats are merged.
+    """
+
+    __slots__ = ('count', 'partials', 'minimum', 'maximum')
+
+    def __init__(self):
+        self.count = 0
+        self.partials = []
+        self.minimum = None
+        self.maximum = None
+
+    def _add_to_total(self, value):
+        partials = self.partials
+        i = 0
+        for partial in partials:
+            if abs(value) < abs(partial):
+                value, partial = partial, value
+            high = value + partial
+            low = partial - (high - value)
+            if low:
+                partials[i] = low
+                i += 1
+            value = high
+        partials[i:] = [value]
+
+    def add(self, value):
+        self.count += 1
+        self._add_to_total(value)
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+
+    def merge(self, other):
+        if not other.count:
+            return
+        self.count += other.count
+        for partial in other.partials:
+            self._add_to_total(partial)
+        if self.minimum is None or other.minimum < self.minimum:
+            self.minimum = other.minimum
+        if self.maximum is None or other.maximum > self.maximum:
+            self.maximum = other.maximum
+
+    def total(self):
+        return math.fsum(self.partials)
+
+    def mean(self):
+        return self.total() / self.count
+
+
+# Column codes used by ColumnBuilder / RecordColumns
+STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+UNKNOWN_STATUS = 255
+
+
+class ColumnBuilder:
+    """Accumulates records into compact typed arrays, ready to be viewed as NumPy columns.
+
+    Test names are interned into a code table so each row only stores a uint32.
+    """
+
+    def __init__(self):
+        self.test_names = []
+        self.test_codes = {}
+        self.patient_id = array('i')
+        self.test_code = array('I')
+        self.test_time = array('q')
+        self.results_time = array('q')
+        self.value = array('d')
+        self.status = array('B')
+
+    def code_for(self, test_name):
+        test_name = test_name.upper()
+        code = self.test_codes.get(test_name)
+        if code is None:
+            code = self.test_codes[test_name] = len(self.test_names)
+            self.test_names.append(test_name)
+        return code
+
+    def add(self, record):
+        self.patient_id.append(record.patient_id)
+        self.test_code.append(self.code_for(record.test_name))
+        self.test_time.append(record.test_time)
+        self.results_time.append(MISSING_TIME if record.results_time is None else record.results_time)
+        self.value.append(record.result)
+        self.status.append(STATUS_CODES.get(record.status, UNKNOWN_STATUS))
+
+    def __len__(self):
+        return len(self.value)
+
+    def columns(self, tests):
+        return RecordColumns(
+            self.test_names,
+            np.frombuffer(self.patient_id, dtype=np.int32),
+            np.frombuffer(self.test_code, dtype=np.uint32),
+            np.frombuffer(self.test_time, dtype=np.int64),
+            np.frombuffer(self.results_time, dtype=np.int64),
+            np.frombuffer(self.value, dtype=np.float64),
+            np.frombuffer(self.status, dtype=np.uint8),
+            tests,
+        )
+
+
+class RecordColumns:
+    """Records as NumPy columns, with filters evaluated as boolean masks.
+
+    The turnaround column and the abnormal and late flags are computed once for every
+    row, the flags from per-test bound and turnaround-time arrays indexed by test code.
+    """
+
+    def __init__(self, test_names, patient_id, test_code, test_time, results_time, value, status, tests):
+        self.test_names = test_names
+        self.patient_id = patient_id
+        self.test_code = test_code
+        self.test_time = test_time
+        self.results_time = results_time
+        self.value = value
+        self.status = status
+        self.has_result = results_time != MISSING_TIME
+        self.turnaround = np.where(self.has_result, results_time - test_time, -1)
+        self.abnormal = self._abnormal(tests)
+        self.late = self._late(tests)
+
+    def __len__(self):
+        return len(self.value)
+
+    def _abnormal(self, tests):
+        count = len(self.test_names)
+        lower = np.full(count, -np.inf)
+        upper = np.full(count, np.inf)
+        lower_inclusive = np.zeros(count, dtype=bool)
+        upper_inclusive = np.zeros(count, dtype=bool)
+        has_range = np.zeros(count, dtype=bool)
+        for code, test_name in enumerate(self.test_names):
+            test = tests.get(test_name)
+            if test is None or test['bounds'] is None:
+                continue
+            low, low_inclusive, high, high_inclusive = test['bounds']
+            has_range[code] = True
+            if low is not None:
+                lower[code], lower_inclusive[code] = low, low_inclusive
+            if high is not None:
+                upper[code], upper_inclusive[code] = high, high_inclusive
+        code = self.test_code
+        above_lower = (self.value > lower[code]) | (lower_inclusive[code] & (self.value == lower[code]))
+        below_upper = (self.value < upper[code]) | (upper_inclusive[code] & (self.value == upper[code]))
+        # Rows of tests without a normal range (or not in the catalog) are neither normal nor abnormal
+        self.has_range = has_range[code]
+        return self.has_range & ~(above_lower & below_upper)
+
+    def _late(self, tests):
+        """Rows whose result came later than the test's DD-hh-mm turnaround time allows."""
+        allowed = np.full(len(self.test_names), np.iinfo(np.int64).max, dtype=np.int64)
+        for code, test_name in enumerate(self.test_names):
+            test = tests.get(test_name)
+            if test is not None and test['turnaround_minutes'] is not None:
+                allowed[code] = test['turnaround_minutes']
+        return self.has_result & (self.turnaround > allowed[self.test_code])
+
+    def mask(self, filters):
+        """Boolean mask of the rows matching filters (same keys as filter_tests)."""
+        mask = np.ones(len(self), dtype=bool)
+        if 'patient_id' in filters:
+            mask &= self.patient_id == int(filters['patient_id'])
+        if 'test_name' in filters:
+            code = self.test_names.index(filters['test_name'].upper()) \
+                if filters['test_name'].upper() in self.test_names else -1
+            mask &= self.test_code == code
+        if 'abnormal' in filters:
+            mask &= self.abnormal
+        if 'date_range' in filters:
+            start_time, end_time = date_range_minutes(filters['date_range'])
+            mask &= (self.test_time >= start_time) & (self.test_time <= end_time)
+        if 'status' in filters:
+            mask &= self.status == STATUS_CODES.get(filters['status'], UNKNOWN_STATUS)
+        if 'turnaround' in filters:
+            mask &= self.has_result & (self.turnaround >= filters['turnaround'][0]) \
+                & (self.turnaround <= filters['turnaround'][1])
+        if 'late' in filters:
+            mask &= self.late
+        return mask
+
+    def grouped_stats(self, mask=None):
+        """Per test type count, mean, std, percentiles and abnormal rate, in the order the
+        test types first appear among the rows."""
+        code = self.test_code if mask is None else self.test_code[mask]
+        value = self.value if mask is None else self.value[mask]
+        abnormal = self.abnormal if mask is None else self.abnormal[mask]
+        groups = len(self.test_names)
+        counts = np.bincount(code, minlength=groups)
+        sums = np.bincount(code, weights=value, minlength=groups)
+        squares = np.bincount(code, weights=value * value, minlength=groups)
+        abnormal_counts = np.bincount(code, weights=abnormal, minlength=groups)
+        late_counts = np.bincount(code, weights=self.late if mask is None else self.late[mask], minlength=groups)
+        order = np.lexsort((value, code))
+        sorted_values = value[order]
+        ends = np.cumsum(counts)
+        present, first = np.unique(code, return_index=True)
+        stats = []
+        for group in present[np.argsort(first)]:
+            count = counts[group]
+            mean = sums[group] / count
+            group_values = sorted_values[ends[group] - count:ends[group]]
+            p25, p50, p75, p90 = np.percentile(group_values, PERCENTILES)
+            stats.append({
+                'test_name': self.test_names[group],
+                'count': int(count),
+                'mean': float(mean),
+                'std': float(np.sqrt(max(squares[group] / count - mean * mean, 0.0))),
+                'p25': float(p25),
+                'p50': float(p50),
+                'p75': float(p75),
+                'p90': float(p90),
+                'abnormal_rate': float(abnormal_counts[group] / count),
+                'late_rate': float(late_counts[group] / count),
+            })
+        return stats
+
+
+PERCENTILES = (25, 50, 75, 90)
+
+
+def percentiles(values):
+    """p25, p50, p75 and p90 of a non-empty sequence of numbers, interpolated linearly
+    between the closest ranks as numpy.percentile does."""
+    if np is not None:
+        return [float(value) for value in np.percentile(np.asarray(values, dtype=np.float64), PERCENTILES)]
+    ordered = sorted(values)
+    last = len(ordered) - 1
+    result = []
+    for point in PERCENTILES:
+        rank = last * point / 100
+        low = int(rank)
+        high = min(low + 1, last)
+        result.append(ordered[low] + (ordered[high] - ordered[low]) * (rank - low))
+    return result
+
+
+class TestStats:
+    """Count, mean, sum of squares, results (for the percentiles, 8 bytes each) and
+    abnormal and late counts of one test type's results."""
+
+    __slots__ = ('values', 'squares', 'results', 'abnormal', 'late')
+
+    def __init__(self):
+        self.values = RunningStats()
+        self.squares = RunningStats()
+        self.results = array('d')
+        self.abnormal = 0
+        self.late = 0
+
+    def add(self, value):
+        self.values.add(value)
+        self.squares.add(value * value)
+        self.results.append(value)
+
+    def merge(self, other):
+        self.values.merge(other.values)
+        self.squares.merge(other.squares)
+        self.results.extend(other.results)
+        self.abnormal += other.abnormal
+        self.late += other.late
+
+    def describe(self, test_name):
+        count = self.values.count
+        mean = self.values.mean()
+        p25, p50, p75, p90 = percentiles(self.results)
+        return {
+            'test_name': test_name,
+            'count': count,
+            'mean': mean,
+            'std': math.sqrt(max(self.squares.total() / count - mean * mean, 0.0)),
+            'p25': p25,
+            'p50': p50,
+            'p75': p75,
+            'p90': p90,
+            'abnormal_rate': self.abnormal / count,
+            'late_rate': self.late / count,
+        }
+
+
+COHORT_TOKEN = re.compile(r"\s*(?:(\()|(\))|\[([^\]]*)\]|([A-Za-z]+)|(\S))")
+COHORT_MONTH = re.compile(r"^(\d{4})-(\d{2})$")
+COHORT_QUARTER = re.compile(r"^(\d{4})[Qq]([1-4])$")
+
+
+def month_number(month):
+    """Months since 1970-01 of a 'YYYY-MM' string, raising ValueError if invalid."""
+    match = COHORT_MONTH.match(month.strip())
+    if not match or not 1 <= int(match.group(2)) <= 12:
+        raise ValueError(f"Invalid month {month}. Must be YYYY-MM.")
+    return (int(match.group(1)) - 1970) * 12 + int(match.group(2)) - 1
+
+
+def parse_cohort_criterion(criterion):
+    """One criterion of a cohort term as a (kind, value) pair, raising ValueError if invalid.
+
+    test=NAME, status=STATUS, abnormal, normal, late, month=YYYY-MM[..YYYY-MM],
+    quarter=YYYYQn or year=YYYY; periods become ('months', (first, last)).
+    """
+    name, _, value = (part.strip() for part in criterion.partition("="))
+    name = name.lower()
+    if name in ('abnormal', 'normal', 'late') and not value:
+        return ('late', True) if name == 'late' else ('abnormal', name == 'abnormal')
+    if name == 'test' and value:
+        return 'test', value.upper()
+    if name == 'status' and value:
+        if value.capitalize() not in STATUSES:
+            raise ValueError(f"Invalid Status {value}. Must be one of {', '.join(STATUSES)}.")
+        return 'status', value.capitalize()
+    if name == 'month' and value:
+        first, _, last = value.partition("..")
+        return 'months', (month_number(first), month_number(last or first))
+    if name == 'quarter' and COHORT_QUARTER.match(value):
+        year, quarter = COHORT_QUARTER.match(value).groups()
+        first = month_number(f"{year}-{int(quarter) * 3 - 2:02d}")
+        return 'months', (first, first + 2)
+    if name == 'year' and value.isdigit() and len(value) == 4:
+        return 'months', (month_number(f"{value}-01"), month_number(f"{value}-12"))
+    raise ValueError(f"Invalid cohort criterion {criterion!r}.")
+
+
+def parse_cohort(expression):
+    """Parse a cohort expression into a tree of ('and'|'or', left, right), ('not', node)
+    and ('term', criteria) tuples, raising ValueError if it is malformed.
+
+    A term is a bracketed, comma-separated list of criteria that one record must meet,
+    e.g. [test=LDL, abnormal, quarter=2024Q3]; it stands for the patients with such a
+    record. Terms combine with and, or, not and parentheses (not binds tightest, then
+    and, then or).
+    """
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = COHORT_TOKEN.match(expression, position)
+        opening, closing, term, word, other = match.groups()
+        if other:
+            raise ValueError(f"Unexpected {other!r} in cohort expression.")
+        if term is not None:
+            tokens.append(('term', [parse_cohort_criterion(criterion) for criterion in term.split(",")
+                                    if criterion.strip()]))
+        elif word:
+            if word.lower() not in ('and', 'or', 'not'):
+                raise ValueError(f"Unexpected {word!r}; criteria go inside [...].")
+            tokens.append((word.lower(), None))
+        else:
+            tokens.append((opening or closing, None))
+        position = match.end()
+
+    def parse_or(index):
+        node, index = parse_and(index)
+        while index < len(tokens) and tokens[index][0] == 'or':
+            right, index = parse_and(index + 1)
+            node = ('or', node, right)
+        return node, index
+
+    def parse_and(index):
+        node, index = parse_not(index)
+        while index < len(tokens) and tokens[index][0] == 'and':
+            right, index = parse_not(index + 1)
+            node = ('and', node, right)
+        return node, index
+
+    def parse_not(index):
+        if index >= len(tokens):
+            raise ValueError("Incomplete cohort expression.")
+        kind, criteria = tokens[index]
+        if kind == 'not':
+            node, index = parse_not(index + 1)
+            return ('not', node), index
+        if kind == '(':
+            node, index = parse_or(index + 1)
+            if index >= len(tokens) or tokens[index][0] != ')':
+                raise ValueError("Missing ) in cohort expression.")
+            return node, index + 1
+        if kind == 'term':
+            return ('term', criteria), index + 1
+        raise ValueError(f"Unexpected {kind!r} in cohort expression.")
+
+    node, index = parse_or(0)
+    if index != len(tokens):
+        raise ValueError(f"Unexpected {tokens[index][0]!r} in cohort expression.")
+    return node
+
+
+class CohortIndex:
+    """Bitmap indexes over RecordColumns for cohort queries.
+
+    Every test, status, abnormal/normal and late flag and test month has a packed bitmap
+    over the records (one bit per record). A term's criteria are ANDed bitwise into one
+    record bitmap, which the record -> patient code column turns into a patient bitmap;
+    terms are then combined with and/or/not on patient bitmaps. Answering a query only
+    touches these bitmaps and the patient code column, never the records.
+
+    Records written later are applied with add() and replace() rather than by building
+    the index again: the bitmaps have room to grow (doubling), and each row keeps its
+    patient, test, status, month and flag codes so replace() can find the row to change.
+    """
+
+    def __init__(self, columns):
+        self.size = 0
+        self.capacity = 0
+        self.patients = np.zeros(0, dtype=np.int32)
+        self.patient_codes = {}
+        self.test_names = []
+        self.test_codes = {}
+        self.valid = np.zeros(0, dtype=np.uint8)
+        self.bitmaps = {}
+        self.rows = {field: np.zeros(0, dtype=dtype) for field, dtype in
+                     (('patient', np.int32), ('test', np.int32), ('status', np.uint8), ('month', np.int64),
+                      ('flags', np.uint8))}
+        self.add(columns)
+
+    def _reserve(self, size):
+        if size <= self.capacity:
+            return
+        capacity = max(size, 2 * self.capacity, 1024)
+        capacity += -capacity % 8
+
+        def grow(values, length):
+            grown = np.zeros(length, dtype=values.dtype)
+            grown[:len(values)] = values
+            return grown
+        self.valid = grow(self.valid, capacity // 8)
+        self.bitmaps = {key: grow(bitmap, capacity // 8) for key, bitmap in self.bitmaps.items()}
+        self.rows = {field: grow(values, capacity) for field, values in self.rows.items()}
+        self.capacity = capacity
+
+    def _set_bits(self, key, positions, value=True):
+        bitmap = self.bitmaps.get(key) if key is not None else self.valid
+        if bitmap is None:
+            bitmap = self.bitmaps[key] = np.zeros(self.capacity // 8, dtype=np.uint8)
+        masks = (0x80 >> (positions & 7)).astype(np.uint8)
+        if value:
+            np.bitwise_or.at(bitmap, positions >> 3, masks)
+        else:
+            np.bitwise_and.at(bitmap, positions >> 3, ~masks)
+
+    def _codes(self, columns):
+        """The row codes of columns' records, adding patients and tests not seen before."""
+        unique, inverse = np.unique(columns.patient_id, return_inverse=True)
+        new_patients = [patient_id for patient_id in unique.tolist() if patient_id not in self.patient_codes]
+        for patient_id in new_patients:
+            self.patient_codes[patient_id] = len(self.patient_codes)
+        if new_patients:
+            self.patients = np.concatenate([self.patients, np.array(new_patients, dtype=np.int32)])
+        patient_map = np.array([self.patient_codes[patient_id] for patient_id in unique.tolist()], dtype=np.int32)
+        test_map = np.array([self.test_codes.setdefault(test_name, len(self.test_codes))
+                             for test_name in columns.test_names] or [0], dtype=np.int32)
+        self.test_names = list(self.test_codes)
+        has_range = columns.has_range
+        return {
+            'patient': patient_map[inverse.reshape(-1)],
+            'test': test_map[columns.test_code],
+            'status': columns.status,
+            'month': columns.test_time.astype('datetime64[m]').astype('datetime64[M]').astype(np.int64),
+            'flags': (columns.abnormal * 1 + (has_range & ~columns.abnormal) * 2 + columns.late * 4).astype(np.uint8),
+        }
+
+    def _keyed_positions(self, codes, positions):
+        """(bitmap key, positions) pairs for rows at positions with the given codes."""
+        for field, kind, name in (('test', 'test', self.test_names.__getitem__),
+                                  ('status', 'status', lambda code: STATUSES[code] if code < len(STATUSES) else None),
+                                  ('month', 'month', int)):
+            values = codes[field]
+            order = np.argsort(values, kind='stable')
+            distinct, starts = np.unique(values[order], return_index=True)
+            for value, group in zip(distinct.tolist(), np.split(order, starts[1:])):
+                value = name(value)
+                if value is not None:
+                    yield (kind, value), positions[group]
+        for bit, key in ((1, ('abnormal', True)), (2, ('abnormal', False)), (4, ('late', True))):
+            selected = positions[(codes['flags'] & bit) != 0]
+            if len(selected):
+                yield key, selected
+
+    def add(self, columns):
+        """Append rows for the records in columns."""
+        count = len(columns)
+        if not count:
+            return
+        positions = np.arange(self.size, self.size + count, dtype=np.int64)
+        self._reserve(self.size + count)
+        codes = self._codes(columns)
+        for field, values in codes.items():
+            self.rows[field][self.size:self.size + count] = values
+        self._set_bits(None, positions)
+        for key, key_positions in self._keyed_positions(codes, positions):
+            self._set_bits(key, key_positions)
+        self.size += count
+
+    def replace(self, old_columns, new_columns):
+        """Change the row of the one record in old_columns into the one in new_columns.
+
+        Returns False if no row has the old record's codes (the index missed a write).
+        """
+        old_codes = self._codes(old_columns)
+        size = self.size
+        matches = np.ones(size, dtype=bool)
+        for field, values in old_codes.items():
+            matches &= self.rows[field][:size] == values[0]
+        found = np.flatnonzero(matches)
+        if not len(found):
+            return False
+        position = found[:1].astype(np.int64)
+        for key, key_positions in self._keyed_positions(old_codes, position):
+            self._set_bits(key, key_positions, False)
+        new_codes = self._codes(new_columns)
+        for field, values in new_codes.items():
+            self.rows[field][position] = values
+        for key, key_positions in self._keyed_positions(new_codes, position):
+            self._set_bits(key, key_positions)
+        return True
+
+    def record_bitmap(self, criteria):
+        """Packed bitmap of the records meeting every criterion."""
+        empty = np.zeros_like(self.valid)
+        bitmap = self.valid.copy()
+        for kind, value in criteria:
+            if kind == 'months':
+                period = empty.copy()
+                for month in range(value[0], value[1] + 1):
+                    period |= self.bitmaps.get(('month', month), empty)
+                bitmap &= period
+            else:
+                bitmap &= self.bitmaps.get((kind, value), empty)
+        return bitmap
+
+    def patient_bitmap(self, criteria):
+        """Boolean array over self.patients: who has a record meeting every criterion."""
+        positions = np.flatnonzero(np.unpackbits(self.record_bitmap(criteria), count=self.size))
+        patients = np.zeros(len(self.patients), dtype=bool)
+        patients[self.rows['patient'][positions]] = True
+        return patients
+
+    def evaluate(self, node):
+        kind = node[0]
+        if kind == 'term':
+            return self.patient_bitmap(node[1])
+        if kind == 'not':
+            return ~self.evaluate(node[1])
+        left, right = self.evaluate(node[1]), self.evaluate(node[2])
+        return left & right if kind == 'and' else left | right
+
+    def query(self, expression):
+        """The patient IDs (7-digit strings) and count of the cohort described by expression."""
+        patients = np.sort(self.patients[self.evaluate(parse_cohort(expression))])
+        return {'expression': expression, 'count': len(patients),
+                'patients': [f"{patient_id:07d}" for patient_id in patients.tolist()]}
+
+
+def record_columns(records, tests):
+    """RecordColumns of a few records, e.g. the ones a storage just wrote."""
+    builder = ColumnBuilder()
+    for record in records:
+        builder.add(record)
+    return builder.columns(tests)
+
+
+class CohortCache:
+    """The CohortIndex of the current records, built once and then kept up to date.
+
+    Like TimelineCache, it remembers the storage's version(): the storages feed every
+    record they add or replace to it, and a change that did not come through
+    add/replace (another process wrote) or a new test catalog drops the index, which
+    is built again on the next query. Safe to use from several threads.
+    """
+
+    def __init__(self):
+        self._index = None
+        self._tests = None
+        self._version = None
+        self._lock = threading.RLock()
+
+    def query(self, expression):
+        if np is None:
+            raise RuntimeError("NumPy is required for cohort queries.")
+        with self._lock:
+            tests = storage.tests()
+            version = storage.version()
+            if self._index is None or tests is not self._tests or version != self._version:
+                with profiler.stage("build cohort index"):
+                    if isinstance(storage, TextStorage):
+                        columns = store.columns(tests)
+                    else:
+                        columns = record_columns(storage.select({}), tests)
+                    self._index = CohortIndex(columns)
+                self._tests = tests
+                self._version = version
+            with profiler.stage("cohort query"):
+                return self._index.query(expression)
+
+    def _written(self, version):
+        """Whether the index can follow a write; version is the storage's from before it."""
+        if version != self._version:
+            self._index = None
+        self._version = storage.version()
+        return self._index is not None
+
+    def add(self, records, version):
+        """Account for records the storage just added; call with its write lock still held."""
+        with self._lock:
+            if self._written(version):
+                self._index.add(record_columns(records, self._tests))
+
+    def replace(self, old_record, record, version):
+        """Account for old_record having been replaced by record; as for add()."""
+        with self._lock:
+            if self._written(version) and not self._index.replace(
+                    record_columns([old_record], self._tests), record_columns([record], self._tests)):
+                self._index = None
+
+
+cohorts = CohortCache()
+
+
+def cohort(expression):
+    """Answer a cohort expression (see parse_cohort) with the bitmap indexes."""
+    return cohorts.query(expression)
+
+
+class ReportSummary:
+    """What the summary report needs to know about the matching records.
+
+    Records to display (up to limit) go to emit, or are kept in rows when emit is None
+    so that summaries of separate chunks can be merged in order with merge(). Per test
+    type statistics are accumulated in by_test, using the catalog entries in tests,
+    unless test_stats was already computed from the NumPy columns.
+    """
+
+    def __init__(self, limit=None, emit=None, tests=None):
+        self.limit = limit
+        self.emit = emit
+        self.tests = tests or {}
+        self.rows = []
+        self.shown = 0
+        self.values = RunningStats()
+        self.turnaround = RunningStats()
+        self.by_test = {}
+        self.test_stats = None
+        # Rows parsed and rows skipped as malformed, counted by parallel scan workers
+        self.scanned = 0
+        self.malformed = 0
+
+    def __getstate__(self):
+        return {key: value for key, value in self.__dict__.items() if key not in ('emit', 'tests')}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.emit = None
+        self.tests = {}
+
+    def _show(self, record):
+        self.shown += 1
+        if self.emit is None:
+            self.rows.append(record)
+        else:
+            self.emit(record)
+
+    def add(self, record):
+        if self.limit is None or self.shown < self.limit:
+            self._show(record)
+        self.values.add(record.result)
+        if record.turnaround is not None:
+            self.turnaround.add(record.turnaround)
+        if self.test_stats is None:
+            self._add_test(record)
+
+    def _add_test(self, record):
+        test_name = record.test_name.upper()
+        stats = self.by_test.get(test_name)
+        if stats is None:
+            stats = self.by_test[test_name] = TestStats()
+        value = record.result
+        stats.add(value)
+        test = self.tests.get(test_name)
+        if test:
+            if test['is_normal'] and not test['is_normal'](value):
+                stats.abnormal += 1
+            if test['turnaround_minutes'] is not None and record.turnaround is not None \
+                    and record.turnaround > test['turnaround_minutes']:
+                stats.late += 1
+
+    def merge(self, other):
+        for record in other.rows:
+            if self.limit is not None and self.shown >= self.limit:
+                break
+            self._show(record)
+        self.values.merge(other.values)
+        self.turnaround.merge(other.turnaround)
+        for test_name, stats in other.by_test.items():
+            self.by_test.setdefault(test_name, TestStats()).merge(stats)
+        self.scanned += other.scanned
+        self.malformed += other.malformed
+
+    def grouped_stats(self):
+        """Per test type statistics, as listed by TestStats.describe."""
+        if self.test_stats is not None:
+            return self.test_stats
+        return [stats.describe(test_name) for test_name, stats in self.by_test.items()]
+
+
+def filtered_row_printer():
+    """Return an emit function printing the 'Filtered Records:' heading before the first row."""
+    printed = []
+
+    def emit(record):
+        # Display the filtered records
+        if not printed:
+            print("\nFiltered Records:")
+            printed.append(True)
+        print(record.format())
+    return emit
+
+
+def print_summary_statistics(summary):
+    test_values = summary.values
+    turnaround_times = summary.turnaround
+    if test_values.count == 0:
+        print("No records found matching the criteria.")
+        return
+    if summary.limit is not None and test_values.count > summary.limit:
+        print(f"... {test_values.count - summary.limit} more records not shown.")
+
+    # Descriptive statistics for test values
+    print(f"\nTotal Matching Records: {test_values.count}")
+    print("\nTest Value Statistics:")
+    print(f"Minimum Test Value: {test_values.minimum}")
+    print(f"Maximum Test Value: {test_values.maximum}")
+    print(f"Average Test Value: {test_values.mean()}")
+
+    # Per test type statistics
+    print("\nPer Test Type Statistics:")
+    for group in summary.grouped_stats():
+        print(f"{group['test_name']}: count {group['count']}, mean {group['mean']:.2f}, std {group['std']:.2f}, "
+              f"p25 {group['p25']:.2f}, median {group['p50']:.2f}, p75 {group['p75']:.2f}, p90 {group['p90']:.2f}, "
+              f"abnormal {group['abnormal_rate']:.1%}, late {group['late_rate']:.1%}")
+
+    # Descriptive statistics for turnaround times
+    if turnaround_times.count:
+        print("\nTurnaround Time Statistics (in minutes):")
+        print(f"Minimum Turnaround Time: {turnaround_times.minimum} minutes")
+        print(f"Maximum Turnaround Time: {turnaround_times.maximum} minutes")
+        print(f"Average Turnaround Time: {turnaround_times.mean():.2f} minutes")
+    else:
+        print("\nNo turnaround times available for statistics.")
+
+    print("--- End of Summary Report ---\n")
+
+
+def read_lines(file_path):
+    """Yield the non-empty lines of file_path one at a time."""
+    try:
+        with open(file_path, "r") as file:
+            for line in file:
+                if line.strip():
+                    yield line
+    except FileNotFoundError:
+        print(f"File {file_path} not found. Please ensure the file exists.")
+
+
+def read_record_lines(file_path):
+    """Yield (byte offset, length without the line ending, record) for the well-formed
+    lines of file_path, reporting the malformed ones.
+
+    Blank lines are yielded with record None and their full length, newline included.
+    """
+    parse = profiler.timed("parse", parse_record)
+    with open(file_path, "rb") as file:
+        offset = 0
+        for raw_line in file:
+            line = raw_line.decode()
+            if not line.strip():
+                yield offset, len(raw_line), None
+            else:
+                try:
+                    record = parse(line)
+                except ValueError:
+                    print(f"Skipping malformed record: {line.strip()}")
+                    profiler.count("malformed rows")
+                else:
+                    yield offset, len(raw_line.rstrip(b"\r\n")), record
+            offset += len(raw_line)
+
+
+def parse_records(lines):
+    """Yield a MedicalRecord for every well-formed line, reporting the malformed ones."""
+    parse = profiler.timed("parse", parse_record)
+    for line in lines:
+        try:
+            yield parse(line)
+        except ValueError:
+            print(f"Skipping malformed record: {line.strip()}")
+            profiler.count("malformed rows")
+
+
+def date_range_minutes(date_range):
+    """Turn a ('YYYY-MM-DD', 'YYYY-MM-DD') filter into an inclusive epoch-minute range."""
+    return epoch_day_minutes(date_range[0]), epoch_day_minutes(date_range[1]) + 1439
+
+
+def record_predicates(filters, tests):
+    """Build the list of predicates a record must satisfy for the given filters.
+
+    While profiling, each predicate's calls and time are reported as stage 'filter <key>'.
+    """
+    predicates = {}
+    if 'patient_id' in filters:
+        patient_id = int(filters['patient_id'])
+        predicates['patient_id'] = lambda record: record.patient_id == patient_id
+    if 'test_name' in filters:
+        test_name = filters['test_name'].upper()
+        predicates['test_name'] = lambda record: record.test_name.upper() == test_name
+    if 'abnormal' in filters:
+        def is_abnormal(record):
+            test = tests.get(record.test_name.upper())
+            is_normal = test['is_normal'] if test else None
+            return is_normal is not None and not is_normal(record.result)
+        predicates['abnormal'] = is_abnormal
+    if 'date_range' in filters:
+        start_time, end_time = date_range_minutes(filters['date_range'])
+        predicates['date_range'] = lambda record: start_time <= record.test_time <= end_time
+    if 'status' in filters:
+        status = filters['status']
+        predicates['status'] = lambda record: record.status == status
+    if 'turnaround' in filters:
+        min_turnaround, max_turnaround = filters['turnaround']
+        def within_turnaround(record):
+            return record.turnaround is not None and min_turnaround <= record.turnaround <= max_turnaround
+        predicates['turnaround'] = within_turnaround
+    if 'late' in filters:
+        def is_late(record):
+            test = tests.get(record.test_name.upper())
+            allowed = test['turnaround_minutes'] if test else None
+            return record.turnaround is not None and allowed is not None and record.turnaround > allowed
+        predicates['late'] = is_late
+    return [profiler.timed(f"filter {key}", predicate) for key, predicate in predicates.items()]
+
+
+def column_selection(filters, tests):
+    """The record store's NumPy columns and the mask of the rows matching filters, or None.
+
+    Only used when the store is already loaded and current and no indexed criterion is
+    given, so there is nothing for the hash/sorted indexes to narrow down.
+    """
+    indexed = any(key in filters for key in ('patient_id', 'test_name', 'date_range', 'turnaround'))
+    if np is None or indexed or not store.is_current():
+        return None
+    columns = store.columns(tests)
+    with profiler.stage("filter masks"):
+        mask = columns.mask(filters)
+    profiler.count("rows scanned", len(columns))
+    return columns, mask
+
+
+def select_records(filters):
+    """Yield the records matching filters.
+
+    When the record store is already loaded and current its indexes pick the
+    candidates, or its NumPy columns are masked (see column_selection); otherwise the
+    file is streamed line by line without being loaded.
+    """
+    tests = catalog.tests()
+    predicates = record_predicates(filters, tests)
+    selection = column_selection(filters, tests)
+    if selection is not None:
+        for position in np.flatnonzero(selection[1]):
+            yield store.records[position]
+        return
+    if store.is_current():
+        positions = store.candidates(
+            patient_id=int(filters['patient_id']) if 'patient_id' in filters else None,
+            test_name=filters.get('test_name'),
+            time_range=date_range_minutes(filters['date_range']) if 'date_range' in filters else None,
+            turnaround_range=filters.get('turnaround'))
+        records = (store.records[position] for position in positions)
+    else:
+        records = parse_records(read_lines(FILE))
+    for record in profiler.counted("rows scanned", records):
+        if all(predicate(record) for predicate in predicates):
+            yield record
+
+
+def split_file(file_path, chunks):
+    """Split file_path into at most `chunks` byte ranges that start and end on line boundaries."""
+    size = os.path.getsize(file_path)
+    boundaries = [0]
+    with open(file_path, "rb") as file:
+        for i in range(1, chunks):
+            file.seek(max(size * i // chunks, boundaries[-1]))
+            if file.tell() > 0:
+                file.readline()
+            boundary = min(file.tell(), size)
+            if boundary > boundaries[-1]:
+                boundaries.append(boundary)
+    if boundaries[-1] != size:
+        boundaries.append(size)
+    return list(zip(boundaries, boundaries[1:]))
+
+
+def scan_chunk(file_path, start, end, filters, limit):
+    """Filter the lines in [start, end) of file_path and return their partial ReportSummary.
+
+    Runs in a worker process of the parallel scan.
+    """
+    predicates = record_predicates(filters, catalog.tests())
+    summary = ReportSummary(limit, tests=catalog.tests())
+    with open(file_path, "rb") as file:
+        file.seek(start)
+        offset = start
+        for raw_line in file:
+            if offset >= end:
+                break
+            offset += len(raw_line)
+            line = raw_line.decode()
+            if not line.strip():
                 continue
-        except ValueError:
-            print("Invalid Test Date and Time format. Must be YYYY-MM-DD hh:mm. Please try again.")
-            continue
-        break
-    while True:
-        result = input("Enter Test Result (numeric value): ")
-        try:
-            result = float(result)
-        except ValueError:
-            print("Invalid result. Must be a numeric value. Please try again.")
-            continue
-        break
-    result_unit = input("Enter Result Unit (e.g., 'mg/dL', 'mm Hg'): ")
-    while True:
-        status = input("Enter Test Status (Pending, Completed, Reviewed): ").capitalize()
-        if status not in ["Pending", "Completed", "Reviewed"]:
-            print("Invalid Status. Must be one of 'Pending', 'Completed', or 'Reviewed'. Please try again.")
-            continue
-        break
-    results_date_time = ''
-    if status == "Completed":
-        while True:
-            results_date_time = input("Enter Results Date and Time (format YYYY-MM-DD hh:mm): ")
             try:
-                datetime.datetime.strptime(results_date_time, '%Y-%m-%d %H:%M')
+                record = parse_record(line)
             except ValueError:
-                print("Invalid Results Date and Time format. Must be YYYY-MM-DD hh:mm. Please try again.")
+                print(f"Skipping malformed record: {line.strip()}")
+                summary.malformed += 1
                 continue
-            break
-    with open(FILE, "a") as file:
-        file.write(f"{patient_id}: {test_name}, {test_date_time}, {result}, {result_unit}, {status}, {results_date_time}\n")
-    print("Record added successfully.")
+            summary.scanned += 1
+            if all(predicate(record) for predicate in predicates):
+                summary.add(record)
+    return summary
 
-def add_new_medical_test():
-    while True:
-        test_name = input("Enter new Test Name: ").strip().upper()
-        if not test_name:
-            print("Test Name cannot be empty. Please try again.")
-            continue
-        if test_name.isdigit():
-            print("char only ")
-            continue
-        with open(test_file, "r") as file:
-            if any(test_name in line for line in file):
-                print("Test Name already exists. Please try again.")
-                continue
-        break
-    while True:
-        normal_range = input("Enter normal range (e.g., '> 13.8, < 17.2' or '< 100'): ").strip()
-        if not normal_range:
-            print("Normal Range cannot be empty. Please try again.")
-            continue
-        break
-    while True:
-        result_unit = input("Enter Result Unit (e.g., 'g/dL', 'mg/dL', 'mm Hg'): ").strip()
-        if not result_unit:
-            print("Result Unit cannot be empty. Please try again.")
-            continue
-        break
-    while True:
-        turnaround = input("Enter turnaround time (format DD-hh-mm): ").strip()
-        match = re.match(r"^(\d{2})-(\d{2})-(\d{2})$", turnaround)
-        if not match:
-            print("Invalid turnaround time format. Must be DD-hh-mm. Please try again.")
-            continue
-        days, hours, minutes = map(int, match.groups())
-        if not validate_turnaround_time(days, hours, minutes):
-            continue
-        break
-    with open(test_file, "a") as file:
-        file.write(f"{test_name}, {normal_range}, {result_unit}, {turnaround}\n")
-    print("New medical test added successfully.")
 
+def collect_summary(filters, limit=None, workers=None, emit=None):
+    """Run filters over the record file and return the ReportSummary.
 
-def update_record():
-    patient_id_to_update = input("Enter Patient ID (7-digit integer) to update: ")
-    test_name_to_update = input(
-        "Enter Test Name to update (e.g., 'Hgb', 'BGT', 'LDL', 'systole', 'diastole'): ").upper()
-    updated = False
+    With more than one worker the file is scanned in newline-aligned chunks by a pool
+    of worker processes and their partial summaries are merged in file order, which
+    gives the same summary as the serial scan.
+    """
+    tests = storage.tests()
+    summary = ReportSummary(limit, profiler.timed("report rows", emit) if emit else None, tests)
+    if not workers or workers <= 1 or not isinstance(storage, TextStorage):
+        selection = column_selection(filters, tests) if isinstance(storage, TextStorage) else None
+        if selection is not None:
+            columns, mask = selection
+            with profiler.stage("statistics"):
+                summary.test_stats = columns.grouped_stats(mask)
+            records = (store.records[position] for position in np.flatnonzero(mask))
+        else:
+            records = storage.select(filters)
+        add = profiler.timed("aggregate", summary.add)
+        with profiler.stage("scan"):
+            for record in records:
+                add(record)
+        profiler.count("rows matched", summary.values.count)
+        return summary
+    if not os.path.exists(FILE):
+        print(f"File {FILE} not found. Please ensure the file exists.")
+        return summary
+    ranges = split_file(FILE, workers * 4)
+    with profiler.stage("parallel scan"), ProcessPoolExecutor(max_workers=workers) as pool:
+        partials = pool.map(scan_chunk, *zip(*[(FILE, start, end, filters, limit) for start, end in ranges]))
+        for partial in partials:
+            summary.merge(partial)
+    profiler.count("rows scanned", summary.scanned)
+    profiler.count("rows matched", summary.values.count)
+    profiler.count("malformed rows", summary.malformed)
+    return summary
 
-    try:
-        with open(FILE, "r") as file:
-            lines = file.readlines()
-    except FileNotFoundError:
-        print(f"File {FILE} not found.")
-        return
 
-    with open(FILE, "w") as file:
-        for line in lines:
+class QueryResult:
+    """The outcome of query(): the matching records shown (up to limit) and their statistics."""
+
+    def __init__(self, filters, summary):
+        self.filters = filters
+        self.records = summary.rows
+        self.count = summary.values.count
+        self.values = summary.values
+        self.turnaround = summary.turnaround
+        self.tests = summary.grouped_stats()
+
+    def to_dict(self):
+        def stats(running):
+            if not running.count:
+                return None
+            return {'count': running.count, 'min': running.minimum, 'max': running.maximum, 'mean': running.mean()}
+        return {
+            'filters': {key: list(value) if isinstance(value, tuple) else value for key, value in self.filters.items()},
+            'count': self.count,
+            'values': stats(self.values),
+            'turnaround_minutes': stats(self.turnaround),
+            'tests': self.tests,
+            'records': [record.to_dict() for record in self.records],
+        }
+
+
+def build_filters(patient_id=None, test_name=None, abnormal=False, date_range=None, status=None, turnaround=None,
+                  late=False):
+    """Validate query criteria and turn them into the filters dict used by the scans.
+
+    Raises ValueError describing the first invalid criterion.
+    """
+    filters = {}
+    if patient_id is not None:
+        patient_id = f"{patient_id:07d}" if isinstance(patient_id, int) else str(patient_id).strip()
+        if not patient_id.isdigit() or len(patient_id) != 7:
+            raise ValueError("Invalid Patient ID. Must be a 7-digit integer.")
+        filters['patient_id'] = patient_id
+    if test_name:
+        filters['test_name'] = test_name.strip().upper()
+    if abnormal:
+        filters['abnormal'] = True
+    if date_range is not None:
+        start_date, end_date = date_range
+        for date in date_range:
             try:
-                line_patient_id, rest_of_line = line.split(": ", 1)
-                if line_patient_id != patient_id_to_update:
-                    file.write(line)
-                    continue
+                epoch_day_minutes(date)
+            except ValueError:
+                raise ValueError(f"Invalid date {date}. Must be YYYY-MM-DD.")
+        if start_date > end_date:
+            raise ValueError("Start date cannot be after end date.")
+        filters['date_range'] = (start_date, end_date)
+    if status:
+        status = status.capitalize()
+        if status not in STATUSES:
+            raise ValueError(f"Invalid Status. Must be one of {', '.join(STATUSES)}.")
+        filters['status'] = status
+    if turnaround is not None:
+        min_turnaround, max_turnaround = int(turnaround[0]), int(turnaround[1])
+        if min_turnaround < 0 or max_turnaround < 0:
+            raise ValueError("Turnaround time cannot be negative.")
+        if min_turnaround > max_turnaround:
+            raise ValueError("Minimum turnaround time cannot be greater than maximum.")
+        filters['turnaround'] = (min_turnaround, max_turnaround)
+    if late:
+        filters['late'] = True
+    return filters
 
-                details = rest_of_line.strip().split(", ")
-                line_test_name = details[0]
-                line_test_date_time = details[1]
-                line_result = details[2]
-                line_result_unit = details[3]
-                line_status = details[4]
-                line_results_date_time = details[5] if len(details) > 5 else ''
 
-                if line_test_name != test_name_to_update:
-                    file.write(line)
-                    continue
+def query(patient_id=None, test_name=None, abnormal=False, date_range=None, status=None, turnaround=None,
+          late=False, limit=None, workers=None):
+    """Filter the records without any prompts and return a QueryResult.
 
-                print(f"Updating record for Patient ID: {patient_id_to_update}, Test Name: {test_name_to_update}")
-
-                # Get new values or keep current values
-                test_name = input(
-                    f"Enter new Test Name (current: {line_test_name}) or press Enter to keep: ").upper() or line_test_name
-
-                while True:
-                    test_date_time = input(
-                        f"Enter new Test Date and Time (current: {line_test_date_time}) or press Enter to keep: ")
-                    if test_date_time == '':
-                        test_date_time = line_test_date_time
-                        break
-                    if is_future_date(test_date_time):
-                        print("Test date cannot be in the future. Please try again.")
-                        continue
-                    break
+    date_range is a ('YYYY-MM-DD', 'YYYY-MM-DD') pair and turnaround a (min, max) pair
+    in minutes; late keeps only results that took longer than the test's turnaround
+    time in medicalTest.txt; limit caps how many matching records are kept in the result (the
+    statistics always cover every match) and workers > 1 selects the parallel scan.
+    """
+    filters = build_filters(patient_id, test_name, abnormal, date_range, status, turnaround, late)
+    return QueryResult(filters, collect_summary(filters, limit, workers))
 
-                while True:
-                    result = input(f"Enter new Test Result (current: {line_result}) or press Enter to keep: ")
-                    if result == '':
-                        result = line_result
-                        break
-                    try:
-                        result = float(result)
-                        break
-                    except ValueError:
-                        print("Invalid result. Must be a numeric value. Please try again.")
-
-                result_unit = input(
-                    f"Enter new Result Unit (current: {line_result_unit}) or press Enter to keep: ") or line_result_unit
-
-                # Proper status input handling
-                valid_statuses = ["Pending", "Completed", "Reviewed"]
-                while True:
-                    status = input(
-                        f"Enter new Test Status (current: {line_status}) or press Enter to keep: ").capitalize()
-                    if status == '':
-                        status = line_status
-                    if status in valid_statuses:
-                        break
-                    else:
-                        print(f"Invalid Status. Must be one of {', '.join(valid_statuses)}. Please try again.")
-
-                if status == "Completed":
-                    while True:
-                        results_date_time = input(
-                            f"Enter new Results Date and Time (current: {line_results_date_time}) or press Enter to keep: ")
-                        if results_date_time == '':
-                            results_date_time = line_results_date_time
-                            break
-                        if is_future_date(results_date_time):
-                            print("Results date cannot be in the future. Please try again.")
-                            continue
-                        break
-                else:
-                    results_date_time = line_results_date_time
 
-                file.write(
-                    f"{patient_id_to_update}: {test_name}, {test_date_time}, {result}, {result_unit}, {status}, {results_date_time}\n")
-                updated = True
+class TestSeries:
+    """One patient's results for one test in test-time order, with trend figures kept
+    current as results are added or removed.
 
-            except ValueError:
-                print(f"Skipping malformed record: {line.strip()}")
+    Appending a result later than the last one updates the least-squares sums behind the
+    slope and the abnormal streaks in constant time; the moving average and deltas only
+    read the last few values. Results inserted out of order or removed redo the streaks.
+    """
+
+    __slots__ = ('is_normal', 'times', 'values', 'abnormal', 'origin', 'sum_x', 'sum_y', 'sum_xx', 'sum_xy',
+                 'streak', 'longest_streak')
+
+    def __init__(self, is_normal=None):
+        self.is_normal = is_normal
+        self.times = array('q')
+        self.values = array('d')
+        self.abnormal = bytearray()
+        # Least-squares sums over (days since the first result, value)
+        self.origin = None
+        self.sum_x = self.sum_y = self.sum_xx = self.sum_xy = 0.0
+        self.streak = 0
+        self.longest_streak = 0
+
+    def __len__(self):
+        return len(self.times)
+
+    def _regression_add(self, time, value, sign):
+        x = (time - self.origin) / 1440
+        self.sum_x += sign * x
+        self.sum_y += sign * value
+        self.sum_xx += sign * x * x
+        self.sum_xy += sign * x * value
+
+    def _recompute_streaks(self):
+        self.streak = self.longest_streak = 0
+        for flag in self.abnormal:
+            self.streak = self.streak + 1 if flag else 0
+            self.longest_streak = max(self.longest_streak, self.streak)
+
+    def add(self, time, value):
+        if self.origin is None:
+            self.origin = time
+        abnormal = self.is_normal is not None and not self.is_normal(value)
+        index = bisect.bisect_right(self.times, time)
+        self.times.insert(index, time)
+        self.values.insert(index, value)
+        self.abnormal.insert(index, abnormal)
+        self._regression_add(time, value, 1)
+        if index < len(self.times) - 1:
+            self._recompute_streaks()
+            return
+        self.streak = self.streak + 1 if abnormal else 0
+        self.longest_streak = max(self.longest_streak, self.streak)
+
+    def remove(self, time, value):
+        """Remove one result taken at time with value; returns whether there was one."""
+        index = bisect.bisect_left(self.times, time)
+        while index < len(self.times) and self.times[index] == time:
+            if self.values[index] == value:
+                del self.times[index], self.values[index], self.abnormal[index]
+                self._regression_add(time, value, -1)
+                self._recompute_streaks()
+                return True
+            index += 1
+        return False
+
+    def moving_average(self):
+        window = self.values[-TIMELINE_WINDOW:]
+        return math.fsum(window) / len(window) if window else None
+
+    def slope(self):
+        """Least-squares change in value per day, or None with fewer than two distinct times."""
+        count = len(self.values)
+        denominator = count * self.sum_xx - self.sum_x * self.sum_x
+        if count < 2 or abs(denominator) < 1e-9:
+            return None
+        return (count * self.sum_xy - self.sum_x * self.sum_y) / denominator
+
+    def deltas(self, count=TIMELINE_DELTAS):
+        """Changes between consecutive results, for the last count of them."""
+        tail = self.values[-count - 1:]
+        return [round(later - earlier, 10) for earlier, later in zip(tail, tail[1:])]
+
+    def to_dict(self, points=None):
+        shown = range(len(self.times)) if points is None else range(max(0, len(self.times) - points), len(self.times))
+        return {
+            'count': len(self.times),
+            'first': format_epoch_minutes(self.times[0]),
+            'last': format_epoch_minutes(self.times[-1]),
+            'latest': self.values[-1],
+            'moving_average': self.moving_average(),
+            'window': TIMELINE_WINDOW,
+            'slope_per_day': self.slope(),
+            'deltas': self.deltas(),
+            'abnormal_streak': self.streak,
+            'longest_abnormal_streak': self.longest_streak,
+            'points': [{'test_date_time': format_epoch_minutes(self.times[i]), 'result': self.values[i],
+                        'abnormal': bool(self.abnormal[i])} for i in shown],
+        }
+
+
+class PatientTimeline:
+    """A patient's results as one TestSeries per test, keyed by upper-cased test name."""
+
+    def __init__(self, patient_id, tests):
+        self.patient_id = patient_id
+        self.tests = tests
+        self.series = {}
+
+    def add(self, record):
+        test_name = record.test_name.upper()
+        series = self.series.get(test_name)
+        if series is None:
+            test = self.tests.get(test_name)
+            series = self.series[test_name] = TestSeries(test['is_normal'] if test else None)
+        series.add(record.test_time, record.result)
+
+    def remove(self, record):
+        test_name = record.test_name.upper()
+        series = self.series.get(test_name)
+        if series is not None and series.remove(record.test_time, record.result) and not series:
+            del self.series[test_name]
+
+    def to_dict(self, test_name=None, points=None):
+        names = sorted(self.series) if test_name is None else [test_name.upper()]
+        return {
+            'patient_id': f"{self.patient_id:07d}",
+            'tests': {name: self.series[name].to_dict(points) for name in names if name in self.series},
+        }
+
+
+class TimelineCache:
+    """Timelines of the most recently viewed patients.
+
+    A timeline is built once from the storage, in test-time order, and from then on the
+    storages feed every record they add or replace to it, so it is not rebuilt while it
+    stays cached. The cache remembers the storage's version(): when it has changed in a
+    way that did not come through add/replace (another process wrote), or the test
+    catalog changed (the abnormal flags depend on it), all timelines are dropped.
+    Safe to use from several threads.
+    """
+
+    def __init__(self, capacity=TIMELINE_CACHE_SIZE):
+        self.capacity = capacity
+        self._timelines = collections.OrderedDict()
+        self._tests = None
+        self._version = None
+        self._lock = threading.RLock()
+
+    def get(self, patient_id):
+        with self._lock:
+            tests = storage.tests()
+            version = storage.version()
+            if tests is not self._tests or version != self._version:
+                self._timelines.clear()
+                self._tests = tests
+                self._version = version
+            timeline = self._timelines.get(patient_id)
+            if timeline is not None:
+                self._timelines.move_to_end(patient_id)
+                return timeline
+            timeline = PatientTimeline(patient_id, tests)
+            for record in sorted(storage.select({'patient_id': f"{patient_id:07d}"}),
+                                 key=lambda record: record.test_time):
+                timeline.add(record)
+            self._timelines[patient_id] = timeline
+            if len(self._timelines) > self.capacity:
+                self._timelines.popitem(last=False)
+            return timeline
+
+    def _written(self, version):
+        """Whether the cached timelines can follow a write; version is the storage's from before it."""
+        if version != self._version:
+            self._timelines.clear()
+        self._version = storage.version()
+        return bool(self._timelines)
+
+    def add(self, records, version):
+        """Account for records the storage just added; call with its write lock still held."""
+        with self._lock:
+            if self._written(version):
+                self._add(records)
+
+    def _add(self, records):
+        for record in records:
+            timeline = self._timelines.get(record.patient_id)
+            if timeline is not None:
+                timeline.add(record)
+
+    def replace(self, old_record, record, version):
+        """Account for old_record having been replaced by record; as for add()."""
+        with self._lock:
+            if self._written(version):
+                timeline = self._timelines.get(old_record.patient_id)
+                if timeline is not None:
+                    timeline.remove(old_record)
+                self._add([record])
+
+
+timelines = TimelineCache()
+
+
+def print_timeline(timeline, test_name=None, points=None):
+    result = timeline.to_dict(test_name, points)
+    print(f"\n--- Timeline for Patient ID {result['patient_id']} ---")
+    if not result['tests']:
+        print("No records found for this patient.")
+    for name, series in result['tests'].items():
+        slope = series['slope_per_day']
+        print(f"\n{name}: {series['count']} results from {series['first']} to {series['last']}")
+        print(f"Latest: {series['latest']}, moving average (last {series['window']}): {series['moving_average']:.2f}, "
+              f"trend: {'n/a' if slope is None else f'{slope:+.4f} per day'}")
+        print(f"Last changes: {', '.join(f'{delta:+g}' for delta in series['deltas']) or 'none'}")
+        print(f"Out-of-range streak: {series['abnormal_streak']} (longest {series['longest_abnormal_streak']})")
+        for point in series['points']:
+            print(f"  {point['test_date_time']}  {point['result']:>10g}{'  *' if point['abnormal'] else ''}")
+    print("--- End of Timeline ---\n")
+
+
+def view_timeline():
+    while True:
+        patient_id = input("Enter Patient ID (7-digit integer): ").strip()
+        if patient_id.isdigit() and len(patient_id) == 7:
+            break
+        print("Invalid Patient ID. Must be a 7-digit integer.")
+    test_name = input("Enter Test Name or press Enter for all tests: ").strip() or None
+    print_timeline(timelines.get(int(patient_id)), test_name, points=20)
+
+
+# Binary record file: a fixed header, fixed-width little-endian rows, then a JSON footer
+# holding the test-name, unit and status tables the rows' codes refer to.
+BINARY_MAGIC = b"MEDREC01"
+BINARY_HEADER = struct.Struct('<8sQQ')  # magic, row count, footer offset
+BINARY_ROW = struct.Struct('<iHHqqdB')  # patient_id, test code, unit code, test/results time, value, status
+BINARY_DTYPE = None if np is None else np.dtype([
+    ('patient_id', '<i4'), ('test_code', '<u2'), ('unit_code', '<u2'), ('test_time', '<i8'),
+    ('results_time', '<i8'), ('value', '<f8'), ('status', 'u1')])
+
+
+def export_binary(text_path, binary_path):
+    """Convert a text record file into the binary format; returns the number of rows written.
+
+    The footer also records the text file's stamp and where each row's line is in it, so
+    a RecordStore can load the binary copy instead of parsing the text file until the
+    text file changes. Raises ValueError if there are more test names or units than the
+    16-bit codes (or statuses than the status byte) can tell apart.
+    """
+    test_codes, unit_codes = {}, {}
+    status_codes = dict(STATUS_CODES)
+    offsets = array('q')
+    lengths = array('I')
+    dead_bytes = 0
+    count = 0
+    # Writers take the same lock, so the text file cannot change while it is exported
+    with FileLock(text_path), open(binary_path, "wb") as file:
+        stat = os.stat(text_path)
+        file.write(BINARY_HEADER.pack(BINARY_MAGIC, 0, 0))
+        rows = []
+        for offset, length, record in read_record_lines(text_path):
+            if record is None:
+                dead_bytes += length
                 continue
+            test_code = test_codes.setdefault(record.test_name, len(test_codes))
+            unit_code = unit_codes.setdefault(record.unit, len(unit_codes))
+            status_code = status_codes.setdefault(record.status, len(status_codes))
+            if test_code > 0xFFFF or unit_code > 0xFFFF or status_code > 0xFF:
+                raise ValueError(f"{text_path} has more than 65536 test names or units or 256 statuses, "
+                                 f"which the binary format cannot code.")
+            rows.append(BINARY_ROW.pack(
+                record.patient_id, test_code, unit_code, record.test_time,
+                MISSING_TIME if record.results_time is None else record.results_time,
+                record.result, status_code))
+            offsets.append(offset)
+            lengths.append(length)
+            count += 1
+            if len(rows) >= 65536:
+                file.write(b"".join(rows))
+                rows = []
+        file.write(b"".join(rows))
+        lines_offset = file.tell()
+        if sys.byteorder == 'big':
+            offsets.byteswap()
+            lengths.byteswap()
+        file.write(offsets.tobytes() + lengths.tobytes())
+        footer_offset = file.tell()
+        file.write(json.dumps({
+            'tests': list(test_codes),
+            'units': list(unit_codes),
+            'statuses': list(status_codes),
+            'source': {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size,
+                       'dead_bytes': dead_bytes, 'lines_offset': lines_offset},
+        }).encode())
+        file.seek(0)
+        file.write(BINARY_HEADER.pack(BINARY_MAGIC, count, footer_offset))
+    return count
 
-    if updated:
-        print("Record updated successfully.")
-    else:
-        print("No matching record found.")
 
+def read_binary_tables(binary_path):
+    """Return (row count, footer tables) of a binary record file."""
+    with open(binary_path, "rb") as file:
+        magic, count, footer_offset = BINARY_HEADER.unpack(file.read(BINARY_HEADER.size))
+        if magic != BINARY_MAGIC:
+            raise ValueError(f"{binary_path} is not a binary record file.")
+        file.seek(footer_offset)
+        return count, json.loads(file.read())
 
-def generate_summary_report(filtered_records, test_values, turnaround_times):
-    """Generate and display a summary report of the filtered records."""
-    print("\n--- Summary Report ---")
 
-    if not filtered_records:
-        print("No records found matching the criteria.")
-        return
+def iter_binary_records(binary_path):
+    """Yield the rows of a binary record file as MedicalRecord objects (no NumPy needed)."""
+    count, tables = read_binary_tables(binary_path)
+    tests = [sys.intern(name) for name in tables['tests']]
+    units = [sys.intern(unit) for unit in tables['units']]
+    statuses = [sys.intern(status) for status in tables['statuses']]
+    with open(binary_path, "rb") as file:
+        file.seek(BINARY_HEADER.size)
+        remaining = count
+        while remaining:
+            chunk = file.read(BINARY_ROW.size * min(remaining, 65536))
+            remaining -= len(chunk) // BINARY_ROW.size
+            for patient_id, test_code, unit_code, test_time, results_time, value, status in \
+                    BINARY_ROW.iter_unpack(chunk):
+                yield MedicalRecord(patient_id, tests[test_code], test_time, value, units[unit_code],
+                                    statuses[status], None if results_time == MISSING_TIME else results_time)
 
-    # Display the filtered records
-    print("\nFiltered Records:")
-    for rec in filtered_records:
-        print(rec)
 
-    # Descriptive statistics for test values
-    if test_values:
-        print("\nTest Value Statistics:")
-        print(f"Minimum Test Value: {min(test_values)}")
-        print(f"Maximum Test Value: {max(test_values)}")
-        print(f"Average Test Value: {statistics.mean(test_values)}")
+def read_binary_table(binary_path, stamp):
+    """Return (RecordTable, line offsets, line lengths, blank-line bytes) of a binary record
+    file, or None unless it exists and was exported from a text file with this stamp."""
+    try:
+        count, tables = read_binary_tables(binary_path)
+    except (FileNotFoundError, ValueError, struct.error):
+        return None
+    source = tables.get('source')
+    if source is None or (source['mtime_ns'], source['size']) != stamp:
+        return None
+    records = RecordTable()
+    test_map = [records._code(name) for name in tables['tests']]
+    unit_map = [records._code(unit) for unit in tables['units']]
+    status_map = [records._code(status) for status in tables['statuses']]
+    offsets = array('q')
+    lengths = array('I')
+    with open(binary_path, "rb") as file:
+        file.seek(BINARY_HEADER.size)
+        data = file.read(BINARY_ROW.size * count)
+        if len(data) != BINARY_ROW.size * count:
+            return None
+        file.seek(source['lines_offset'])
+        offsets.frombytes(file.read(offsets.itemsize * count))
+        lengths.frombytes(file.read(lengths.itemsize * count))
+    if sys.byteorder == 'big':
+        offsets.byteswap()
+        lengths.byteswap()
+    if np is not None:
+        rows = np.frombuffer(data, dtype=BINARY_DTYPE, count=count)
+        records.patient_id = array('i', rows['patient_id'].astype(np.int32).tobytes())
+        records.test_name = array('I', np.array(test_map or [0], dtype=np.uint32)[rows['test_code']].tobytes())
+        records.test_time = array('q', rows['test_time'].astype(np.int64).tobytes())
+        records.result = array('d', rows['value'].astype(np.float64).tobytes())
+        records.unit = array('I', np.array(unit_map or [0], dtype=np.uint32)[rows['unit_code']].tobytes())
+        records.status = array('I', np.array(status_map, dtype=np.uint32)[rows['status']].tobytes())
+        records.results_time = array('q', rows['results_time'].astype(np.int64).tobytes())
     else:
-        print("\nNo test values available for statistics.")
+        for patient_id, test_code, unit_code, test_time, results_time, value, status in \
+                BINARY_ROW.iter_unpack(data):
+            records.patient_id.append(patient_id)
+            records.test_name.append(test_map[test_code])
+            records.test_time.append(test_time)
+            records.result.append(value)
+            records.unit.append(unit_map[unit_code])
+            records.status.append(status_map[status])
+            records.results_time.append(results_time)
+    return records, offsets, lengths, source['dead_bytes']
 
-    # Descriptive statistics for turnaround times
-    if turnaround_times:
-        print("\nTurnaround Time Statistics (in minutes):")
-        print(f"Minimum Turnaround Time: {min(turnaround_times)} minutes")
-        print(f"Maximum Turnaround Time: {max(turnaround_times)} minutes")
-        print(f"Average Turnaround Time: {statistics.mean(turnaround_times):.2f} minutes")
+
+def import_binary(binary_path, text_path):
+    """Write the rows of a binary record file to text_path in the usual text layout."""
+    count = 0
+    with open(text_path, "w") as file:
+        for record in iter_binary_records(binary_path):
+            file.write(record.format() + "\n")
+            count += 1
+    return count
+
+
+def load_binary_columns(binary_path, tests):
+    """Memory-map a binary record file as RecordColumns; the columns are views, not copies."""
+    if np is None:
+        raise RuntimeError("NumPy is required to load binary record columns.")
+    count, tables = read_binary_tables(binary_path)
+    rows = np.memmap(binary_path, dtype=BINARY_DTYPE, mode='r', offset=BINARY_HEADER.size, shape=(count,))
+    # The file keeps test names as written; the columns use one code per upper-cased name
+    test_names = list(dict.fromkeys(name.upper() for name in tables['tests']))
+    test_code = rows['test_code']
+    if len(test_names) != len(tables['tests']):
+        code_map = np.array([test_names.index(name.upper()) for name in tables['tests']], dtype=np.uint16)
+        test_code = code_map[test_code]
+    # Status codes beyond the fixed STATUSES are mapped to UNKNOWN_STATUS
+    status = rows['status']
+    if len(tables['statuses']) > len(STATUSES):
+        status = np.where(status < len(STATUSES), status, UNKNOWN_STATUS).astype(np.uint8)
+    return RecordColumns(test_names, rows['patient_id'], test_code, rows['test_time'],
+                         rows['results_time'], rows['value'], status, tests)
+
+
+def validate_record(record, tests, now_minutes):
+    """Return why record cannot be stored, or None if it is valid."""
+    if not 0 <= record.patient_id <= 9999999:
+        return "Patient ID must be a 7-digit integer"
+    if record.test_name.upper() not in tests:
+        return f"Unknown test name {record.test_name}"
+    if record.test_time > now_minutes:
+        return "Test date is in the future"
+    if record.status not in STATUSES:
+        return f"Invalid status {record.status}"
+    if record.status == "Completed" and record.results_time is None:
+        return "Completed record without a results date"
+    if record.results_time is not None and record.results_time > now_minutes:
+        return "Results date is in the future"
+    if record.results_time is not None and record.results_time < record.test_time:
+        return "Results date is before the test date"
+    return None
+
+
+def read_import_rows(file, input_format):
+    """Yield (line number, MedicalRecord or error message) for each row of a text or CSV feed.
+
+    CSV columns are patient_id, test_name, test_date_time, result, unit, status and an
+    optional results_date_time; a header row is skipped.
+    """
+    if input_format == "csv":
+        for line_number, row in enumerate(csv.reader(file), 1):
+            if not row or (line_number == 1 and not row[0].strip().isdigit()):
+                continue
+            try:
+                yield line_number, record_from_fields(*[field.strip() for field in row])
+            except (TypeError, ValueError):
+                yield line_number, f"Malformed row: {','.join(row)}"
     else:
-        print("\nNo turnaround times available for statistics.")
+        for line_number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, parse_record(line)
+            except (TypeError, ValueError):
+                yield line_number, f"Malformed row: {line.strip()}"
 
-    print("--- End of Summary Report ---\n")
+
+def bulk_import(file, input_format="text", batch_size=10000):
+    """Validate, de-duplicate and append every row of file to the record file.
+
+    Rows are checked against the cached test catalog and against the set of
+    (patient, test, test time) keys already stored, then written in batches with a
+    single fsync each. Rejected rows are reported on stderr. Returns (added, rejected).
+    """
+    tests = storage.tests()
+    now_minutes = current_epoch_minutes()
+    existing = storage.record_keys()
+    validate = profiler.timed("validate", validate_record)
+    write = profiler.timed("write", storage.add_records)
+    added = rejected = 0
+    batch = []
+    for line_number, record in profiler.counted("rows scanned", read_import_rows(file, input_format)):
+        error = record if isinstance(record, str) else validate(record, tests, now_minutes)
+        if error is None and record.key() in existing:
+            error = "Duplicate of an existing record"
+        if error is not None:
+            print(f"Rejected row {line_number}: {error}", file=sys.stderr)
+            rejected += 1
+            continue
+        existing.add(record.key())
+        batch.append(record)
+        if len(batch) >= batch_size:
+            write(batch)
+            added += len(batch)
+            batch = []
+    write(batch)
+    added += len(batch)
+    return added, rejected
 
 
 def filter_tests():
@@ -400,8 +3512,8 @@ def filter_tests():
         if start_date and end_date:
             try:
                 # Validate the date formats
-                start_date_obj = datetime.datetime.strptime(start_date, '%Y-%m-%d')
-                end_date_obj = datetime.datetime.strptime(end_date, '%Y-%m-%d')
+                epoch_day_minutes(start_date)
+                epoch_day_minutes(end_date)
 
                 # Check if start date is after end date
                 if start_date > end_date:
@@ -409,7 +3521,8 @@ def filter_tests():
                     continue
 
                 # Check if the dates are in the future
-                if is_future_date(start_date) or is_future_date(end_date):
+                now = current_epoch_minutes()
+                if is_future_date(start_date, now) or is_future_date(end_date, now):
                     print("Dates cannot be in the future. Please try again.")
                     continue
 
@@ -454,62 +3567,42 @@ def filter_tests():
                 print("Invalid input. Please enter numeric values for turnaround time.")
                 continue
         break
-    if min_turnaround and max_turnaround:
+    if min_turnaround != '' and max_turnaround != '':
         filters['turnaround'] = (min_turnaround, max_turnaround)
 
-    filtered_records = []
-    test_values = []
-    turnaround_times = []
+    # Filter by Late Results
+    while True:
+        late_choice = input("Filter by results later than the test's turnaround time? (y/n): ").strip().lower()
+        if late_choice not in ['y', 'n', '']:
+            print("Invalid choice. Please enter 'y' for Yes or 'n' for No.")
+        else:
+            break
+    if late_choice == 'y':
+        filters['late'] = True
 
-    try:
-        records = load_records(FILE)
-        for record in records:
-            try:
-                patient_id_record, details = record.split(": ", 1)
-                test_name_record, test_date_time, result, result_unit, status_record, *results_date_time = details.split(
-                    ", ")
-                result = float(result)
-                if 'patient_id' in filters and filters['patient_id'] != patient_id_record:
-                    continue
-                if 'test_name' in filters and filters['test_name'] != test_name_record.upper():
-                    continue
-                if 'abnormal' in filters:
-                    test_range = None
-                    with open(test_file, "r") as file:
-                        for line in file:
-                            stored_test_name, normal_range, *_ = line.strip().split(', ')
-                            if test_name_record.upper() == stored_test_name:
-                                test_range = normal_range
-                                break
-                    if test_range and not eval(f"{result} {test_range}"):
-                        continue
-                if 'date_range' in filters:
-                    test_date = test_date_time.split(' ')[0]
-                    if not (filters['date_range'][0] <= test_date <= filters['date_range'][1]):
-                        continue
-                if 'status' in filters and filters['status'] != status_record:
-                    continue
-                if 'turnaround' in filters:
-                    turnaround_minutes = (int(test_date_time.split('-')[1]) * 60 + int(test_date_time.split('-')[2]))
-                    if not (filters['turnaround'][0] <= turnaround_minutes <= filters['turnaround'][1]):
-                        continue
-                    turnaround_times.append(turnaround_minutes)
+    # Limit the number of records printed
+    while True:
+        limit = input("Enter the maximum number of records to display or press Enter to show all: ").strip()
+        if limit and not limit.isdigit():
+            print("Invalid number. Please enter a non-negative integer.")
+        else:
+            break
+    limit = int(limit) if limit else None
 
-                filtered_records.append(record)
-                test_values.append(result)
+    # Scan with several worker processes
+    while True:
+        workers = input("Enter the number of worker processes for a parallel scan or press Enter for a serial scan: ").strip()
+        if workers and (not workers.isdigit() or int(workers) < 1):
+            print("Invalid number. Please enter a positive integer.")
+        else:
+            break
 
-            except ValueError:
-                print(f"Skipping malformed record: {record.strip()}")
-                continue
-    except FileNotFoundError:
-        print(f"File {FILE} not found. Please ensure the file exists.")
-        return
+    try:
+        print("\n--- Summary Report ---")
+        summary = collect_summary(filters, limit, int(workers) if workers else None, emit=filtered_row_printer())
+        print_summary_statistics(summary)
     except Exception as e:
         print(f"An error occurred while processing records: {e}")
-        return
-
-    # Generate the summary report
-    generate_summary_report(filtered_records, test_values, turnaround_times)
 
 
 def main():
@@ -522,14 +3615,463 @@ def main():
         elif choice == "3":
             update_record()
         elif choice == "4":
-            update_test(test_file)
+            update_test()
         elif choice == "5":
             filter_tests()
         elif choice == "6":
+            view_timeline()
+        elif choice == "7":
             print("Exiting the program.")
             break
         else:
             print("Invalid option.")
 
+RECORD_CSV_FIELDS = ['patient_id', 'test_name', 'test_date_time', 'result', 'unit', 'status', 'results_date_time']
+
+
+def filters_from_options(patient_id=None, test_name=None, abnormal=False, start_date=None, end_date=None,
+                         status=None, min_turnaround=None, max_turnaround=None, late=False):
+    """build_filters for the query command's options, where each bound may be given alone."""
+    date_range = None
+    if start_date or end_date:
+        if not (start_date and end_date):
+            raise ValueError("--from and --to must be given together.")
+        date_range = (start_date, end_date)
+    turnaround = None
+    if min_turnaround is not None or max_turnaround is not None:
+        turnaround = (min_turnaround or 0, max_turnaround if max_turnaround is not None else sys.maxsize)
+    return build_filters(patient_id, test_name, abnormal, date_range, status, turnaround, late)
+
+
+def run_query_command(args):
+    filters = filters_from_options(args.patient_id, args.test_name, args.abnormal, args.start_date, args.end_date,
+                                   args.status, args.min_turnaround, args.max_turnaround, args.late)
+    if args.format == "text":
+        print("\n--- Summary Report ---")
+        print_summary_statistics(collect_summary(filters, args.limit, args.workers, emit=filtered_row_printer()))
+    elif args.format == "csv":
+        writer = csv.DictWriter(sys.stdout, fieldnames=RECORD_CSV_FIELDS)
+        writer.writeheader()
+        collect_summary(filters, args.limit, args.workers, emit=lambda record: writer.writerow(record.to_dict()))
+    else:
+        result = QueryResult(filters, collect_summary(filters, args.limit, args.workers))
+        print(json.dumps(result.to_dict(), indent=2))
+
+
+SERVICE_PORT = 8765
+SERVICE_DEFAULT_LIMIT = 100
+SERVICE_UPDATE_FIELDS = ('test_name', 'test_date_time', 'result', 'unit', 'status', 'results_date_time')
+# Request fields that must be strings when given
+SERVICE_STRING_FIELDS = ('op', 'expression', 'test_name', 'from', 'to', 'status', 'test_date_time', 'unit',
+                         'results_date_time')
+
+
+def record_with_changes(record, changes):
+    """A copy of record with some of its text fields replaced, raising ValueError if invalid."""
+    unknown = set(changes) - set(SERVICE_UPDATE_FIELDS)
+    if unknown:
+        raise ValueError(f"Cannot change {', '.join(sorted(unknown))}.")
+    fields = record.to_dict()
+    fields.update(changes)
+    return record_from_fields(fields['patient_id'], str(fields['test_name']).upper(), fields['test_date_time'],
+                              fields['result'], fields['unit'], str(fields['status']),
+                              fields['results_date_time'] or '')
+
+
+class ReadWriteLock:
+    """Any number of readers or one writer, for asyncio tasks.
+
+    A waiting writer keeps new readers out, so a steady stream of queries cannot starve
+    the writer.
+    """
+
+    def __init__(self):
+        self._condition = asyncio.Condition()
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+
+    @contextlib.asynccontextmanager
+    async def reading(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: not self._writing and not self._waiting_writers)
+            self._readers += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._readers -= 1
+                self._condition.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def writing(self):
+        async with self._condition:
+            self._waiting_writers += 1
+            await self._condition.wait_for(lambda: not self._writing and not self._readers)
+            self._waiting_writers -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+class RecordService:
+    """Queries, adds and updates served as JSON lines over a Unix or TCP socket.
+
+    Each request line is a JSON object with an "op" of "query", "cohort", "timeline",
+    "add" or "update", and each gets one JSON line back with "ok" and either the result
+    or an "error". The record store and test catalog stay loaded. The read ops run in
+    the event loop's thread pool under the read side of a ReadWriteLock, so a full scan
+    does not hold up other clients; adds and updates are queued to a single writer task
+    that applies them one at a time in arrival order, in the thread pool as well, under
+    the write side.
+    With partitioned storage the writer also consolidates finished partitions every
+    PARTITION_CONSOLIDATE_INTERVAL seconds.
+    """
+
+    def __init__(self):
+        self.writes = None
+        self.lock = None
+
+    async def serve(self, socket_path=None, host="127.0.0.1", port=SERVICE_PORT):
+        self.writes = asyncio.Queue()
+        self.lock = ReadWriteLock()
+        tasks = [asyncio.create_task(self._write_loop())]
+        if isinstance(storage, PartitionedStorage):
+            tasks.append(asyncio.create_task(self._consolidate_loop()))
+        if socket_path:
+            server = await asyncio.start_unix_server(self._client, path=socket_path)
+        else:
+            server = await asyncio.start_server(self._client, host, port)
+        # Load everything up front so the first request does not pay for it
+        tests = storage.tests()
+        if isinstance(storage, TextStorage):
+            store.refresh()
+            if np is not None:
+                store.columns(tests)
+        print(f"Serving on {socket_path or f'{host}:{port}'}", file=sys.stderr)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    response = await self._respond(line)
+                    writer.write((json.dumps(response) + "\n").encode())
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, line):
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("A request must be a JSON object.")
+            return {'ok': True, **await self.handle(request)}
+        except KeyError as e:
+            return {'ok': False, 'error': f"Missing field {e}."}
+        except (ValueError, TypeError, RuntimeError) as e:
+            return {'ok': False, 'error': str(e)}
+        except Exception as e:
+            # Whatever goes wrong, the client gets an answer and keeps its connection
+            return {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+
+    async def handle(self, request):
+        for field in SERVICE_STRING_FIELDS:
+            if request.get(field) is not None and not isinstance(request[field], str):
+                raise TypeError(f"{field} must be a string.")
+        op = request.get('op')
+        if op == 'query':
+            return await self._read(self.query, request)
+        if op == 'cohort':
+            return await self._read(cohort, request['expression'])
+        if op == 'timeline':
+            return await self._read(self.timeline, request)
+        if op in ('add', 'update'):
+            done = asyncio.get_running_loop().create_future()
+            await self.writes.put((op, request, done))
+            return await done
+        raise ValueError(f"Unknown op {op!r}. Must be query, cohort, timeline, add or update.")
+
+    async def _read(self, function, *args):
+        async with self.lock.reading():
+            return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    async def _consolidate_loop(self):
+        while True:
+            await asyncio.sleep(PARTITION_CONSOLIDATE_INTERVAL)
+            await self.writes.put(('consolidate', None, asyncio.get_running_loop().create_future()))
+
+    async def _write_loop(self):
+        while True:
+            op, request, done = await self.writes.get()
+            if op == 'consolidate':
+                work = self.consolidate
+            else:
+                work = functools.partial(self.add if op == 'add' else self.update, request)
+            try:
+                async with self.lock.writing():
+                    result = await asyncio.get_running_loop().run_in_executor(None, work)
+            except Exception as e:
+                if not done.cancelled():
+                    done.set_exception(e)
+            else:
+                if not done.cancelled():
+                    done.set_result(result)
+
+    def query(self, request):
+        """Options as for the query command: patient_id, test_name, abnormal, from, to, status,
+        min_turnaround, max_turnaround, late and limit (default SERVICE_DEFAULT_LIMIT)."""
+        filters = filters_from_options(request.get('patient_id'), request.get('test_name'), request.get('abnormal'),
+                                       request.get('from'), request.get('to'), request.get('status'),
+                                       request.get('min_turnaround'), request.get('max_turnaround'),
+                                       request.get('late'))
+        summary = collect_summary(filters, request.get('limit', SERVICE_DEFAULT_LIMIT))
+        return QueryResult(filters, summary).to_dict()
+
+    def consolidate(self):
+        return {'months': storage.consolidate()}
+
+    def timeline(self, request):
+        return timelines.get(int(request['patient_id'])).to_dict(request.get('test_name'), request.get('points'))
+
+    def add(self, request):
+        """Add the record given by patient_id, test_name, test_date_time, result, unit, status
+        and results_date_time, with the checks of bulk-import."""
+        record = record_from_fields(request['patient_id'], str(request['test_name']).upper(),
+                                    request['test_date_time'], request['result'], request['unit'],
+                                    str(request['status']), request.get('results_date_time') or '')
+        error = validate_record(record, storage.tests(), current_epoch_minutes())
+        if error is None and any(existing.test_time == record.test_time
+                                 for _, existing in storage.find_records(record.patient_id, record.test_name)):
+            error = "Duplicate of an existing record"
+        if error is not None:
+            raise ValueError(error)
+        storage.add_records([record])
+        return {'record': record.to_dict()}
+
+    def update(self, request):
+        """Apply the fields in changes to the records of patient_id and test_name (only the
+        one taken at test_date_time, if given)."""
+        with storage.locked():
+            return self._update(request)
+
+    def _update(self, request):
+        matches = storage.find_records(int(request['patient_id']), request['test_name'])
+        if 'test_date_time' in request:
+            test_time = to_epoch_minutes(request['test_date_time'])
+            matches = [(handle, record) for handle, record in matches if record.test_time == test_time]
+        if not matches:
+            raise ValueError("No matching record found.")
+        changes = request.get('changes')
+        if not isinstance(changes, dict):
+            raise ValueError("changes must be an object of field names and new values.")
+        tests, now_minutes = storage.tests(), current_epoch_minutes()
+        updates = []
+        for handle, record in matches:
+            new_record = record_with_changes(record, changes)
+            error = validate_record(new_record, tests, now_minutes)
+            if error is not None:
+                raise ValueError(error)
+            updates.append((handle, record, new_record))
+        for handle, record, new_record in updates:
+            storage.replace_record(handle, record, new_record)
+        return {'records': [new_record.to_dict() for _, _, new_record in updates]}
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="Medical Test System. Run without a command for the interactive menu.")
+    backends = parser.add_mutually_exclusive_group()
+    backends.add_argument("--sqlite", metavar="DB", help="use an SQLite database instead of the text files")
+    backends.add_argument("--partitions", metavar="DIR",
+                          help="use monthly partition files in DIR instead of medicalRecord.txt")
+    parser.add_argument("--profile", action="store_true", help="print per-stage timings and counters on stderr")
+    parser.add_argument("--profile-output", metavar="FILE", help="also write cProfile statistics (pstats) to FILE")
+    commands = parser.add_subparsers(dest="command")
+    bulk = commands.add_parser("bulk-import", help="append records from a lab feed without prompts")
+    bulk.add_argument("source", nargs="?", default="-", help="feed file, or - for stdin (default)")
+    bulk.add_argument("--format", choices=["text", "csv"], default="text",
+                      help="'text' for the medicalRecord.txt layout (default) or 'csv'")
+    bulk.add_argument("--batch-size", type=int, default=10000, help="records per write/fsync (default 10000)")
+
+    search = commands.add_parser("query", help="filter records without prompts")
+    search.add_argument("--patient-id", help="7-digit patient ID")
+    search.add_argument("--test-name", help="test name, e.g. LDL")
+    search.add_argument("--abnormal", action="store_true", help="only results outside the normal range")
+    search.add_argument("--from", dest="start_date", metavar="YYYY-MM-DD", help="first test date")
+    search.add_argument("--to", dest="end_date", metavar="YYYY-MM-DD", help="last test date")
+    search.add_argument("--status", help="Pending, Completed or Reviewed")
+    search.add_argument("--min-turnaround", type=int, metavar="MINUTES")
+    search.add_argument("--max-turnaround", type=int, metavar="MINUTES")
+    search.add_argument("--late", action="store_true", help="only results later than the test's turnaround time")
+    search.add_argument("--limit", type=int, help="maximum number of records to output")
+    search.add_argument("--workers", type=int, help="worker processes for a parallel scan")
+    search.add_argument("--format", choices=["text", "json", "csv"], default="text",
+                        help="report text (default), JSON result or CSV records")
+
+    summary = commands.add_parser("summary", help="cached statistics for a patient's test or a test over days")
+    summary.add_argument("--test-name", required=True, help="test name, e.g. LDL")
+    summary.add_argument("--patient-id", help="7-digit patient ID")
+    summary.add_argument("--from", dest="start_date", metavar="YYYY-MM-DD", help="first test date")
+    summary.add_argument("--to", dest="end_date", metavar="YYYY-MM-DD", help="last test date (default: --from)")
+
+    cohort_command = commands.add_parser(
+        "cohort", help="patients matching a boolean combination of criteria, e.g. "
+                       "'[test=LDL, abnormal, quarter=2024Q3] and [test=BGT, status=Pending, quarter=2024Q3]'")
+    cohort_command.add_argument("expression")
+    cohort_command.add_argument("--limit", type=int, help="maximum number of patient IDs to list")
+    cohort_command.add_argument("--format", choices=["text", "json"], default="text")
+
+    timeline = commands.add_parser("timeline", help="a patient's results over time with trend figures")
+    timeline.add_argument("--patient-id", required=True, help="7-digit patient ID")
+    timeline.add_argument("--test-name", help="only this test")
+    timeline.add_argument("--points", type=int, help="show only the last N results of each test")
+    timeline.add_argument("--format", choices=["text", "json"], default="text")
+
+    export = commands.add_parser("export-binary", help="convert the text record file to the binary format")
+    export.add_argument("source", nargs="?", default=FILE)
+    export.add_argument("target", nargs="?", default=BINARY_FILE)
+    restore = commands.add_parser("import-binary", help="convert a binary record file back to text")
+    restore.add_argument("source", nargs="?", default=BINARY_FILE)
+    restore.add_argument("target", nargs="?", default=FILE)
+    migrate = commands.add_parser("migrate-sqlite", help="copy the text files into a new SQLite database")
+    migrate.add_argument("target", help="SQLite database file")
+    partition = commands.add_parser("partition-records", help="copy medicalRecord.txt into monthly partition files")
+    partition.add_argument("target", nargs="?", default=PARTITION_DIR, help=f"directory (default {PARTITION_DIR})")
+    consolidate = commands.add_parser("consolidate-partitions",
+                                      help="rewrite finished monthly partitions sorted and without blank lines")
+    consolidate.add_argument("directory", nargs="?", default=PARTITION_DIR)
+    serve = commands.add_parser("serve", help="keep the records loaded and answer JSON requests on a socket")
+    serve.add_argument("--socket", metavar="PATH", help="listen on a Unix socket instead of TCP")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=SERVICE_PORT, help=f"TCP port (default {SERVICE_PORT})")
+    args = parser.parse_args(argv)
+
+    global storage
+    if (args.sqlite or args.partitions) and args.command == "summary":
+        parser.error("summary reads the text record file; it cannot be used with --sqlite or --partitions")
+    if args.sqlite:
+        storage = SQLiteStorage(args.sqlite)
+    elif args.partitions:
+        storage = PartitionedStorage(args.partitions)
+
+    if not (args.profile or args.profile_output):
+        return run_command(parser, args)
+    profiler.enabled = True
+    python_profile = cProfile.Profile() if args.profile_output else None
+    if python_profile:
+        python_profile.enable()
+    try:
+        return run_command(parser, args)
+    finally:
+        if python_profile:
+            python_profile.disable()
+            python_profile.dump_stats(args.profile_output)
+        profiler.report()
+
+
+def run_command(parser, args):
+    if args.command == "bulk-import":
+        if args.source == "-":
+            added, rejected = bulk_import(sys.stdin, args.format, args.batch_size)
+        else:
+            with open(args.source, "r", newline="") as file:
+                added, rejected = bulk_import(file, args.format, args.batch_size)
+        print(f"Imported {added} records, rejected {rejected}.")
+        return 1 if rejected else 0
+    if args.command == "query":
+        try:
+            run_query_command(args)
+        except ValueError as e:
+            parser.error(str(e))
+        return 0
+    if args.command == "summary":
+        if not (args.patient_id or args.start_date):
+            parser.error("summary needs --patient-id or --from")
+        try:
+            # Checked like the query options, for the same messages
+            build_filters(args.patient_id, args.test_name, date_range=(
+                (args.start_date, args.end_date or args.start_date) if args.start_date else None))
+            if args.patient_id:
+                result = aggregates.patient_test_summary(args.patient_id, args.test_name)
+            else:
+                result = aggregates.test_days_summary(args.test_name, args.start_date, args.end_date)
+        except ValueError as e:
+            parser.error(str(e))
+        print(json.dumps(result, indent=2))
+        return 0
+    if args.command == "cohort":
+        try:
+            result = cohort(args.expression)
+        except (ValueError, RuntimeError) as e:
+            parser.error(str(e))
+        if args.limit is not None:
+            result['patients'] = result['patients'][:args.limit]
+        if args.format == "json":
+            print(json.dumps(result, indent=2))
+        else:
+            print(f"Matching patients: {result['count']}")
+            for patient_id in result['patients']:
+                print(patient_id)
+            if len(result['patients']) < result['count']:
+                print(f"... {result['count'] - len(result['patients'])} more patients not shown.")
+        return 0
+    if args.command == "timeline":
+        if not (args.patient_id.isdigit() and len(args.patient_id) == 7):
+            parser.error("Invalid Patient ID. Must be a 7-digit integer.")
+        result = timelines.get(int(args.patient_id))
+        if args.format == "json":
+            print(json.dumps(result.to_dict(args.test_name, args.points), indent=2))
+        else:
+            print_timeline(result, args.test_name, args.points)
+        return 0
+    if args.command == "export-binary":
+        try:
+            count = export_binary(args.source, args.target)
+        except ValueError as e:
+            parser.error(str(e))
+        print(f"Exported {count} records to {args.target}.")
+        return 0
+    if args.command == "import-binary":
+        print(f"Imported {import_binary(args.source, args.target)} records into {args.target}.")
+        return 0
+    if args.command == "serve":
+        try:
+            asyncio.run(RecordService().serve(args.socket, args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+        return 0
+    if args.command == "partition-records":
+        try:
+            print(f"Partitioned {migrate_to_partitions(args.target)} records into {args.target}.")
+        except ValueError as e:
+            parser.error(str(e))
+        return 0
+    if args.command == "consolidate-partitions":
+        months = PartitionedStorage(args.directory).consolidate()
+        print(f"Consolidated {len(months)} partitions{': ' + ', '.join(months) if months else '.'}")
+        return 0
+    if args.command == "migrate-sqlite":
+        try:
+            print(f"Migrated {migrate_to_sqlite(args.target)} records to {args.target}.")
+        except ValueError as e:
+            parser.error(str(e))
+        return 0
+    main()
+    return 0
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(cli())
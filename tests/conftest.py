@@ -0,0 +1,46 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import driver  # noqa: E402
+
+TEST_LINES = [
+    "Hgb, > 13.8, < 17.2, g/dL, 00-03-04",
+    "BGT, > 70, < 99, mg/dL, 00-12-06",
+    "LDL, < 100, mg/dL, 00-12-06",
+    "systole, <= 120, mm Hg, 00-03-04",
+]
+
+RECORD_LINES = [
+    "1000001: Hgb, 2024-01-05 08:00, 12.5, g/dL, Completed, 2024-01-05 10:30",
+    "1000001: LDL, 2024-01-05 08:00, 130.0, mg/dL, Reviewed, 2024-01-06 09:00",
+    "1000002: BGT, 2024-01-20 07:15, 85.0, mg/dL, Completed, 2024-01-20 20:00",
+    "1000002: ldl, 2024-02-02 09:45, 95.5, mg/dL, Pending, ",
+    "1000003: systole, 2024-02-14 11:00, 120.0, mm Hg, Reviewed, 2024-02-14 11:20",
+    "1000003: BGT, 2024-03-01 06:30, 101.0, mg/dL, Completed, 2024-03-02 01:00",
+    "",
+    "1000001: Hgb, 2024-03-15 08:00, 15.0, g/dL, Completed, 2024-03-15 16:00",
+    "1000004: LDL, 2024-03-20 10:00, 160.0, mg/dL, Completed, 2024-03-20 12:00",
+    "1000004: Hgb, 2024-04-02 13:00, 18.0, g/dL, Pending, ",
+    "1000002: systole, 2024-04-10 15:30, 135.0, mm Hg, Completed, 2024-04-10 16:00",
+]
+
+
+@pytest.fixture
+def records_dir(tmp_path, monkeypatch):
+    """A temporary current directory holding medicalTest.txt and medicalRecord.txt, with
+    driver's module-level catalog, store and caches pointing at fresh objects."""
+    (tmp_path / driver.test_file).write_text("\n".join(TEST_LINES) + "\n")
+    (tmp_path / driver.FILE).write_text("\n".join(RECORD_LINES) + "\n")
+    monkeypatch.chdir(tmp_path)
+    record_store = driver.RecordStore(driver.FILE)
+    monkeypatch.setattr(driver, 'catalog', driver.TestCatalog(driver.test_file))
+    monkeypatch.setattr(driver, 'store', record_store)
+    monkeypatch.setattr(driver, 'aggregates', driver.AggregateCache(driver.AGGREGATE_FILE, driver.FILE, record_store))
+    monkeypatch.setattr(driver, 'storage', driver.TextStorage())
+    monkeypatch.setattr(driver, 'timelines', driver.TimelineCache())
+    monkeypatch.setattr(driver, 'cohorts', driver.CohortCache())
+    return tmp_path
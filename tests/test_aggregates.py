@@ -0,0 +1,118 @@
+import io
+import json
+
+import pytest
+
+import driver
+
+
+def rebuilt():
+    """A fresh cache built from the record file as it is now."""
+    cache = driver.AggregateCache("rebuilt.agg.json", driver.FILE, driver.RecordStore(driver.FILE))
+    cache.rebuild()
+    return cache
+
+
+def assert_matches_rebuild(cache):
+    expected = rebuilt()
+    assert cache.checksum == expected.checksum
+    for table, expected_table in ((cache.by_patient_test, expected.by_patient_test),
+                                  (cache.by_test_day, expected.by_test_day)):
+        assert table.keys() == expected_table.keys()
+        for key, entry in table.items():
+            assert entry == pytest.approx(expected_table[key])
+
+
+def replace(position, **changes):
+    store = driver.store
+    old = store.records[position]
+    fields = {'patient_id': old.patient_id, 'test_name': old.test_name, 'test_time': old.test_time,
+              'result': old.result, 'unit': old.unit, 'status': old.status, 'results_time': old.results_time}
+    fields.update(changes)
+    new = driver.MedicalRecord(**fields)
+    with store.lock:
+        position = store.locate(position, old)
+        old_line = store.line_at(position)
+        store.replace(position, new)
+        driver.aggregates.replace(old_line, old, new)
+
+
+def test_summaries_come_from_the_cache(records_dir):
+    summary = driver.aggregates.patient_test_summary("1000001", "hgb")
+    assert summary['count'] == 2
+    assert summary['mean'] == pytest.approx(13.75)
+    assert (summary['min'], summary['max'], summary['abnormal']) == (12.5, 15.0, 1)
+    days = driver.aggregates.test_days_summary("BGT", "2024-01-01", "2024-03-31")
+    assert (days['count'], days['min'], days['max'], days['abnormal']) == (2, 85.0, 101.0, 1)
+    assert driver.aggregates.test_days_summary("BGT", "2024-02-01") is None
+
+
+def test_appends_are_applied_incrementally(records_dir):
+    driver.aggregates.refresh()
+    feed = io.StringIO(
+        "1000001: Hgb, 2024-05-01 08:00, 16.0, g/dL, Completed, 2024-05-01 09:00\n"
+        "1000007: LDL, 2024-01-05 09:00, 80.0, mg/dL, Pending, \n"
+    )
+    assert driver.bulk_import(feed) == (2, 0)
+    assert driver.aggregates.is_current()
+    assert_matches_rebuild(driver.aggregates)
+
+
+def test_replacements_are_applied_incrementally(records_dir):
+    driver.aggregates.refresh()
+    store = driver.store
+    # An ordinary value, a patient's minimum (recomputed from the store), and a move to another day
+    replace(store.find(1000001, 'LDL')[0], result=120.0)
+    replace(store.find(1000001, 'HGB')[0], result=14.0)
+    replace(store.find(1000003, 'BGT')[0], test_time=driver.to_epoch_minutes("2024-01-20 07:00"),
+            result=75.0, results_time=None, status='Pending')
+    assert driver.aggregates.is_current()
+    assert_matches_rebuild(driver.aggregates)
+    assert driver.aggregates.patient_test_summary("1000001", "HGB")['min'] == 14.0
+
+
+def test_saved_cache_is_reused_and_checked(records_dir):
+    driver.aggregates.refresh()
+    driver.aggregates.save()
+    path = records_dir / driver.FILE
+    cache = driver.AggregateCache(driver.AGGREGATE_FILE, driver.FILE, driver.store)
+    cache.refresh()
+    assert not cache.dirty
+
+    # A change behind the cache's back is noticed through the checksum
+    path.write_text(path.read_text().replace("130.0", "131.0"))
+    cache = driver.AggregateCache(driver.AGGREGATE_FILE, driver.FILE, driver.store)
+    cache.refresh()
+    assert_matches_rebuild(cache)
+    assert cache.patient_test_summary("1000001", "LDL")['max'] == 131.0
+
+
+def test_writes_keep_the_saved_cache_current_without_a_rebuild(records_dir, monkeypatch, capsys):
+    driver.aggregates.refresh()
+    driver.aggregates.save()
+
+    def rebuild(self):
+        raise AssertionError("the aggregates were rebuilt")
+    monkeypatch.setattr(driver.AggregateCache, 'rebuild', rebuild)
+    # A later process writes, and yet another one asks for a summary
+    monkeypatch.setattr(driver, 'aggregates', driver.AggregateCache(driver.AGGREGATE_FILE, driver.FILE, driver.store))
+    assert driver.bulk_import(io.StringIO(
+        "1000001: Hgb, 2024-05-01 08:00, 16.0, g/dL, Completed, 2024-05-01 09:00\n")) == (1, 0)
+    [(handle, record)] = [match for match in driver.storage.find_records(1000001, 'HGB') if match[1].result == 12.5]
+    driver.storage.replace_record(handle, record, driver.record_with_changes(record, {'result': '13.0'}))
+    monkeypatch.setattr(driver, 'aggregates', driver.AggregateCache(driver.AGGREGATE_FILE, driver.FILE, driver.store))
+    assert driver.cli(["summary", "--test-name", "hgb", "--patient-id", "1000001"]) == 0
+    summary = json.loads(capsys.readouterr().out)
+    assert (summary['count'], summary['min'], summary['max']) == (3, 13.0, 16.0)
+
+
+@pytest.mark.parametrize("options, message", [
+    (["--patient-id", "12345"], "Invalid Patient ID"),
+    (["--from", "2024-13-01"], "Invalid date 2024-13-01"),
+    ([], "summary needs --patient-id or --from"),
+])
+def test_summary_rejects_invalid_options(records_dir, capsys, options, message):
+    with pytest.raises(SystemExit) as exit_info:
+        driver.cli(["summary", "--test-name", "hgb"] + options)
+    assert exit_info.value.code == 2
+    assert message in capsys.readouterr().err
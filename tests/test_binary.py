@@ -0,0 +1,82 @@
+import pytest
+
+import driver
+from conftest import RECORD_LINES
+
+
+def test_text_binary_text_round_trip(records_dir):
+    assert driver.export_binary(driver.FILE, driver.BINARY_FILE) == 10
+    assert driver.import_binary(driver.BINARY_FILE, "back.txt") == 10
+    expected = [driver.parse_record(line).format() for line in RECORD_LINES if line]
+    assert (records_dir / "back.txt").read_text().splitlines() == expected
+
+
+def test_round_trip_keeps_missing_results_time_and_test_name_case(records_dir):
+    driver.export_binary(driver.FILE, driver.BINARY_FILE)
+    records = list(driver.iter_binary_records(driver.BINARY_FILE))
+    assert records[3].test_name == "ldl"
+    assert records[3].results_time is None
+    assert records[0].results_time == driver.to_epoch_minutes("2024-01-05 10:30")
+
+
+def test_empty_file_round_trip(records_dir):
+    (records_dir / driver.FILE).write_text("")
+    assert driver.export_binary(driver.FILE, driver.BINARY_FILE) == 0
+    assert driver.read_binary_tables(driver.BINARY_FILE)[0] == 0
+    assert driver.import_binary(driver.BINARY_FILE, "back.txt") == 0
+    assert (records_dir / "back.txt").read_text() == ""
+
+
+def test_binary_columns_match_text(records_dir):
+    if driver.np is None:
+        pytest.skip("NumPy is not installed")
+    driver.export_binary(driver.FILE, driver.BINARY_FILE)
+    tests = driver.catalog.tests()
+    columns = driver.load_binary_columns(driver.BINARY_FILE, tests)
+    assert columns.test_names == ["HGB", "LDL", "BGT", "SYSTOLE"]
+    assert columns.abnormal.tolist() == [True, True, False, False, False, True, False, True, True, True]
+
+
+def test_import_rejects_other_files(records_dir):
+    with pytest.raises(ValueError, match="not a binary record file"):
+        driver.import_binary(driver.FILE, "back.txt")
+
+
+def loaded_store():
+    store = driver.RecordStore(driver.FILE)
+    store.refresh()
+    return store, [record.format() for record in store.records], store.offsets.tolist(), \
+        store.lengths.tolist(), store.dead_bytes
+
+
+@pytest.mark.parametrize("numpy", [True, False])
+def test_store_loads_the_binary_copy_instead_of_parsing(records_dir, monkeypatch, numpy):
+    expected = list(loaded_store()[1:])
+    driver.export_binary(driver.FILE, driver.BINARY_FILE)
+    if not numpy:
+        monkeypatch.setattr(driver, 'np', None)
+
+    def parse_record(line):
+        raise AssertionError("the text file was parsed")
+    monkeypatch.setattr(driver, 'parse_record', parse_record)
+    store, *loaded = loaded_store()
+    assert loaded == expected
+    assert sorted(store.by_test) == ["BGT", "HGB", "LDL", "SYSTOLE"]
+    assert store.by_patient[1000002].tolist() == [2, 3, 9]
+
+
+def test_store_parses_the_text_file_once_it_changed(records_dir):
+    driver.export_binary(driver.FILE, driver.BINARY_FILE)
+    with open(driver.FILE, "a") as file:
+        file.write("1000005: BGT, 2024-05-01 07:00, 90.0, mg/dL, Completed, 2024-05-01 09:00\n")
+    store = loaded_store()[0]
+    assert len(store.records) == 11
+    assert store.records[10].patient_id == 1000005
+
+
+def test_export_rejects_more_test_names_than_the_codes_hold(records_dir):
+    with open(driver.FILE, "w") as file:
+        for number in range(65537):
+            file.write(f"1000001: T{number}, 2024-01-05 08:00, 1.0, g/dL, Completed, 2024-01-05 10:30\n")
+    with pytest.raises(ValueError, match="more than 65536 test names"):
+        driver.export_binary(driver.FILE, driver.BINARY_FILE)
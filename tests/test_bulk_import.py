@@ -0,0 +1,86 @@
+import io
+
+import driver
+from conftest import RECORD_LINES
+
+
+def stored_lines(records_dir):
+    return [line for line in (records_dir / driver.FILE).read_text().splitlines() if line.strip()]
+
+
+def test_valid_rows_are_appended(records_dir):
+    feed = io.StringIO(
+        "1000005: Hgb, 2024-05-01 08:00, 14.0, g/dL, Completed, 2024-05-01 09:00\n"
+        "\n"
+        "1000005: LDL, 2024-05-01 08:00, 90.0, mg/dL, Pending, \n"
+    )
+    assert driver.bulk_import(feed) == (2, 0)
+    lines = stored_lines(records_dir)
+    assert len(lines) == 12
+    assert driver.parse_record(lines[-1]).key() == (1000005, "LDL", driver.to_epoch_minutes("2024-05-01 08:00"))
+
+
+def test_csv_rows_with_a_header_are_appended(records_dir):
+    feed = io.StringIO(
+        "patient_id,test_name,test_date_time,result,unit,status,results_date_time\n"
+        "1000005,BGT,2024-05-01 08:00,80.0,mg/dL,completed,2024-05-01 09:00\n"
+    )
+    assert driver.bulk_import(feed, "csv") == (1, 0)
+    assert stored_lines(records_dir)[-1] == \
+        "1000005: BGT, 2024-05-01 08:00, 80.0, mg/dL, Completed, 2024-05-01 09:00"
+
+
+def test_invalid_rows_are_rejected(records_dir, capsys):
+    feed = io.StringIO(
+        "1000005: XYZ, 2024-05-01 08:00, 14.0, g/dL, Completed, 2024-05-01 09:00\n"
+        "1000005: Hgb, 2999-05-01 08:00, 14.0, g/dL, Pending, \n"
+        "1000005: Hgb, 2024-05-01 08:00, 14.0, g/dL, Lost, \n"
+        "1000005: Hgb, 2024-05-01 08:00, 14.0, g/dL, Completed, \n"
+        "1000005: Hgb, 2024-05-01 08:00, high, g/dL, Pending, \n"
+        "garbage\n"
+    )
+    assert driver.bulk_import(feed) == (0, 6)
+    errors = capsys.readouterr().err.splitlines()
+    assert errors == [
+        "Rejected row 1: Unknown test name XYZ",
+        "Rejected row 2: Test date is in the future",
+        "Rejected row 3: Invalid status Lost",
+        "Rejected row 4: Completed record without a results date",
+        "Rejected row 5: Malformed row: 1000005: Hgb, 2024-05-01 08:00, high, g/dL, Pending,",
+        "Rejected row 6: Malformed row: garbage",
+    ]
+    assert len(stored_lines(records_dir)) == 10
+
+
+def test_duplicates_of_stored_and_earlier_rows_are_rejected(records_dir, capsys):
+    new_row = "1000005: Hgb, 2024-05-01 08:00, 14.0, g/dL, Completed, 2024-05-01 09:00\n"
+    # Same key as a stored row, differing only in test name case and result
+    stored_duplicate = "1000002: LDL, 2024-02-02 09:45, 99.0, mg/dL, Pending, \n"
+    feed = io.StringIO(new_row + stored_duplicate + new_row)
+    assert driver.bulk_import(feed) == (1, 2)
+    assert capsys.readouterr().err.splitlines() == [
+        "Rejected row 2: Duplicate of an existing record",
+        "Rejected row 3: Duplicate of an existing record",
+    ]
+    assert stored_lines(records_dir) == [line for line in RECORD_LINES if line] + [new_row.strip()]
+
+
+def test_loaded_store_sees_imported_rows(records_dir):
+    driver.store.refresh()
+    feed = io.StringIO("1000005: Hgb, 2024-05-01 08:00, 14.0, g/dL, Completed, 2024-05-01 09:00\n")
+    assert driver.bulk_import(feed, batch_size=1) == (1, 0)
+    assert driver.store.is_current()
+    assert [driver.store.records[position].result for position in driver.store.find(1000005, "hgb")] == [14.0]
+
+
+def test_results_dates_must_be_past_and_after_the_test(records_dir, capsys):
+    feed = io.StringIO(
+        "1000005: Hgb, 2024-05-01 08:00, 14.0, g/dL, Completed, 2999-05-01 09:00\n"
+        "1000005: LDL, 2024-05-01 08:00, 90.0, mg/dL, Reviewed, 2024-04-30 09:00\n"
+        "1000005: BGT, 2024-05-01 08:00, 80.0, mg/dL, Completed, 2024-05-01 08:00\n"
+    )
+    assert driver.bulk_import(feed) == (1, 2)
+    assert capsys.readouterr().err.splitlines() == [
+        "Rejected row 1: Results date is in the future",
+        "Rejected row 2: Results date is before the test date",
+    ]
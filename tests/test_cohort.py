@@ -0,0 +1,122 @@
+import pytest
+
+import driver
+
+LDL = ('term', [('test', 'LDL')])
+BGT = ('term', [('test', 'BGT')])
+HGB = ('term', [('test', 'HGB')])
+
+
+def test_term_criteria():
+    assert driver.parse_cohort("[test=ldl, abnormal, status=pending, quarter=2024Q3]") == (
+        'term', [('test', 'LDL'), ('abnormal', True), ('status', 'Pending'),
+                 ('months', (driver.month_number("2024-07"), driver.month_number("2024-09")))])
+    assert driver.parse_cohort("[normal, late, month=2024-01..2024-03, year=2023]") == (
+        'term', [('abnormal', False), ('late', True),
+                 ('months', (driver.month_number("2024-01"), driver.month_number("2024-03"))),
+                 ('months', (driver.month_number("2023-01"), driver.month_number("2023-12")))])
+
+
+def test_and_binds_tighter_than_or():
+    assert driver.parse_cohort("[test=LDL] or [test=BGT] and [test=HGB]") == ('or', LDL, ('and', BGT, HGB))
+    assert driver.parse_cohort("[test=LDL] and [test=BGT] or [test=HGB]") == ('or', ('and', LDL, BGT), HGB)
+
+
+def test_not_binds_tightest():
+    assert driver.parse_cohort("not [test=LDL] and [test=BGT]") == ('and', ('not', LDL), BGT)
+    assert driver.parse_cohort("[test=LDL] and not not [test=BGT]") == ('and', LDL, ('not', ('not', BGT)))
+
+
+def test_parentheses_and_left_associativity():
+    assert driver.parse_cohort("([test=LDL] or [test=BGT]) and [test=HGB]") == ('and', ('or', LDL, BGT), HGB)
+    assert driver.parse_cohort("not ([test=LDL] or [test=BGT])") == ('not', ('or', LDL, BGT))
+    assert driver.parse_cohort("[test=LDL] or [test=BGT] or [test=HGB]") == ('or', ('or', LDL, BGT), HGB)
+    assert driver.parse_cohort("[test=LDL] AND [test=BGT]") == ('and', LDL, BGT)
+
+
+@pytest.mark.parametrize("expression, message", [
+    ("", "Incomplete cohort expression."),
+    ("[test=LDL] and", "Incomplete cohort expression."),
+    ("not", "Incomplete cohort expression."),
+    ("([test=LDL] or [test=BGT]", r"Missing \) in cohort expression."),
+    ("[test=LDL] [test=BGT]", "Unexpected 'term' in cohort expression."),
+    ("[test=LDL])", r"Unexpected '\)' in cohort expression."),
+    ("and [test=LDL]", "Unexpected 'and' in cohort expression."),
+    ("[test=LDL] xor [test=BGT]", r"Unexpected 'xor'; criteria go inside \[...\]."),
+    ("test=LDL", r"Unexpected 'test'; criteria go inside \[...\]."),
+    ("[test=LDL] & [test=BGT]", "Unexpected '&' in cohort expression."),
+    ("[test=LDL", r"Unexpected '\[' in cohort expression."),
+    ("[colour=red]", "Invalid cohort criterion 'colour=red'."),
+    ("[test=]", "Invalid cohort criterion 'test='."),
+    ("[abnormal=yes]", "Invalid cohort criterion 'abnormal=yes'."),
+    ("[status=Lost]", "Invalid Status Lost. Must be one of Pending, Completed, Reviewed."),
+    ("[month=2024-13]", "Invalid month 2024-13. Must be YYYY-MM."),
+    ("[quarter=2024Q5]", "Invalid cohort criterion 'quarter=2024Q5'."),
+    ("[year=24]", "Invalid cohort criterion 'year=24'."),
+])
+def test_errors(expression, message):
+    with pytest.raises(ValueError, match=f"^{message}$"):
+        driver.parse_cohort(expression)
+
+
+def test_queries_match_the_records(records_dir):
+    if driver.np is None:
+        pytest.skip("NumPy is required for cohort queries")
+
+    def patients(expression):
+        return driver.cohort(expression)['patients']
+
+    assert patients("[test=LDL, abnormal]") == ["1000001", "1000004"]
+    assert patients("[test=LDL] and not [test=LDL, abnormal]") == ["1000002"]
+    assert patients("[test=BGT] or [test=systole] and [status=Pending]") == ["1000002", "1000003"]
+    assert patients("[month=2024-04] and not [normal]") == ["1000004"]
+    assert patients("[normal, test=Hgb]") == ["1000001"]
+
+
+def test_tests_without_a_range_are_neither_normal_nor_abnormal(records_dir):
+    if driver.np is None:
+        pytest.skip("NumPy is required for cohort queries")
+    with open(driver.FILE, "a") as file:
+        file.write("1000005: XYZ, 2024-04-01 10:00, 1.0, mg, Completed, 2024-04-01 11:00\n")
+    assert driver.cohort("[test=XYZ]")['patients'] == ["1000005"]
+    assert "1000005" not in driver.cohort("[normal]")['patients']
+    assert "1000005" not in driver.cohort("[abnormal]")['patients']
+
+
+QUERIES = ["[test=LDL, abnormal]", "[test=BGT] and not [normal]", "[status=Pending] or [late]",
+           "[month=2024-01..2024-02]", "[test=HGB, normal]", "not [test=BGT]"]
+
+
+@pytest.mark.parametrize("kind", ['text', 'sqlite', 'partitions'])
+def test_writes_update_the_index_in_place(records_dir, monkeypatch, kind):
+    if driver.np is None:
+        pytest.skip("NumPy is required for cohort queries")
+    if kind == 'sqlite':
+        driver.migrate_to_sqlite("records.db")
+        monkeypatch.setattr(driver, 'storage', driver.SQLiteStorage("records.db"))
+    elif kind == 'partitions':
+        driver.migrate_to_partitions(driver.PARTITION_DIR)
+        monkeypatch.setattr(driver, 'storage', driver.PartitionedStorage(driver.PARTITION_DIR))
+    driver.cohort("[test=LDL]")
+    index = driver.cohorts._index
+    driver.storage.add_records([
+        driver.parse_record("1000005: BGT, 2024-01-10 07:00, 120.0, mg/dL, Pending, "),
+        driver.parse_record("1000002: LDL, 2024-02-10 07:00, 180.0, mg/dL, Completed, 2024-02-10 09:00"),
+    ])
+    [(handle, record)] = driver.storage.find_records(1000004, 'LDL')
+    driver.storage.replace_record(handle, record, driver.record_with_changes(
+        record, {'result': '90.0', 'test_date_time': '2024-01-20 10:00', 'status': 'Pending'}))
+    answers = [driver.cohort(expression) for expression in QUERIES]
+    assert driver.cohorts._index is index
+    monkeypatch.setattr(driver, 'cohorts', driver.CohortCache())
+    assert answers == [driver.cohort(expression) for expression in QUERIES]
+    assert answers[0]['patients'] == ["1000001", "1000002"]
+
+
+def test_writes_by_another_process_drop_the_index(records_dir):
+    if driver.np is None:
+        pytest.skip("NumPy is required for cohort queries")
+    assert driver.cohort("[test=BGT, month=2024-05]")['count'] == 0
+    with open(driver.FILE, "a") as file:
+        file.write("1000003: BGT, 2024-05-05 06:30, 98.0, mg/dL, Completed, 2024-05-05 08:00\n")
+    assert driver.cohort("[test=BGT, month=2024-05]")['patients'] == ["1000003"]
@@ -0,0 +1,53 @@
+import pytest
+
+import driver
+
+np = pytest.importorskip("numpy")
+
+FILTERS = [
+    {},
+    {'abnormal': True},
+    {'status': 'Completed'},
+    {'turnaround': (0, 600)},
+    {'status': 'Completed', 'abnormal': True},
+    {'patient_id': '1000002', 'date_range': ('2024-01-01', '2024-02-28')},
+    {'test_name': 'ldl'},
+]
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_masks_match_the_record_predicates(records_dir, filters):
+    tests = driver.catalog.tests()
+    driver.store.refresh()
+    predicates = driver.record_predicates(filters, tests)
+    expected = [position for position, record in enumerate(driver.store.records)
+                if all(predicate(record) for predicate in predicates)]
+    mask = driver.store.columns(tests).mask(filters)
+    assert np.flatnonzero(mask).tolist() == expected
+
+
+def test_grouped_stats_agree_with_the_accumulators(records_dir):
+    tests = driver.catalog.tests()
+    driver.store.refresh()
+    by_test = {}
+    for record in driver.store.records:
+        stats = by_test.setdefault(record.test_name.upper(), driver.TestStats())
+        stats.add(record.result)
+        test = tests[record.test_name.upper()]
+        if not test['is_normal'](record.result):
+            stats.abnormal += 1
+    expected = [stats.describe(test_name) for test_name, stats in by_test.items()]
+
+    grouped = driver.store.columns(tests).grouped_stats()
+    assert [group['test_name'] for group in grouped] == [group['test_name'] for group in expected]
+    for group, accumulated in zip(grouped, expected):
+        assert group['count'] == accumulated['count']
+        for key in ('mean', 'std', 'p25', 'p50', 'p75', 'p90', 'abnormal_rate'):
+            assert group[key] == pytest.approx(accumulated[key])
+
+
+@pytest.mark.parametrize("values", [[5.0], [3.0, 1.0], [4.0, 9.5, 1.0, 7.25, 7.25, 2.0, 30.0]])
+def test_percentiles_without_numpy_match_numpy(monkeypatch, values):
+    expected = driver.percentiles(values)
+    monkeypatch.setattr(driver, 'np', None)
+    assert driver.percentiles(values) == pytest.approx(expected)
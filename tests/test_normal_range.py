@@ -0,0 +1,52 @@
+import pytest
+
+import driver
+
+
+@pytest.mark.parametrize("spec, bounds", [
+    ("> 13.8, < 17.2", (13.8, False, 17.2, False)),
+    ("< 100", (None, False, 100.0, False)),
+    ("> 70", (70.0, False, None, False)),
+    (">= 70, <= 99", (70.0, True, 99.0, True)),
+    ("<=120", (None, False, 120.0, True)),
+    ("> -5.5, < 0", (-5.5, False, 0.0, False)),
+    ("  >  1 ,  <  2  ", (1.0, False, 2.0, False)),
+])
+def test_valid_ranges(spec, bounds):
+    assert driver.parse_normal_range(spec) == bounds
+
+
+@pytest.mark.parametrize("spec", [
+    "",
+    "100",
+    "=> 70",
+    "> seventy",
+    "> 70,",
+    "> 1e3",
+    "__import__('os').system('true')",
+    "> 70 and < 99",
+])
+def test_invalid_ranges(spec):
+    with pytest.raises(ValueError, match="Invalid normal range"):
+        driver.parse_normal_range(spec)
+
+
+@pytest.mark.parametrize("spec, normal, abnormal", [
+    ("> 13.8, < 17.2", [13.9, 17.1], [13.8, 17.2, 5.0]),
+    (">= 70, <= 99", [70.0, 99.0, 85.0], [69.9, 99.1]),
+    ("< 100", [-1.0, 99.9], [100.0, 250.0]),
+    ("> 70", [70.1, 1e9], [70.0, 0.0]),
+])
+def test_compiled_range_bounds(spec, normal, abnormal):
+    is_normal = driver.compile_normal_range(spec)
+    assert all(is_normal(value) for value in normal)
+    assert not any(is_normal(value) for value in abnormal)
+
+
+def test_test_with_invalid_range_has_no_predicate(tmp_path, capsys):
+    test_file = tmp_path / "medicalTest.txt"
+    test_file.write_text("LDL, < 100, mg/dL, 00-12-06\nBAD, ~ 5, mg/dL, 00-12-06\n")
+    tests = driver.TestCatalog(str(test_file)).tests()
+    assert tests['LDL']['is_normal'](99.0) and not tests['LDL']['is_normal'](100.0)
+    assert tests['BAD']['is_normal'] is None
+    assert "Unrecognised normal range for BAD" in capsys.readouterr().out
@@ -0,0 +1,50 @@
+import pytest
+
+import driver
+
+FILTERS = [
+    {},
+    {'abnormal': True},
+    {'test_name': 'LDL'},
+    {'status': 'Completed', 'turnaround': (0, 600)},
+    {'date_range': ('2024-02-01', '2024-03-31')},
+]
+
+
+def report(capsys, filters, limit, workers):
+    summary = driver.collect_summary(filters, limit, workers, emit=driver.filtered_row_printer())
+    driver.print_summary_statistics(summary)
+    return capsys.readouterr().out
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+@pytest.mark.parametrize("limit", [None, 2])
+def test_parallel_report_matches_serial(records_dir, capsys, filters, limit):
+    serial = report(capsys, filters, limit, None)
+    parallel = report(capsys, filters, limit, 2)
+    assert parallel == serial
+
+
+def test_chunks_cover_the_file_on_line_boundaries(records_dir):
+    data = (records_dir / driver.FILE).read_bytes()
+    ranges = driver.split_file(driver.FILE, 7)
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(data)
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start
+        assert data[end - 1:end] == b"\n"
+
+
+def test_running_stats_merge_is_order_independent():
+    values = [0.1] * 10 + [1e16, 1.0, -1e16]
+    whole = driver.RunningStats()
+    for value in values:
+        whole.add(value)
+    merged = driver.RunningStats()
+    for part in (values[8:], values[:3], values[3:8]):
+        stats = driver.RunningStats()
+        for value in part:
+            stats.add(value)
+        merged.merge(stats)
+    assert merged.count == whole.count
+    assert merged.total() == whole.total() == pytest.approx(2.0)
+    assert (merged.minimum, merged.maximum) == (whole.minimum, whole.maximum)
@@ -0,0 +1,151 @@
+import pytest
+
+import driver
+
+from conftest import RECORD_LINES
+
+
+def file_records(path):
+    """The records a fresh parse of the file at path finds, in file order."""
+    return [driver.parse_record(line).fields()
+            for line in path.read_text().splitlines() if line.strip()]
+
+
+def test_shorter_update_is_written_in_place(records_dir):
+    path = records_dir / driver.FILE
+    size = path.stat().st_size
+    store = driver.store
+    position = store.find(1000001, 'ldl')[0]
+    old = store.records[position]
+    new = driver.MedicalRecord(old.patient_id, old.test_name, old.test_time, 99.0, old.unit,
+                               old.status, old.results_time)
+    store.replace(store.locate(position, old), new)
+
+    assert path.stat().st_size == size
+    lines = path.read_text().splitlines()
+    assert lines[1].rstrip() == new.format()
+    assert len(lines[1]) == len(RECORD_LINES[1])
+    # Only the blank line of the fixture is dead
+    assert store.dead_bytes == 1
+    assert file_records(path) == [record.fields() for record in store.records]
+
+
+def test_longer_update_blanks_the_old_line_and_appends(records_dir):
+    path = records_dir / driver.FILE
+    store = driver.store
+    position = store.find(1000002, 'LDL')[0]
+    old = store.records[position]
+    new = driver.MedicalRecord(old.patient_id, old.test_name, old.test_time, 95.5, old.unit,
+                               'Completed', old.test_time + 600)
+    store.replace(store.locate(position, old), new)
+
+    lines = path.read_text().splitlines()
+    assert lines[3].strip() == ''
+    assert lines[-1] == new.format()
+    assert store.dead_bytes == 1 + len(RECORD_LINES[3]) + 1
+    assert store.find(1000002, 'ldl') == [position]
+    assert sorted(file_records(path)) == sorted(record.fields() for record in store.records)
+
+
+def test_replace_line_moves_even_a_shorter_line_to_another_file(tmp_path):
+    source, target = tmp_path / "2024-01.txt", tmp_path / "2024-02.txt"
+    source.write_bytes(b"first line\nsecond line\n")
+    target.write_bytes(b"other")
+    assert driver.replace_line(str(source), 11, 11, b"short") is None
+    assert driver.replace_line(str(source), 0, 10, b"moved", str(target)) == 6
+    assert source.read_bytes() == b"          \nshort      \n"
+    assert target.read_bytes() == b"other\nmoved\n"
+
+
+def test_compact_drops_blank_lines_and_keeps_positions(records_dir):
+    path = records_dir / driver.FILE
+    store = driver.store
+    position = store.find(1000002, 'LDL')[0]
+    old = store.records[position]
+    new = driver.MedicalRecord(old.patient_id, old.test_name, old.test_time, 95.5, old.unit,
+                               'Completed', old.test_time + 600)
+    store.replace(store.locate(position, old), new)
+    store.compact()
+
+    lines = path.read_text().splitlines()
+    assert all(line.strip() for line in lines)
+    assert len(lines) == len(store.records) == 10
+    assert store.dead_bytes == 0
+    for position, record in enumerate(store.records):
+        assert store.line_at(position).decode() == record.format().rstrip()
+    # The file was written by the store itself, so it is not re-read
+    assert store.is_current()
+
+
+def test_locate_follows_a_record_moved_by_another_writer(records_dir):
+    store = driver.store
+    position = store.find(1000001, 'LDL')[0]
+    old = store.records[position]
+    path = records_dir / driver.FILE
+    path.write_text("\n".join(RECORD_LINES[1:]) + "\n")
+
+    assert store.locate(position, old) == 0
+
+
+def test_locate_rejects_a_record_changed_by_another_writer(records_dir):
+    store = driver.store
+    position = store.find(1000001, 'LDL')[0]
+    old = store.records[position]
+    path = records_dir / driver.FILE
+    path.write_text(path.read_text().replace("130.0", "131.0"))
+
+    with pytest.raises(driver.RecordChangedError):
+        store.locate(position, old)
+
+
+def menu_update(monkeypatch, patient_id, test_name, while_prompting):
+    """Run the menu's update_record, calling while_prompting(old_record) in place of the prompts."""
+    answers = iter([patient_id, test_name])
+    monkeypatch.setattr("builtins.input", lambda prompt="": next(answers))
+    monkeypatch.setattr(driver, 'prompt_record_update', while_prompting)
+    driver.update_record()
+
+
+def test_menu_update_holds_no_lock_while_prompting(records_dir, monkeypatch, capsys):
+    path = records_dir / driver.FILE
+
+    def another_writer(record):
+        # Another process could not write if the lock were held here
+        assert driver.store.lock._depth == 0
+        path.write_text("\n".join(RECORD_LINES[2:] + RECORD_LINES[:2]) + "\n")
+        return driver.record_with_changes(record, {'result': '99.0'})
+
+    menu_update(monkeypatch, "1000001", "ldl", another_writer)
+    assert capsys.readouterr().out.strip() == "Record updated successfully."
+    assert [line.rstrip() for line in path.read_text().splitlines()][-1] == RECORD_LINES[1].replace("130.0", "99.0")
+
+
+def test_menu_update_reports_a_record_changed_while_prompting(records_dir, monkeypatch, capsys):
+    path = records_dir / driver.FILE
+
+    def another_writer(record):
+        path.write_text(path.read_text().replace("130.0", "131.0"))
+        return driver.record_with_changes(record, {'result': '99.0'})
+
+    menu_update(monkeypatch, "1000001", "LDL", another_writer)
+    assert "was changed or removed by someone else" in capsys.readouterr().out
+    assert "131.0" in path.read_text() and "99.0" not in path.read_text()
+
+
+@pytest.mark.parametrize("patient_id", ["-1", "10000000", "99999999999"])
+def test_patient_ids_outside_seven_digits_are_rejected(patient_id):
+    with pytest.raises(ValueError, match="Must be a 7-digit integer"):
+        driver.parse_record(f"{patient_id}: Hgb, 2024-01-05 08:00, 12.5, g/dL, Completed, 2024-01-05 10:30")
+
+
+def test_record_table_holds_more_than_65536_strings():
+    table = driver.RecordTable()
+    records = [driver.MedicalRecord(1000000 + i % 10, f"T{i}", 28000000 + i, float(i), f"U{i}", "Completed", None)
+               for i in range(40000)]
+    for record in records:
+        table.append(record)
+    assert len(table.strings) > 1 << 16
+    assert [table[i].fields() for i in (0, 39999)] == [records[i].fields() for i in (0, 39999)]
+    if driver.np is not None:
+        columns = table.columns({})
+        assert columns.test_names[columns.test_code[-1]] == "T39999"
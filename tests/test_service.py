@@ -0,0 +1,65 @@
+import asyncio
+import json
+
+import driver
+
+
+def exchange(lines):
+    """Send request lines to a RecordService over a Unix socket and return its replies."""
+    async def run():
+        service = driver.RecordService()
+        server_task = asyncio.create_task(service.serve(socket_path="service.sock"))
+        while service.lock is None:
+            await asyncio.sleep(0.01)
+        for _ in range(100):
+            try:
+                reader, writer = await asyncio.open_unix_connection("service.sock")
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                await asyncio.sleep(0.01)
+        replies = []
+        for line in lines:
+            writer.write((line + "\n").encode())
+            await writer.drain()
+            replies.append(json.loads(await reader.readline()))
+        writer.close()
+        server_task.cancel()
+        return replies
+
+    return asyncio.run(run())
+
+
+def test_query_add_and_update(records_dir):
+    new_record = {'op': 'add', 'patient_id': '1000005', 'test_name': 'hgb', 'test_date_time': '2024-05-01 08:00',
+                  'result': 14.0, 'unit': 'g/dL', 'status': 'Completed', 'results_date_time': '2024-05-01 09:00'}
+    update = {'op': 'update', 'patient_id': '1000002', 'test_name': 'BGT', 'changes': {'result': '70.5'}}
+    added, duplicate, updated, result = exchange([
+        json.dumps(new_record),
+        json.dumps(new_record),
+        json.dumps(update),
+        json.dumps({'op': 'query', 'test_name': 'BGT'}),
+    ])
+    assert added['ok'] and added['record']['test_name'] == 'HGB'
+    assert duplicate == {'ok': False, 'error': "Duplicate of an existing record"}
+    assert updated['ok'] and updated['records'][0]['result'] == 70.5
+    assert result['ok'] and result['count'] == 2
+    assert sorted(record['result'] for record in result['records']) == [70.5, 101.0]
+    assert "1000005: HGB, 2024-05-01 08:00, 14.0, g/dL, Completed, 2024-05-01 09:00" in \
+        (records_dir / driver.FILE).read_text()
+
+
+def test_malformed_requests_get_an_error_reply(records_dir):
+    replies = exchange([
+        "not json",
+        "[1, 2]",
+        json.dumps({'op': 'delete'}),
+        json.dumps({'op': 'query', 'test_name': 5}),
+        json.dumps({'op': 'update', 'test_name': 'BGT'}),
+        json.dumps({'op': 'query', 'patient_id': '1000002'}),
+    ])
+    assert [reply['ok'] for reply in replies] == [False, False, False, False, False, True]
+    assert replies[1]['error'] == "A request must be a JSON object."
+    assert replies[2]['error'] == "Unknown op 'delete'. Must be query, cohort, timeline, add or update."
+    assert replies[3]['error'] == "test_name must be a string."
+    assert replies[4]['error'] == "Missing field 'patient_id'."
+    assert replies[5]['count'] == 3
@@ -0,0 +1,75 @@
+import pytest
+
+import driver
+
+FILTERS = [
+    {},
+    {'test_name': 'LDL'},
+    {'patient_id': '1000002'},
+    {'abnormal': True},
+    {'date_range': ('2024-02-01', '2024-03-31')},
+    {'status': 'Completed'},
+    {'turnaround': (0, 300)},
+    {'late': True},
+    {'test_name': 'Hgb', 'abnormal': True, 'date_range': ('2024-01-01', '2024-12-31')},
+    {'patient_id': '1000009'},
+]
+
+
+def use_storage(kind, monkeypatch):
+    if kind == 'sqlite':
+        driver.migrate_to_sqlite("records.db")
+        monkeypatch.setattr(driver, 'storage', driver.SQLiteStorage("records.db"))
+    elif kind == 'partitions':
+        driver.migrate_to_partitions(driver.PARTITION_DIR)
+        monkeypatch.setattr(driver, 'storage', driver.PartitionedStorage(driver.PARTITION_DIR))
+    elif kind == 'loaded text':
+        driver.store.refresh()
+
+
+def rounded(value):
+    if isinstance(value, float):
+        return round(value, 9)
+    if isinstance(value, dict):
+        return {key: rounded(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [rounded(item) for item in value]
+    return value
+
+
+def report(filters):
+    """What a query reports, in a form that does not depend on the storage's row order."""
+    summary = driver.collect_summary(filters)
+    result = driver.QueryResult(filters, summary).to_dict()
+    tests = {group['test_name']: group for group in result.pop('tests')}
+    result['records'] = sorted(record.format() for record in summary.rows)
+    return rounded(result), rounded(tests)
+
+
+@pytest.mark.parametrize("kind", ['loaded text', 'sqlite', 'partitions'])
+def test_storages_agree_with_the_text_file(records_dir, monkeypatch, kind):
+    expected = [report(filters) for filters in FILTERS]
+    use_storage(kind, monkeypatch)
+    for filters, (expected_result, expected_tests) in zip(FILTERS, expected):
+        result, tests = report(filters)
+        assert result == expected_result, filters
+        assert tests == expected_tests, filters
+
+
+def test_expected_matches(records_dir):
+    counts = [report(filters)[0]['count'] for filters in FILTERS]
+    assert counts == [10, 3, 3, 6, 5, 6, 4, 4, 2, 0]
+
+
+@pytest.mark.parametrize("kind", ['text', 'sqlite', 'partitions'])
+def test_updates_are_seen_by_every_storage(records_dir, monkeypatch, kind):
+    use_storage(kind, monkeypatch)
+    storage = driver.storage
+    [(handle, record)] = storage.find_records(1000002, 'bgt')
+    updated = driver.record_with_changes(record, {'result': '70.5', 'test_date_time': '2024-05-20 07:15',
+                                                  'results_date_time': '2024-05-20 09:00'})
+    storage.replace_record(handle, record, updated)
+    assert [found.format() for _, found in storage.find_records(1000002, 'BGT')] == [updated.format()]
+    with pytest.raises(driver.RecordChangedError):
+        storage.replace_record(handle, record, updated)
+    assert report({'date_range': ('2024-05-01', '2024-05-31')})[0]['records'] == [updated.format()]
@@ -0,0 +1,61 @@
+import pytest
+
+import driver
+
+
+def use_storage(kind, monkeypatch):
+    if kind == 'sqlite':
+        driver.migrate_to_sqlite("records.db")
+        monkeypatch.setattr(driver, 'storage', driver.SQLiteStorage("records.db"))
+    elif kind == 'partitions':
+        driver.migrate_to_partitions(driver.PARTITION_DIR)
+        monkeypatch.setattr(driver, 'storage', driver.PartitionedStorage(driver.PARTITION_DIR))
+
+
+def comparable(timeline):
+    """timeline.to_dict() with the slopes, which are kept as running sums, rounded."""
+    result = timeline.to_dict()
+    for series in result['tests'].values():
+        if series['slope_per_day'] is not None:
+            series['slope_per_day'] = round(series['slope_per_day'], 9)
+    return result
+
+
+def test_trend_figures(records_dir):
+    driver.storage.add_records([
+        driver.parse_record("1000004: LDL, 2024-03-22 10:00, 150.0, mg/dL, Completed, 2024-03-22 12:00"),
+        driver.parse_record("1000004: LDL, 2024-03-24 10:00, 90.0, mg/dL, Completed, 2024-03-24 12:00"),
+    ])
+    series = driver.timelines.get(1000004).to_dict('ldl')['tests']['LDL']
+    assert series['count'] == 3
+    assert series['latest'] == 90.0
+    assert series['moving_average'] == pytest.approx(400.0 / 3)
+    assert series['slope_per_day'] == pytest.approx(-17.5)
+    assert series['deltas'] == [-10.0, -60.0]
+    assert (series['abnormal_streak'], series['longest_abnormal_streak']) == (0, 2)
+    assert [point['abnormal'] for point in series['points']] == [True, True, False]
+
+
+@pytest.mark.parametrize("kind", ['text', 'sqlite', 'partitions'])
+def test_own_writes_update_the_cached_timeline(records_dir, monkeypatch, kind):
+    use_storage(kind, monkeypatch)
+    timeline = driver.timelines.get(1000002)
+    driver.storage.add_records([
+        driver.parse_record("1000002: BGT, 2024-01-10 07:00, 120.0, mg/dL, Completed, 2024-01-10 09:00"),
+        driver.parse_record("1000002: BGT, 2024-05-01 07:00, 90.0, mg/dL, Completed, 2024-05-01 09:00"),
+    ])
+    [(handle, record)] = [(handle, record) for handle, record in driver.storage.find_records(1000002, 'BGT')
+                          if record.result == 85.0]
+    driver.storage.replace_record(handle, record, driver.record_with_changes(record, {'result': '60.0'}))
+    assert driver.timelines.get(1000002) is timeline
+    assert comparable(timeline) == comparable(driver.TimelineCache().get(1000002))
+    assert [point['result'] for point in timeline.to_dict('BGT')['tests']['BGT']['points']] == [120.0, 60.0, 90.0]
+
+
+def test_writes_by_another_process_drop_the_cache(records_dir):
+    timeline = driver.timelines.get(1000003)
+    with open(driver.FILE, "a") as file:
+        file.write("1000003: BGT, 2024-03-05 06:30, 98.0, mg/dL, Completed, 2024-03-05 08:00\n")
+    fresh = driver.timelines.get(1000003)
+    assert fresh is not timeline
+    assert fresh.to_dict()['tests']['BGT']['count'] == 2
@@ -0,0 +1,61 @@
+import calendar
+import datetime
+
+import pytest
+
+import driver
+
+
+def strptime_minutes(date_time):
+    parsed = datetime.datetime.strptime(date_time, driver.DATE_TIME_FORMAT)
+    return calendar.timegm(parsed.timetuple()) // 60
+
+
+@pytest.mark.parametrize("date_time", [
+    "1970-01-01 00:00",
+    "1969-12-31 23:59",
+    "2024-02-29 12:30",
+    "2023-12-31 23:59",
+    "2000-03-01 00:01",
+    "9999-12-31 23:59",
+    "2024-1-5 8:05",
+])
+def test_slicing_matches_strptime(date_time):
+    assert driver.to_epoch_minutes(date_time) == strptime_minutes(date_time)
+
+
+def test_every_minute_of_a_leap_day_matches_strptime():
+    for minute in range(0, 1440, 7):
+        date_time = f"2024-02-29 {minute // 60:02d}:{minute % 60:02d}"
+        assert driver.to_epoch_minutes(date_time) == strptime_minutes(date_time)
+
+
+@pytest.mark.parametrize("date_time", [
+    "2023-02-29 10:00",
+    "2024-13-01 10:00",
+    "2024-04-31 10:00",
+    "2024-01-01 24:00",
+    "2024-01-01 10:60",
+    "2024-01-01 1a:00",
+    "2024-01-01T10:00",
+    "2024/01/01 10:00",
+    "2024-01-01",
+    "",
+])
+def test_invalid_timestamps_are_rejected_like_strptime(date_time):
+    with pytest.raises(ValueError):
+        strptime_minutes(date_time)
+    with pytest.raises(ValueError):
+        driver.to_epoch_minutes(date_time)
+
+
+@pytest.mark.parametrize("date_time", ["1970-01-01 00:00", "1969-12-31 23:59", "2024-02-29 12:30"])
+def test_format_round_trips(date_time):
+    assert driver.format_epoch_minutes(driver.to_epoch_minutes(date_time)) == date_time
+
+
+def test_is_future_date_accepts_dates_and_date_times():
+    now = driver.current_epoch_minutes()
+    assert not driver.is_future_date("2024-01-01", now)
+    assert not driver.is_future_date("2024-01-01 10:00", now)
+    assert driver.is_future_date("2999-01-01", now)